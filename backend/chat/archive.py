@@ -0,0 +1,362 @@
+# chat/archive.py
+"""
+Холодный архив сообщений неактивных комнат: zstd-сегменты на локальном диске.
+
+Раскладка (CHAT_ARCHIVE_DIR/<room_id>/):
+  000001.zst — append-only сегмент: подряд идущие независимые zstd-кадры (блоки),
+               в блоке до BLOCK_ROWS сообщений NDJSON, по возрастанию (created_at, id);
+  000001.idx — разреженный индекс: на каждый блок одна запись фиксированного размера
+               (первый/последний created_at в мкс, смещение, длина, число строк).
+Сегмент закрывается по размеру (CHAT_ARCHIVE_SEGMENT_BYTES), дальше пишется следующий.
+
+Инвариант: архив комнаты целиком старше её горячих строк (архивируем от старых к новым и
+ничего старше порога в БД не оставляем). Поэтому лента (MessageViewSet) просто продолжает
+листать в архив, когда курсор выходит за горячий диапазон. Chat.last_message может указывать
+на архивную строку — превью диалога тогда берётся из архива (latest_message).
+
+Чтение — через mmap: индекс ищется бинарным поиском, распаковываются только нужные блоки.
+Порядок записи: блоки + fsync -> индекс + fsync -> удаление строк из БД. После сбоя между
+последними шагами строки остаются и в БД, и в архиве — следующий запуск удаляет из БД те из них,
+чьи id есть в архиве. Комнату одновременно архивирует только один запуск (advisory-блокировка).
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from uuid import UUID
+
+import zstandard
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from .models import HiddenMessage, Message
+from .services import history_watermark
+
+BLOCK_ROWS = 256
+INDEX_RECORD = struct.Struct("<qqQII")  # first_us, last_us, offset, length, count
+
+# поля, которые уходят в архив (search_vector — генерируемый, не храним)
+ARCHIVE_FIELDS = (
+    "id", "room_id", "author_id", "display_name", "content", "attachment", "attachment_type",
+    "attachment_name", "reply_to_id", "expires_at", "created_at", "edited_at", "deleted_at", "meta",
+)
+_DATETIME_FIELDS = ("expires_at", "created_at", "edited_at", "deleted_at")
+
+MAX_US = (1 << 63) - 1
+ARCHIVE_LOCK = 0x63617263  # пространство ключей pg_advisory_lock(ключ, room_id) архиватора
+
+
+def archive_root() -> Path:
+    return Path(getattr(settings, "CHAT_ARCHIVE_DIR", Path(settings.BASE_DIR) / "archive"))
+
+
+def _segment_limit() -> int:
+    return int(getattr(settings, "CHAT_ARCHIVE_SEGMENT_BYTES", 64 * 2**20))
+
+
+def _level() -> int:
+    return int(getattr(settings, "CHAT_ARCHIVE_ZSTD_LEVEL", 9))
+
+
+def to_us(dt: datetime) -> int:
+    delta = dt - datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_us(us: int) -> datetime:
+    return datetime.fromtimestamp(us // 1_000_000, tz=dt_timezone.utc).replace(microsecond=us % 1_000_000)
+
+
+# ---------- позиция курсора по архиву: "<created_at мкс>.<id>" ----------
+
+def encode_position(us: int, message_id) -> str:
+    return f"{us}.{message_id}"
+
+
+def decode_position(token: str) -> Optional[tuple[int, str]]:
+    us, _, mid = (token or "").partition(".")
+    try:
+        return int(us), str(UUID(mid)) if mid else ""
+    except ValueError:
+        return None
+
+
+# ---------- сегменты ----------
+
+def _room_dir(room_id: int) -> Path:
+    return archive_root() / str(int(room_id))
+
+
+def _segments(room_id: int) -> list[Path]:
+    d = _room_dir(room_id)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob("*.zst"))
+
+
+def _read_index(idx_path: Path) -> list[tuple[int, int, int, int, int]]:
+    size = idx_path.stat().st_size if idx_path.exists() else 0
+    if size < INDEX_RECORD.size:
+        return []
+    with open(idx_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        n = size // INDEX_RECORD.size  # хвост от незавершённой записи игнорируем
+        return [INDEX_RECORD.unpack_from(mm, i * INDEX_RECORD.size) for i in range(n)]
+
+
+def has_archive(room_id: int) -> bool:
+    return bool(_segments(room_id))
+
+
+def _encode_row(row: dict) -> bytes:
+    # DjangoJSONEncoder режет время до миллисекунд — позиции курсора нужны микросекунды
+    row = {k: (v.isoformat() if k in _DATETIME_FIELDS and v else v) for k, v in row.items()}
+    return json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _decode_row(line: bytes) -> dict:
+    row = json.loads(line)
+    for name in _DATETIME_FIELDS:
+        if row.get(name):
+            row[name] = parse_datetime(row[name])
+    return row
+
+
+def iter_archived_desc(room_id: int, before_us: int = MAX_US, before_id: str = "") -> Iterator[dict]:
+    """Архивные строки комнаты строго старше (before_us, before_id), от новых к старым."""
+    decompressor = zstandard.ZstdDecompressor()
+    for seg in reversed(_segments(room_id)):
+        entries = _read_index(seg.with_suffix(".idx"))
+        if not entries:
+            continue
+        # последний блок, который может содержать строки <= before_us
+        start = bisect_left([e[0] for e in entries], before_us + 1) - 1
+        if start < 0:
+            continue
+        with open(seg, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for first_us, last_us, offset, length, count in reversed(entries[: start + 1]):
+                raw = decompressor.decompress(mm[offset: offset + length])
+                for line in reversed(raw.splitlines()):
+                    row = _decode_row(line)
+                    key = (to_us(row["created_at"]), row["id"])  # uuid-строки сравниваются как uuid
+                    if key < (before_us, before_id):
+                        yield row
+
+
+def latest_message(room_id: int) -> Optional[Message]:
+    """Самое новое архивное сообщение комнаты (как Message, не из БД) — для превью диалога."""
+    row = next(iter_archived_desc(room_id), None)
+    return _to_instance(row) if row else None
+
+
+def iter_archived_blocks(room_id: int) -> Iterator[list[dict]]:
+    """Архив комнаты от старых к новым, поблочно (по BLOCK_ROWS строк) — для экспорта."""
+    decompressor = zstandard.ZstdDecompressor()
+    for seg in _segments(room_id):
+        entries = _read_index(seg.with_suffix(".idx"))
+        if not entries:
+            continue
+        with open(seg, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for _first, _last, offset, length, _count in entries:
+                raw = decompressor.decompress(mm[offset: offset + length])
+                yield [_decode_row(line) for line in raw.splitlines()]
+
+
+def _to_instance(row: dict) -> Message:
+    msg = Message(**{k: row.get(k) for k in ARCHIVE_FIELDS if k != "attachment"})
+    msg.attachment.name = row.get("attachment") or None
+    msg.id = UUID(row["id"])
+    return msg
+
+
+def read_page(
+    room_id: int, user, position: Optional[tuple[int, str]], limit: int
+) -> tuple[list[Message], Optional[tuple[int, str]]]:
+    """
+    До limit архивных сообщений старше position (None — с самого нового), как Message (не из БД),
+    и позиция для следующей страницы (None — архив кончился).
+    Учитываются deleted_at, cleared_before и HiddenMessage пользователя.
+    """
+    before_us, before_id = position or (MAX_US, "")
+    cleared_us = None
+    authenticated = bool(user and getattr(user, "is_authenticated", False))
+    if authenticated:
+        cleared = history_watermark(user, room_id)
+        cleared_us = to_us(cleared) if cleared else None
+
+    scanned: list[dict] = []
+    stopped_early = False
+    for row in iter_archived_desc(room_id, before_us, before_id):
+        if cleared_us is not None and to_us(row["created_at"]) <= cleared_us:
+            break  # дальше только старше водяного знака
+        scanned.append(row)
+        if len(scanned) >= limit * 2:  # запас под удалённые/скрытые
+            stopped_early = True
+            break
+
+    visible = [r for r in scanned if not r.get("deleted_at")]
+    if authenticated and visible:
+        hidden = {
+            str(mid) for mid in HiddenMessage.objects.filter(
+                user=user, message_id__in=[r["id"] for r in visible]
+            ).values_list("message_id", flat=True)
+        }
+        visible = [r for r in visible if r["id"] not in hidden]
+
+    def _pos(r):
+        return to_us(r["created_at"]), r["id"]
+
+    if len(visible) > limit:
+        visible = visible[:limit]
+        next_position = _pos(visible[-1])
+    else:
+        next_position = _pos(scanned[-1]) if stopped_early else None
+
+    messages = [_to_instance(r) for r in visible]
+    authors = get_user_model().objects.in_bulk({m.author_id for m in messages if m.author_id})
+    for m in messages:
+        if m.author_id in authors:
+            m.author = authors[m.author_id]
+        else:
+            m.author_id = None
+    return messages, next_position
+
+
+# ---------- запись ----------
+
+class SegmentWriter:
+    """Дописывает блоки в текущий сегмент комнаты (с переходом на новый по размеру)."""
+
+    def __init__(self, room_id: int):
+        self.dir = _room_dir(room_id)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        segs = sorted(self.dir.glob("*.zst"))
+        self.seg = segs[-1] if segs else self.dir / "000001.zst"
+        self.compressor = zstandard.ZstdCompressor(level=_level())
+
+    def _rotate_if_needed(self) -> None:
+        if self.seg.exists() and self.seg.stat().st_size >= _segment_limit():
+            self.seg = self.dir / f"{int(self.seg.stem) + 1:06d}.zst"
+
+    def append(self, rows: list[dict]) -> None:
+        self._rotate_if_needed()
+        index = []
+        with open(self.seg, "ab") as f:
+            offset = f.tell()
+            for i in range(0, len(rows), BLOCK_ROWS):
+                block = rows[i: i + BLOCK_ROWS]
+                payload = b"\n".join(_encode_row(r) for r in block)
+                frame = self.compressor.compress(payload)
+                f.write(frame)
+                index.append(INDEX_RECORD.pack(
+                    to_us(block[0]["created_at"]), to_us(block[-1]["created_at"]), offset, len(frame), len(block)
+                ))
+                offset += len(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.seg.with_suffix(".idx"), "ab") as f:
+            f.write(b"".join(index))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class RoomBusy(Exception):
+    """Комнату уже архивирует другой процесс (держит advisory-блокировку)."""
+
+
+def last_position(room_id: int) -> Optional[tuple[int, str]]:
+    """(created_at в мкс, id) самого нового заархивированного сообщения комнаты."""
+    row = next(iter_archived_desc(room_id), None)
+    return (to_us(row["created_at"]), row["id"]) if row else None
+
+
+def _archived_ids_since(room_id: int, since_us: int) -> set[str]:
+    ids = set()
+    for row in iter_archived_desc(room_id):
+        if to_us(row["created_at"]) < since_us:
+            break
+        ids.add(row["id"])
+    return ids
+
+
+def archive_room(room_id: int, older_than: datetime, *, batch: int = 5000) -> int:
+    """
+    Переносит все сообщения комнаты старше older_than в архив и удаляет их из БД (без каскадов:
+    HiddenMessage, ссылки reply_to и Chat.last_message продолжают указывать на id архивных
+    сообщений). Возвращает число перенесённых строк; RoomBusy — комнату архивирует другой запуск.
+    """
+    with connection.cursor() as cur:
+        # два запуска не должны дописывать один сегмент и чистить строки друг друга
+        cur.execute("SELECT pg_try_advisory_lock(%s, %s)", [ARCHIVE_LOCK, int(room_id)])
+        if not cur.fetchone()[0]:
+            raise RoomBusy(room_id)
+    try:
+        return _archive_room(room_id, older_than, batch)
+    finally:
+        with connection.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s, %s)", [ARCHIVE_LOCK, int(room_id)])
+
+
+def _archive_room(room_id: int, older_than: datetime, batch: int) -> int:
+    writer = SegmentWriter(room_id)
+    moved = 0
+    after = last_position(room_id)
+
+    if after is not None:
+        # дочистка после сбоя: строки, записанные в сегмент, но не удалённые из БД. Удаляем только
+        # id, которые действительно есть в архиве: если сбой пришёлся между пачками, разрезавшими
+        # одинаковый created_at, часть строк на этой метке в сегмент ещё не попала.
+        with connection.cursor() as cur:
+            cur.execute(
+                "SELECT id, created_at FROM chat_message WHERE room_id = %s AND (created_at, id) <= (%s, %s::uuid)",
+                [room_id, from_us(after[0]), after[1]],
+            )
+            leftover = {str(mid): created_at for mid, created_at in cur.fetchall()}
+        if leftover:
+            archived = _archived_ids_since(room_id, to_us(min(leftover.values())))
+            with connection.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM chat_message WHERE room_id = %s AND id = ANY(%s::uuid[])",
+                    [room_id, [mid for mid in leftover if mid in archived]],
+                )
+
+    cols = ", ".join(ARCHIVE_FIELDS)
+    while True:
+        # только строки новее архива: сегменты должны оставаться упорядоченными по (created_at, id)
+        where, params = "room_id = %s AND created_at < %s", [room_id, older_than]
+        if after is not None:
+            where += " AND (created_at, id) > (%s, %s::uuid)"
+            params += [from_us(after[0]), after[1]]
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT {cols} FROM chat_message WHERE {where} ORDER BY created_at, id LIMIT %s",
+                params + [batch],
+            )
+            rows = [dict(zip(ARCHIVE_FIELDS, r)) for r in cur.fetchall()]
+        if not rows:
+            break
+        for r in rows:
+            r["id"] = str(r["id"])
+            r["reply_to_id"] = str(r["reply_to_id"]) if r["reply_to_id"] else None
+            if isinstance(r["meta"], str):
+                r["meta"] = json.loads(r["meta"])
+        writer.append(rows)
+        with connection.cursor() as cur:
+            cur.execute(
+                "DELETE FROM chat_message WHERE room_id = %s AND created_at >= %s AND created_at <= %s "
+                "AND id = ANY(%s::uuid[])",
+                [room_id, rows[0]["created_at"], rows[-1]["created_at"], [r["id"] for r in rows]],
+            )
+        moved += len(rows)
+        after = (to_us(rows[-1]["created_at"]), rows[-1]["id"])
+        if len(rows) < batch:
+            break
+    return moved
@@ -0,0 +1,99 @@
+# chat/async_views.py
+"""
+Async-списки для горячих GET (config/async_api.py): лента комнаты и список диалогов.
+
+  GET /api/messages/?room=<id>  — MessageViewSet.list
+  GET /api/conversations/       — ConversationsViewSet.list
+
+Запросы, выборка и сериализация — те же, что у DRF-представлений, но через async ORM;
+ETag/304 — те же валидаторы (chat/versioning.py), версии читаются через aget кэша;
+чтения — с реплики, как у DRF-списков (config/replicas.py).
+Лента без ?room=, архивные страницы и анонимный список диалогов (401) — DRF-представления.
+"""
+from __future__ import annotations
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response
+
+from config import replicas
+from config.async_api import async_list, json_response
+from config.replicas import replica_reads
+
+from . import archive
+from .blocks import exclude_blocked_chats
+from .models import Chat, ChatParticipant, ChatType, Message
+from .serializers import ConversationSerializer, MessageSerializer
+from .services import avisible_messages
+from .versioning import aroom_version, auser_version, list_etag, set_validators
+from .views import ConversationsViewSet, MessageCursorPagination, MessageViewSet
+
+
+async def _conditional(request, versions: list[int], build):
+    etag = list_etag(request, versions)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if replicas.changed_recently(max(versions)):
+            with replicas.primary():
+                response = await build()
+        else:
+            response = await build()
+    return set_validators(response, etag)
+
+
+@async_list(MessageViewSet.as_view({"get": "list", "post": "create"}))
+@replica_reads
+async def message_list(request):
+    params = request.query_params
+    room_id = params.get("room")
+    if not room_id or not room_id.isdigit() or MessageCursorPagination.archive_query_param in params:
+        return None
+    room_id = int(room_id)
+    user = request.user
+
+    versions = [await aroom_version(room_id)]
+    if user.is_authenticated:
+        versions.append(await auser_version(user.id))
+
+    async def build():
+        qs = Message.objects.select_related("author").filter(deleted_at__isnull=True, room_id=room_id)
+        if user.is_authenticated:
+            qs = await avisible_messages(qs, user, room_id)
+        paginator = MessageCursorPagination()
+        page = await paginator.apaginate_queryset(qs.order_by("-created_at"), request, room_id)
+        data = MessageSerializer(page, many=True, context={"request": request}).data
+        return json_response(paginator.get_paginated_response(data).data)
+
+    return await _conditional(request, versions, build)
+
+
+@async_list(ConversationsViewSet.as_view({"get": "list", "post": "create"}))
+@replica_reads
+async def conversation_list(request):
+    user = request.user
+    if not user.is_authenticated:
+        return None
+
+    async def build():
+        qs = exclude_blocked_chats(Chat.objects.filter(type=ChatType.PRIVATE, participants=user), user)
+        chats = [
+            chat async for chat in qs
+            .select_related("last_message")
+            .defer("last_message__search_vector")
+            .prefetch_related("participants")
+            .order_by("-last_message__created_at", "-id")
+        ]
+        # строки участника (unread_count, cleared_before) — одним запросом, а не по запросу на диалог
+        links = {chat.pk: None for chat in chats}
+        async for link in ChatParticipant.objects.filter(user=user, chat_id__in=list(links)).only(
+            "chat_id", "unread_count", "cleared_before",
+        ):
+            links[link.chat_id] = link
+        # превью, ушедшие в архив, читаем с диска не в event loop
+        archived = [chat.pk for chat in chats if chat.last_message_id and chat.last_message is None]
+        previews = await sync_to_async(
+            lambda: {pk: archive.latest_message(pk) for pk in archived}, thread_sensitive=False
+        )() if archived else {}
+        context = {"request": request, "_participant_links": links, "_archived_previews": previews}
+        return json_response(ConversationSerializer(chats, many=True, context=context).data)
+
+    return await _conditional(request, [await auser_version(user.id)], build)
@@ -1,6 +1,6 @@
 from urllib.parse import parse_qs
 
-from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import AccessToken
 
@@ -25,7 +25,7 @@ class JWTAuthMiddleware:
                 user_id = access.get('user_id')
                 if user_id:
                     from users.models import User
-                    user = await sync_to_async(User.objects.get)(id=user_id)
+                    user = await database_sync_to_async(User.objects.get)(id=user_id)
                     scope['user'] = user
         except Exception:
             # ничего не падаем, просто оставляем анонима
@@ -0,0 +1,72 @@
+# chat/blocks.py
+"""
+Блокировки пользователей.
+
+- get_block_ids(user_id): кэшируемое множество id, с кем у пользователя блокировка
+  в любую сторону (он заблокировал + его заблокировали). Для точечных проверок (block_exists).
+- exclude_blocked*/…: фильтры для queryset'ов списков — NOT EXISTS (anti-join) в том же запросе,
+  поэтому списки не зависят от свежести кэша.
+
+Кэш сбрасывается после коммита при любой записи Block (см. chat/signals.py).
+"""
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+
+from config import replicas
+
+from .models import Block
+
+BLOCK_IDS_KEY = "chat:blocks:{}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_BLOCK_CACHE_TTL", 300))
+
+
+def get_block_ids(user_id: int) -> frozenset[int]:
+    key = BLOCK_IDS_KEY.format(int(user_id))
+    ids = cache.get(key)
+    if ids is None:
+        rows = Block.objects.filter(
+            Q(blocker_id=user_id) | Q(blocked_id=user_id)
+        ).values_list("blocker_id", "blocked_id")
+        with replicas.primary():  # в кэш — только с default (config/replicas.py)
+            ids = [b if a == user_id else a for a, b in rows]
+        cache.set(key, ids, _ttl())
+    return frozenset(ids)
+
+
+def invalidate_block_ids(*user_ids: int) -> None:
+    keys = [BLOCK_IDS_KEY.format(int(uid)) for uid in user_ids if uid]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def block_exists(a, b) -> bool:
+    return int(b.id) in get_block_ids(a.id)
+
+
+# ---- queryset-фильтры (одним запросом) ----
+
+def blocked_with(user, user_ref: str) -> Exists:
+    """EXISTS: между user и пользователем OuterRef(user_ref) есть блокировка (в любую сторону)."""
+    return Exists(Block.objects.filter(
+        Q(blocker=user, blocked=OuterRef(user_ref)) | Q(blocker=OuterRef(user_ref), blocked=user)
+    ))
+
+
+def exclude_blocked(qs: QuerySet, user, user_ref: str = "pk") -> QuerySet:
+    """Убирает строки, где пользователь по пути user_ref заблокирован с user (или наоборот)."""
+    return qs.filter(~blocked_with(user, user_ref))
+
+
+def exclude_blocked_chats(qs: QuerySet, user, chat_ref: str = "pk") -> QuerySet:
+    """Убирает чаты, в которых есть участник, состоящий в блокировке с user."""
+    return qs.filter(~Exists(Block.objects.filter(
+        Q(blocker=user, blocked__chat_links__chat=OuterRef(chat_ref))
+        | Q(blocked=user, blocker__chat_links__chat=OuterRef(chat_ref))
+    )))
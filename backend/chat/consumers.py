@@ -5,12 +5,15 @@ import logging
 from typing import Optional
 
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
-from .models import Chat, Message, ChatType
+from config import replicas
+
+from . import frames, idempotency, ratelimit, replay
+from .models import Chat, ChatParticipant, Message, ChatType
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -19,39 +22,93 @@ User = get_user_model()
 ROOM_PRESENCE: dict[str, set[str]] = {}
 
 
-@database_sync_to_async
-def user_can_join_room(chat_id: int, user: Optional[User]) -> bool:
-    try:
-        chat = Chat.objects.prefetch_related("participants").get(id=chat_id)
-    except Chat.DoesNotExist:
+# Горячие пути консьюмера — на async ORM (aget/acreate/aexists/afirst): по одному запросу на
+# путь вместо пачки синхронных в database_sync_to_async. Соединение закрывает/проверяет
+# channels перед каждым обработчиком (AsyncConsumer.dispatch -> aclose_old_connections).
+# Сравнение с прежней версией: manage.py bench_consumer_db.
+
+_NAME_FIELDS = [
+    f for f in ("nickname", "display_name", "username", "email", "first_name")
+    if any(getattr(field, "attname", None) == f for field in User._meta.concrete_fields)
+]
+
+
+async def user_can_join_room(chat_id: int, user: Optional[User]) -> bool:
+    is_auth = bool(user and not isinstance(user, AnonymousUser) and user.is_authenticated)
+    row = await (
+        Chat.objects.filter(pk=chat_id)
+        .annotate(is_member=Exists(
+            ChatParticipant.objects.filter(chat_id=OuterRef("pk"), user_id=user.id if is_auth else None)
+        ))
+        .values_list("type", "is_member")
+        .afirst()
+    )
+    if row is None:
         return False
-
-    if chat.type == ChatType.PRIVATE:
-        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
-            return False
-        return chat.participants.filter(pk=user.id).exists()
+    chat_type, is_member = row
+    if chat_type == ChatType.PRIVATE:
+        return is_auth and is_member
     return True
 
 
-@database_sync_to_async
-def create_message(room_id: int, user_id: int, content: str) -> Message:
-    return Message.objects.create(room_id=room_id, author_id=user_id, content=content)
+async def create_message(
+    room_id: int, user_id: int, content: str, key: Optional[str] = None, *, limit: bool = False,
+) -> tuple[Optional[Message], bool]:
+    """
+    (сообщение, создано ли сейчас). Повтор с тем же ключом — исходное сообщение без INSERT,
+    (None, False) — если оно уже удалено; первый запрос с ключом ещё идёт — idempotency.KeyPending.
+    limit — проверить лимит отправки (chat/ratelimit.py) после ключа: повтор уже созданного
+    сообщения лимит не тратит; сверх лимита — ratelimit.RateLimited.
+    """
+    if not key:
+        await _admit(user_id, room_id, limit)
+        msg = await Message.objects.acreate(room_id=room_id, author_id=user_id, content=content)
+        await replicas.amark_write(user_id)
+        return msg, True
+    scope = idempotency.room_scope(room_id)
+    found = await idempotency.aclaim(user_id, scope, key)
+    if found == idempotency.PENDING:
+        raise idempotency.KeyPending(key)
+    if found is not None:
+        msg = await Message.objects.filter(pk=found).afirst()
+        if msg is None:
+            # id мог быть перевыпущен backfill_message_ids после записи ключа
+            new_id = await idempotency.aremapped(found)
+            msg = await Message.objects.filter(pk=new_id).afirst() if new_id else None
+        return msg, False
+    try:
+        await _admit(user_id, room_id, limit)
+        msg = await Message.objects.acreate(room_id=room_id, author_id=user_id, content=content)
+    except Exception:
+        await idempotency.arelease(user_id, scope, key)
+        raise
+    # автокоммит: INSERT уже закоммичен, on_commit здесь не нужен (и недоступен из event loop)
+    await idempotency.astore(user_id, scope, key, msg.id)
+    await replicas.amark_write(user_id)  # своё сообщение в REST-ленте — с default, не с реплики
+    return msg, True
 
 
-@database_sync_to_async
-def get_user_display_name(user_id: int) -> str:
-    try:
-        u = User.objects.get(id=user_id)
-    except User.DoesNotExist:
+async def _admit(user_id: int, room_id: int, limit: bool) -> None:
+    if limit:
+        wait = await ratelimit.acheck_send(user_id, room_id)
+        if wait:
+            raise ratelimit.RateLimited(wait)
+
+
+async def get_user_display_name(user_id: int) -> str:
+    row = await User.objects.filter(pk=user_id).values_list(*_NAME_FIELDS).afirst() if _NAME_FIELDS else None
+    if row is None:
         return "User"
-    for field in ("nickname", "display_name", "username", "email", "first_name"):
-        if hasattr(u, field):
-            val = getattr(u, field)
-            if val:
-                return str(val)
+    for val in row:
+        if val:
+            return str(val)
     return "User"
 
 
+async def get_frame_profile(user_id: Optional[int]) -> str:
+    return await frames.aprofile_for_user(user_id)
+
+
 def _safe_int(value, default=None) -> Optional[int]:
     try:
         return int(value)
@@ -67,9 +124,21 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
     События группы:
       - chat_message -> {"type": "message:new", "payload": {...}}
       - chat_delete  -> {"type": "message:delete", "payload": {"id": "..."}}
+      - chat_delete_batch -> {"type": "message:delete_batch", "payload": {"ids": [...]}}
+      - chat_edit     -> {"type": "message:edit", "payload": {"id", "content", "edited_at"}}
+      - chat_reaction -> {"type": "reaction:delta", "payload": {"id", "emoji", "delta": ±1, "user_id"}}
       - presence_event -> {"type":"presence", "event":"join|leave", ...}
+    События приходят с готовым кадром ("text"/"bytes", см. chat/frames.py) и пишутся
+    в сокет без перекодирования. Подпротокол humy.msgpack — бинарные кадры msgpack.
+    При data_usage=low соединение получает урезанные кадры (profile=low).
+    Вход/выход из комнаты и разбор клиентских кадров вынесены в join_room / leave_room /
+    handle_room_frame — их же использует мультиплексный GatewayConsumer (chat/gateway.py).
     """
 
+    binary = False
+    profile = frames.PROFILE_FULL
+    stats_prefix = "chat"
+
     async def connect(self):
         user = self.scope.get("user")
         url_kwargs = self.scope.get("url_route", {}).get("kwargs", {})
@@ -84,122 +153,244 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             await self.close(code=4403)
             return
 
+        subprotocol = await self.setup_connection()
+        await self.accept(subprotocol=subprotocol)
+        logger.info(
+            "[WS][CONNECT] path=%s user_id=%s auth=%s room_id=%s proto=%s profile=%s",
+            self.scope.get("path"), self.user_id, bool(self.user), self.room_id, subprotocol, self.profile,
+        )
+        await self.join_room(self.room_id)
+
+    async def setup_connection(self) -> Optional[str]:
+        """Пользователь, имя, профиль кадров и подпротокол — один раз на сокет."""
+        user = self.scope.get("user")
         self.user = user if user and getattr(user, "is_authenticated", False) else None
         self.user_id = int(getattr(self.user, "id", 0) or 0) or None
         self.user_display_name = (
             await get_user_display_name(self.user_id)
             if self.user_id else "Guest"
         )
+        self.profile = await get_frame_profile(self.user_id)
+        subprotocol = frames.pick_subprotocol(self.scope.get("subprotocols"))
+        self.binary = subprotocol == frames.SUBPROTOCOL_MSGPACK
+        return subprotocol
 
-        await self.accept()
-        logger.info(
-            "[WS][CONNECT] path=%s user_id=%s auth=%s room_id=%s",
-            self.scope.get("path"), self.user_id, bool(self.user), self.room_id,
-        )
-
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
+    async def join_room(self, room_id: int) -> None:
+        group = f"chat_{room_id}"
+        await self.channel_layer.group_add(group, self.channel_name)
 
-        present = ROOM_PRESENCE.setdefault(self.group_name, set())
+        present = ROOM_PRESENCE.setdefault(group, set())
         present.add(self.channel_name)
         count = len(present)
 
         await self.channel_layer.group_send(
-            self.group_name,
-            {
-                "type": "presence_event",
-                "data": {
-                    "type": "presence",
-                    "event": "join",
-                    "user_id": self.user_id,
-                    "display_name": self.user_display_name,
-                    "count": count,
-                    "timestamp": timezone.now().isoformat(),
-                },
-            },
+            group,
+            frames.make_event("presence_event", {
+                "type": "presence",
+                "event": "join",
+                "user_id": self.user_id,
+                "display_name": self.user_display_name,
+                "count": count,
+                "timestamp": timezone.now().isoformat(),
+            }, room=room_id),
+        )
+
+    async def leave_room(self, room_id: int) -> None:
+        group = f"chat_{room_id}"
+        await self.channel_layer.group_discard(group, self.channel_name)
+
+        present = ROOM_PRESENCE.get(group)
+        if present and self.channel_name in present:
+            present.remove(self.channel_name)
+        count = len(present) if present else 0
+
+        await self.channel_layer.group_send(
+            group,
+            frames.make_event("presence_event", {
+                "type": "presence",
+                "event": "leave",
+                "user_id": getattr(self, "user_id", None),
+                "display_name": getattr(self, "user_display_name", None),
+                "count": count,
+                "timestamp": timezone.now().isoformat(),
+            }, room=room_id),
         )
 
     async def disconnect(self, code):
         try:
             if getattr(self, "group_name", None):
-                await self.channel_layer.group_discard(self.group_name, self.channel_name)
-
-                present = ROOM_PRESENCE.get(self.group_name)
-                if present and self.channel_name in present:
-                    present.remove(self.channel_name)
-                count = len(present) if present else 0
-
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "presence_event",
-                        "data": {
-                            "type": "presence",
-                            "event": "leave",
-                            "user_id": getattr(self, "user_id", None),
-                            "display_name": getattr(self, "user_display_name", None),
-                            "count": count,
-                            "timestamp": timezone.now().isoformat(),
-                        },
-                    },
-                )
+                await self.leave_room(self.room_id)
         except Exception as e:
             logger.warning("Disconnect cleanup error: %s", e)
         finally:
             await super().disconnect(code)
 
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # msgpack-клиент шлёт бинарные кадры; JSON-текст принимаем всегда
+        if bytes_data is not None and self.binary:
+            try:
+                content = frames.decode_msgpack(bytes_data)
+            except Exception:
+                return
+            if isinstance(content, dict):
+                await self.receive_json(content, **kwargs)
+            return
+        if text_data is None:
+            return
+        await super().receive(text_data=text_data, bytes_data=None, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.profile == frames.PROFILE_LOW:
+            content = frames.trim_low(content)
+        if isinstance(content, dict):
+            kind = f"{self.stats_prefix}:{content.get('type') or content.get('kind') or 'event'}"
+        else:
+            kind = f"{self.stats_prefix}:event"
+        if self.binary:
+            raw = frames.encode_msgpack(content)
+            await frames.arecord(kind, len(raw), self.profile)
+            await self.send(bytes_data=raw, close=close)
+        else:
+            text = frames.encode_json(content)
+            await frames.arecord(kind, len(text.encode()), self.profile)
+            await self.send(text_data=text, close=close)
+
+    async def send_frame(self, event) -> None:
+        """Готовый кадр из события группы; старый формат ({"data": {...}}) — через send_json."""
+        text, raw = frames.pick_frame(event, binary=self.binary, profile=self.profile)
+        if raw is not None:
+            await frames.arecord(f"{self.stats_prefix}:{event['type']}", len(raw), self.profile)
+            await self.send(bytes_data=raw)
+        elif text is not None:
+            await frames.arecord(f"{self.stats_prefix}:{event['type']}", len(text.encode()), self.profile)
+            await self.send(text_data=text)
+        else:
+            await self.send_json(event.get("data") or event)
+
     async def receive_json(self, content, **kwargs):
         """
         Принимаем от клиента:
           - {"type":"ping"}
           - {"type":"typing", "value": true|false}
-          - {"type":"message", "content":"..."} — фоллбэк на отправку через WS (основной поток через REST)
+          - {"type":"message", "content":"..."} — фоллбэк на отправку через WS (основной поток через REST);
+            сверх лимита (chat/ratelimit.py) — {"type":"message:rejected", "retry_after": s} только отправителю;
+            повтор ключа, пока первая отправка не закончена или после удаления исходного сообщения, —
+            {"type":"message:pending", "reason": "in_progress"|"deleted"} только отправителю
+          - {"type":"resume", "last_event_id": N} — дослать пропущенное после реконнекта, с запасом
+            до N — клиент отбрасывает кадры с уже виденным event_id (chat/replay.py)
         """
         t = (content.get("type") or "").lower()
         if t == "ping":
             await self.send_json({"type": "pong", "ts": timezone.now().isoformat()})
             return
+        await self.handle_room_frame(self.room_id, t, content)
+
+    async def handle_room_frame(self, room_id: int, t: str, content: dict) -> None:
+        group = f"chat_{room_id}"
+        if t == "resume":
+            await self.resume_room(room_id, content.get("last_event_id"))
+            return
 
         if t == "typing":
             await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "typing_event",
-                 "data": {"type": "typing", "user_id": self.user_id, "value": bool(content.get("value"))}}
+                group,
+                frames.make_event(
+                    "typing_event",
+                    {"type": "typing", "user_id": self.user_id, "value": bool(content.get("value"))},
+                    room=room_id,
+                ),
             )
             return
 
         if t == "message":
             if not self.user_id:
                 return
+            try:
+                key = idempotency.clean_key(
+                    content.get("idempotency_key") or content.get("temp_id") or content.get("tempId")
+                )
+            except ValueError:
+                key = None
             text = str(content.get("content") or "")[:5000]
-            msg = await create_message(self.room_id, self.user_id, text)
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "chat_message",
-                    "data": {
-                        "id": str(msg.id),
-                        "room": self.room_id,
-                        "author_id": self.user_id,
-                        "display_name": self.user_display_name,
-                        "content": msg.content,
-                        "attachment_url": None,
-                        "attachment_name": "",
-                        "attachment_type": "",
-                        "created_at": msg.created_at.isoformat() if getattr(msg, "created_at", None) else timezone.now().isoformat(),
-                        "meta": {},
-                    },
-                },
-            )
+            temp_id = content.get("temp_id") or content.get("tempId")
+            try:
+                msg, created = await create_message(room_id, self.user_id, text, key, limit=True)
+            except ratelimit.RateLimited as e:
+                # в БД и в комнату не идём; фронт по temp_id помечает сообщение неотправленным
+                await self.send_json({
+                    "type": "message:rejected",
+                    "room": room_id,
+                    "reason": "rate_limited",
+                    "retry_after": round(e.wait, 2),
+                    "temp_id": temp_id,
+                })
+                return
+            except idempotency.KeyPending:
+                # первая отправка ещё идёт: её message:new придёт в комнату, фронт ждёт его
+                await self.send_json({
+                    "type": "message:pending", "room": room_id, "reason": "in_progress", "retry_after": 1,
+                    "temp_id": temp_id,
+                })
+                return
+            if msg is None:
+                # ключ есть, а сообщения уже нет: повторять бессмысленно, фронт убирает черновик
+                await self.send_json({"type": "message:pending", "room": room_id, "reason": "deleted", "temp_id": temp_id})
+                return
+            frame = self.message_frame(msg, room_id)
+            if not created:
+                # повтор: комнате уже разослано, отвечаем только отправителю
+                await self.send_json(frame)
+                return
+            await self.channel_layer.group_send(group, await replay.amake_room_event("chat_message", frame, room_id))
+
+    def message_frame(self, msg: Message, room_id: int) -> dict:
+        return {
+            "id": str(msg.id),
+            "room": room_id,
+            "author_id": self.user_id,
+            "display_name": self.user_display_name,
+            "content": msg.content,
+            "attachment_url": None,
+            "attachment_name": "",
+            "attachment_type": "",
+            "created_at": msg.created_at.isoformat() if getattr(msg, "created_at", None) else timezone.now().isoformat(),
+            "meta": {},
+        }
+
+    async def resume_room(self, room_id: int, last_event_id) -> None:
+        last = _safe_int(last_event_id)
+        events = await replay.aevents_since(room_id, last) if last is not None else None
+        if events is None:
+            await self.send_json({"type": "resume:reset", "room": room_id})
+            return
+        for event in events:
+            await self.send_frame(event)
+        await self.send_json({"type": "resume:ok", "room": room_id, "replayed": len(events)})
 
     # ---- события группы -> клиент ----
+    # старый формат событий ({"data": ...} / {"id": ...}) ещё может прийти от воркеров
+    # предыдущей версии во время выкладки — поддерживаем оба
     async def chat_message(self, event):
-        await self.send_json(event.get("data") or event)
+        await self.send_frame(event)
 
     async def chat_delete(self, event):
-        await self.send_json({"type": "message:delete", "payload": {"id": event.get("id")}})
+        if "text" not in event:
+            event = {**event, "data": {"type": "message:delete", "payload": {"id": event.get("id")}}}
+        await self.send_frame(event)
+
+    async def chat_delete_batch(self, event):
+        if "text" not in event:
+            event = {**event, "data": {"type": "message:delete_batch", "payload": {"ids": event.get("ids") or []}}}
+        await self.send_frame(event)
+
+    async def chat_edit(self, event):
+        await self.send_frame(event)
+
+    async def chat_reaction(self, event):
+        await self.send_frame(event)
 
     async def presence_event(self, event):
-        await self.send_json(event.get("data") or event)
+        await self.send_frame(event)
 
     async def typing_event(self, event):
-        await self.send_json(event.get("data") or event)
+        await self.send_frame(event)
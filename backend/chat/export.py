@@ -0,0 +1,200 @@
+# chat/export.py
+"""
+Потоковая выгрузка истории чата (для /api/conversations/{id}/export/ и /api/chats/{id}/export/).
+
+  ?as=ndjson (по умолчанию) — одно сообщение на строку, вложения ссылками;
+  ?as=zip                   — messages.ndjson + attachments/<message_id>/<имя>.
+
+Память постоянна при любой длине истории: горячая часть читается серверным курсором
+(iterator(chunk_size=...)), архив (chat/archive.py) — поблочно, zip пишется в поток
+без seek (data descriptors), каждый кусок сразу уходит в StreamingHttpResponse.
+Под ASGI ответу нужен асинхронный итератор: синхронный Django собрал бы целиком через
+sync_to_async(list) до первого байта. Поэтому там каждый кусок забирается отдельным
+переходом в поток запроса (_aiter).
+Порядок — по возрастанию created_at: сначала архив (он целиком старше), потом БД.
+"""
+from __future__ import annotations
+
+import json
+import zipfile
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import archive
+from .models import Chat, HiddenMessage, Message
+from .services import history_watermark, visible_messages
+
+EXPORT_KINDS = ("ndjson", "zip")
+EXPORT_FIELDS = (
+    "id", "created_at", "author_id", "author__nickname", "display_name", "content",
+    "attachment", "attachment_type", "attachment_name", "reply_to_id", "edited_at", "meta",
+)
+FILE_CHUNK = 64 * 1024
+
+
+def _chunk_size() -> int:
+    return int(getattr(settings, "CHAT_EXPORT_CHUNK_SIZE", 2000))
+
+
+def _row(values: dict, attachment_ref: Optional[str]) -> dict:
+    return {
+        "id": str(values["id"]),
+        "created_at": values["created_at"],
+        "author_id": values.get("author_id"),
+        "author": values.get("author__nickname") or values.get("display_name") or None,
+        "content": values.get("content") or "",
+        "attachment": attachment_ref,
+        "attachment_type": values.get("attachment_type") or "",
+        "attachment_name": values.get("attachment_name") or "",
+        "reply_to_id": str(values["reply_to_id"]) if values.get("reply_to_id") else None,
+        "edited_at": values.get("edited_at"),
+        "meta": values.get("meta") or {},
+    }
+
+
+def _archived_rows(room: Chat, user) -> Iterator[dict]:
+    cleared = history_watermark(user, room.id)
+    for block in archive.iter_archived_blocks(room.id):
+        block = [
+            r for r in block
+            if not r.get("deleted_at") and (cleared is None or r["created_at"] > cleared)
+        ]
+        if not block:
+            continue
+        hidden = {
+            str(mid) for mid in HiddenMessage.objects.filter(
+                user=user, message_id__in=[r["id"] for r in block]
+            ).values_list("message_id", flat=True)
+        }
+        for r in block:
+            if r["id"] not in hidden:
+                yield r  # у архивных строк нет author__nickname — останется display_name
+
+
+def _hot_rows(room: Chat, user, *, with_attachment: bool = False) -> Iterator[dict]:
+    qs = visible_messages(Message.objects.filter(room=room, deleted_at__isnull=True), user, room.id)
+    if with_attachment:
+        qs = qs.exclude(attachment="").exclude(attachment__isnull=True)
+    yield from qs.order_by("created_at", "id").values(*EXPORT_FIELDS).iterator(chunk_size=_chunk_size())
+
+
+def iter_export_rows(room: Chat, user) -> Iterator[dict]:
+    yield from _archived_rows(room, user)
+    yield from _hot_rows(room, user)
+
+
+def _line(row: dict) -> bytes:
+    return json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False).encode() + b"\n"
+
+
+def _zip_path(values: dict) -> str:
+    name = values.get("attachment_name") or values["attachment"].rsplit("/", 1)[-1]
+    return f"attachments/{values['id']}/{name}"
+
+
+def stream_ndjson(room: Chat, user, request) -> Iterator[bytes]:
+    buf: list[bytes] = []
+    for values in iter_export_rows(room, user):
+        ref = request.build_absolute_uri(default_storage.url(values["attachment"])) if values.get("attachment") else None
+        buf.append(_line(_row(values, ref)))
+        if len(buf) >= 200:
+            yield b"".join(buf)
+            buf.clear()
+    if buf:
+        yield b"".join(buf)
+
+
+class _Sink:
+    """Файлоподобный приёмник без seek/tell: zipfile пишет сюда, генератор забирает куски."""
+
+    def __init__(self):
+        self.parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self.parts)
+        self.parts.clear()
+        return out
+
+
+def stream_zip(room: Chat, user, request) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("messages.ndjson", mode="w", force_zip64=True) as entry:
+            for values in iter_export_rows(room, user):
+                ref = _zip_path(values) if values.get("attachment") else None
+                entry.write(_line(_row(values, ref)))
+                if sum(map(len, sink.parts)) >= FILE_CHUNK:
+                    yield sink.drain()
+        yield sink.drain()
+
+        # второй проход — только сообщения с вложениями, файлы копируем кусками
+        for values in _iter_with_attachments(room, user):
+            try:
+                src = default_storage.open(values["attachment"], "rb")
+            except (FileNotFoundError, OSError):
+                continue
+            with src, zf.open(_zip_path(values), mode="w", force_zip64=True) as entry:
+                for chunk in iter(lambda: src.read(FILE_CHUNK), b""):
+                    entry.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _iter_with_attachments(room: Chat, user) -> Iterable[dict]:
+    for r in _archived_rows(room, user):
+        if r.get("attachment"):
+            yield r
+    yield from _hot_rows(room, user, with_attachment=True)
+
+
+def _non_empty(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    return (chunk for chunk in chunks if chunk)
+
+
+async def _aiter(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    # thread_sensitive: серверный курсор iterator() живёт на соединении потока запроса
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def _body(chunks: Iterator[bytes], request):
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        return _aiter(chunks)
+    return chunks
+
+
+def export_response(room: Chat, user, request, kind: str) -> StreamingHttpResponse:
+    stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+    if kind == "zip":
+        chunks, content_type = stream_zip(room, user, request), "application/zip"
+        filename = f"chat-{room.id}-{stamp}.zip"
+    else:
+        chunks, content_type = stream_ndjson(room, user, request), "application/x-ndjson"
+        filename = f"chat-{room.id}-{stamp}.ndjson"
+    resp = StreamingHttpResponse(_body(_non_empty(chunks), request), content_type=content_type)
+    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    resp["Cache-Control"] = "private, no-store"
+    resp["X-Accel-Buffering"] = "no"  # nginx: не буферизовать поток
+    return resp
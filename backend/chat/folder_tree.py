@@ -0,0 +1,100 @@
+# chat/folder_tree.py
+"""
+Дерево папок целиком для сайдбара — за два запроса:
+  1) папки поддерева по диапазону MPTT (tree_id, lft/rght) + их метки (JSONB-агрегат);
+  2) чаты этих папок через таблицу связи + метки чатов (JSONB-агрегат).
+Вложенность собираем в памяти и кэшируем по корню.
+
+Ключ кэша включает версию папок (chat/versioning.py): любая запись папки/чата/меток
+её поднимает. Версия глобальная, потому что MPTT при вставке корня перенумеровывает tree_id
+соседних деревьев — привязка кэша к tree_id была бы ненадёжной.
+"""
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import JSONBAgg
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.db.models.functions import JSONObject
+
+from .models import Chat, Folder
+from .versioning import folders_version
+
+TREE_KEY = "chat:folder_tree:{}:{}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_FOLDER_TREE_TTL", 3600))
+
+
+def _labels_agg(prefix: str) -> JSONBAgg:
+    return JSONBAgg(
+        JSONObject(id=F(f"{prefix}__id"), name=F(f"{prefix}__name"), color=F(f"{prefix}__color")),
+        filter=Q(**{f"{prefix}__isnull": False}),
+        distinct=True,
+        default=[],
+    )
+
+
+def _build(root: Optional[Folder]) -> list[dict[str, Any]]:
+    folders = Folder.objects.all()
+    if root is not None:
+        folders = folders.filter(tree_id=root.tree_id, lft__gte=root.lft, rght__lte=root.rght)
+    rows = list(
+        folders.order_by("tree_id", "lft")
+        .values("id", "name", "parent_id", "created_at", "updated_at")
+        .annotate(labels_data=_labels_agg("labels"))
+    )
+    if not rows:
+        return []
+
+    nodes: dict[int, dict[str, Any]] = {}
+    for r in rows:
+        nodes[r["id"]] = {
+            "id": r["id"],
+            "name": r["name"],
+            "parent": r["parent_id"],
+            "labels": r["labels_data"],
+            "created_at": r["created_at"],
+            "updated_at": r["updated_at"],
+            "children": [],
+            "chats": [],
+        }
+
+    links = (
+        Chat.folders.through.objects
+        .filter(folder_id__in=list(nodes))
+        .order_by("folder_id", "-chat__created_at")
+        .values("folder_id", "chat_id", "chat__name", "chat__is_protected", "chat__created_at")
+        .annotate(labels_data=_labels_agg("chat__labels"))
+    )
+    for link in links:
+        nodes[link["folder_id"]]["chats"].append({
+            "id": link["chat_id"],
+            "name": link["chat__name"],
+            "labels": link["labels_data"],
+            "is_protected": link["chat__is_protected"],
+            "created_at": link["chat__created_at"],
+        })
+
+    # rows отсортированы по lft — родитель всегда раньше детей
+    top: list[dict[str, Any]] = []
+    for r in rows:
+        node = nodes[r["id"]]
+        parent = nodes.get(r["parent_id"])
+        if parent is not None and (root is None or r["id"] != root.pk):
+            parent["children"].append(node)
+        else:
+            top.append(node)
+    return top
+
+
+def get_folder_tree(root: Optional[Folder] = None) -> list[dict[str, Any]]:
+    key = TREE_KEY.format(root.pk if root is not None else "all", folders_version())
+    tree = cache.get(key)
+    if tree is None:
+        tree = _build(root)
+        cache.set(key, tree, _ttl())
+    return tree
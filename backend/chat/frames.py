@@ -0,0 +1,262 @@
+# chat/frames.py
+"""
+Предкодированные кадры для ChatConsumer.
+
+Событие комнаты сериализуется один раз у отправителя (view / consumer), через channel layer
+идёт уже готовый кадр, и каждый получатель пишет его в сокет как есть — без send_json
+и повторного json.dumps на каждого из N участников:
+
+  {"type": "chat_message", "text": "<JSON-кадр>", "bytes": b"<msgpack-кадр>"}
+
+"bytes" есть только если установлен msgpack и CHAT_WS_MSGPACK включён. Клиент получает
+msgpack, если при подключении предложил подпротокол SUBPROTOCOL_MSGPACK
+(new WebSocket(url, ["humy.msgpack", "humy.json"])); без подпротоколов — JSON, как раньше.
+
+Профиль соединения берётся из UserSettings.data_usage: для "low" у события есть второй,
+урезанный кадр ("low_text"/"low_bytes": без аватаров, с короткими превью, без пустых
+необязательных полей) — он тоже кодируется один раз у отправителя.
+
+Учёт трафика: record() копит кадры/байты по типу кадра и профилю в памяти процесса
+и раз в CHAT_WS_STATS_FLUSH_SEC сбрасывает их в кэш (консьюмеры — arecord: сброс в пуле потоков);
+смотреть — manage.py ws_frame_stats.
+Байты — до permessage-deflate (см. config/ws_compression.py).
+"""
+from __future__ import annotations
+
+import json
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:  # опционально: pip install msgpack (ставится вместе с channels_redis)
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+SUBPROTOCOL_JSON = "humy.json"
+SUBPROTOCOL_MSGPACK = "humy.msgpack"
+
+PROFILE_FULL = "full"
+PROFILE_LOW = "low"
+
+# урезание кадров для data_usage=low
+LOW_DROP_KEYS = frozenset({"avatar", "author_username", "attachment"})
+LOW_DROP_IF_EMPTY = frozenset({"reply_to", "expires_at", "edited_at", "deleted_at", "attachment_url", "meta"})
+LOW_PREVIEW_KEYS = frozenset({"preview"})
+
+STATS_KEY = "ws:stats:{}"
+STATS_LABELS_KEY = "ws:stats:labels"
+
+
+def msgpack_enabled() -> bool:
+    return msgpack is not None and bool(getattr(settings, "CHAT_WS_MSGPACK", True))
+
+
+def encode_json(data) -> str:
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_msgpack(data, text: Optional[str] = None) -> bytes:
+    # msgpack не знает datetime/UUID/Decimal — берём уже готовый JSON того же кадра,
+    # чтобы оба формата были идентичны по содержимому
+    return msgpack.packb(json.loads(text if text is not None else encode_json(data)), use_bin_type=True)
+
+
+def decode_msgpack(raw: bytes):
+    return msgpack.unpackb(raw, raw=False)
+
+
+def _short(text: str) -> str:
+    limit = int(getattr(settings, "CHAT_WS_LOW_PREVIEW_CHARS", 40))
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def trim_low(data):
+    """Кадр для профиля low: без аватаров и дублей, короткие превью, без пустых необязательных полей."""
+    if isinstance(data, dict):
+        out = {}
+        for key, value in data.items():
+            if key in LOW_DROP_KEYS or (key in LOW_DROP_IF_EMPTY and not value):
+                continue
+            if key in LOW_PREVIEW_KEYS and isinstance(value, str):
+                out[key] = _short(value)
+            else:
+                out[key] = trim_low(value)
+        return out
+    if isinstance(data, list):
+        return [trim_low(v) for v in data]
+    return data
+
+
+def make_event(handler: str, frame, *, room: Optional[int] = None) -> dict:
+    """
+    Событие для group_send с готовым кадром. handler — имя метода консьюмера
+    ("chat_message", "chat_delete", ...), frame — то, что увидит клиент,
+    room — комната-источник (нужна мультиплексному сокету, см. chat/gateway.py).
+    """
+    binary = msgpack_enabled()
+    text = encode_json(frame)
+    event = {"type": handler, "text": text}
+    if room is not None:
+        event["room"] = room
+    if binary:
+        event["bytes"] = encode_msgpack(frame, text)
+    low = trim_low(frame)
+    if low != frame:
+        event["low_text"] = encode_json(low)
+        if binary:
+            event["low_bytes"] = encode_msgpack(low, event["low_text"])
+    return event
+
+
+def pick_frame(event: dict, *, binary: bool, profile: str):
+    """Готовый кадр события для соединения: (text, bytes), заполнено одно из двух; (None, None) — старый формат."""
+    prefix = "low_" if profile == PROFILE_LOW and "low_text" in event else ""
+    text = event.get(prefix + "text")
+    if text is None:
+        return None, None
+    if binary:
+        raw = event.get(prefix + "bytes")
+        return None, raw if raw is not None else encode_msgpack(None, text)
+    return text, None
+
+
+def wrap_room_text(room: int, text: str) -> str:
+    """{"kind":"room","room":<id>,"data":<кадр>} склейкой строк — кадр не перекодируется."""
+    return '{"kind":"room","room":%d,"data":%s}' % (int(room), text)
+
+
+def wrap_room_bytes(room: int, raw: bytes) -> bytes:
+    """То же для msgpack: заголовок map из трёх пар + готовый кадр как значение "data"."""
+    return (
+        b"\x83"
+        + msgpack.packb("kind") + msgpack.packb("room")
+        + msgpack.packb("room") + msgpack.packb(int(room))
+        + msgpack.packb("data") + raw
+    )
+
+
+def profile_for_user(user_id: Optional[int]) -> str:
+    """Профиль кадров по UserSettings.data_usage (синхронно; в консьюмерах — aprofile_for_user)."""
+    if not user_id:
+        return PROFILE_FULL
+    from users.models import UserSettings
+
+    usage = UserSettings.objects.filter(user_id=user_id).values_list("data_usage", flat=True).first()
+    return PROFILE_LOW if usage == UserSettings.DATA_USAGE_LOW else PROFILE_FULL
+
+
+async def aprofile_for_user(user_id: Optional[int]) -> str:
+    if not user_id:
+        return PROFILE_FULL
+    from users.models import UserSettings
+
+    usage = await UserSettings.objects.filter(user_id=user_id).values_list("data_usage", flat=True).afirst()
+    return PROFILE_LOW if usage == UserSettings.DATA_USAGE_LOW else PROFILE_FULL
+
+
+# ---- учёт трафика по типам кадров ----
+
+_pending: dict[str, list[int]] = {}
+_flushed_at = time.monotonic()
+
+
+def _add(kind: str, size: int, profile: str) -> bool:
+    label = f"{kind}|{profile}"
+    row = _pending.get(label)
+    if row is None:
+        row = _pending[label] = [0, 0]
+    row[0] += 1
+    row[1] += size
+    return time.monotonic() - _flushed_at >= float(getattr(settings, "CHAT_WS_STATS_FLUSH_SEC", 10))
+
+
+def record(kind: str, size: int, profile: str = PROFILE_FULL) -> None:
+    if _add(kind, size, profile):
+        flush_stats()
+
+
+async def arecord(kind: str, size: int, profile: str = PROFILE_FULL) -> None:
+    """record для консьюмеров: сброс в кэш — в пуле потоков, не в event loop."""
+    if _add(kind, size, profile):
+        await aflush_stats()
+
+
+def _incr(key: str, delta: int) -> None:
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # ключа ещё нет: add не перетрёт значение, которое успел создать другой процесс
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def _take() -> dict[str, list[int]]:
+    # забираем накопленное в вызывающем потоке: счётчики, записанные во время отправки
+    # в кэш, попадут в следующую пачку, а не потеряются
+    global _flushed_at, _pending
+    _flushed_at = time.monotonic()
+    batch, _pending = _pending, {}
+    return batch
+
+
+def _ship(batch: dict[str, list[int]]) -> None:
+    try:
+        labels = set(cache.get(STATS_LABELS_KEY) or ())
+        if not labels.issuperset(batch):
+            cache.set(STATS_LABELS_KEY, sorted(labels | set(batch)), None)
+        for label, (frames_n, size) in batch.items():
+            _incr(STATS_KEY.format(label) + ":frames", frames_n)
+            _incr(STATS_KEY.format(label) + ":bytes", size)
+    except Exception:
+        # метрики не должны ронять сокет
+        pass
+
+
+def flush_stats() -> None:
+    batch = _take()
+    if batch:
+        _ship(batch)
+
+
+async def aflush_stats() -> None:
+    batch = _take()
+    if batch:
+        await sync_to_async(_ship, thread_sensitive=False)(batch)
+
+
+def read_stats() -> list[dict]:
+    """[{kind, profile, frames, bytes}] по всем процессам (что уже сброшено в кэш)."""
+    labels = cache.get(STATS_LABELS_KEY) or []
+    keys = [STATS_KEY.format(label) + suffix for label in labels for suffix in (":frames", ":bytes")]
+    values = cache.get_many(keys)
+    rows = []
+    for label in labels:
+        kind, _, profile = label.partition("|")
+        rows.append({
+            "kind": kind,
+            "profile": profile,
+            "frames": int(values.get(STATS_KEY.format(label) + ":frames") or 0),
+            "bytes": int(values.get(STATS_KEY.format(label) + ":bytes") or 0),
+        })
+    return rows
+
+
+def reset_stats() -> None:
+    labels = cache.get(STATS_LABELS_KEY) or []
+    cache.delete_many([STATS_KEY.format(label) + s for label in labels for s in (":frames", ":bytes")])
+    cache.delete(STATS_LABELS_KEY)
+
+
+def pick_subprotocol(offered) -> Optional[str]:
+    """Выбор подпротокола по списку из scope["subprotocols"] (в порядке предпочтения сервера)."""
+    offered = list(offered or ())
+    if SUBPROTOCOL_MSGPACK in offered and msgpack_enabled():
+        return SUBPROTOCOL_MSGPACK
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
@@ -0,0 +1,138 @@
+# chat/friend_graph.py
+"""
+Граф дружбы в кэше: для каждого пользователя — множество id друзей (список смежности).
+
+Хранение: chat:friends:<id> -> bytes (array('q'), отсортированный) — компактно и без pickle-объектов.
+Промах кэша поднимает список одним запросом к Friendship.
+При изменении Friendship списки обоих пользователей удаляются после коммита (invalidate_edge,
+см. chat/signals.py) и соберутся заново при следующем чтении.
+"""
+from __future__ import annotations
+
+from array import array
+from collections import Counter
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from config import replicas
+
+from .models import Friendship
+
+FRIENDS_KEY = "chat:friends:{}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_FRIEND_GRAPH_TTL", 3600))
+
+
+def _key(user_id: int) -> str:
+    return FRIENDS_KEY.format(int(user_id))
+
+
+def _encode(ids: Iterable[int]) -> bytes:
+    return array("q", sorted(ids)).tobytes()
+
+
+def _decode(raw: bytes) -> frozenset[int]:
+    arr = array("q")
+    arr.frombytes(raw)
+    return frozenset(arr)
+
+
+def _load_from_db(user_ids: list[int]) -> dict[int, set[int]]:
+    """Списки смежности для нескольких пользователей одним запросом."""
+    wanted = set(user_ids)
+    result: dict[int, set[int]] = {uid: set() for uid in wanted}
+    rows = Friendship.objects.filter(
+        Q(user1_id__in=wanted) | Q(user2_id__in=wanted)
+    ).values_list("user1_id", "user2_id")
+    with replicas.primary():  # в кэш — только с default, не с отстающей реплики
+        rows = list(rows)
+    for a, b in rows:
+        if a in wanted:
+            result[a].add(b)
+        if b in wanted:
+            result[b].add(a)
+    return result
+
+
+def friend_ids_many(user_ids: Iterable[int]) -> dict[int, frozenset[int]]:
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return {}
+    keys = {_key(uid): uid for uid in user_ids}
+    cached = cache.get_many(list(keys))
+
+    result = {keys[k]: _decode(v) for k, v in cached.items()}
+    missing = [uid for uid in user_ids if uid not in result]
+    if missing:
+        loaded = _load_from_db(missing)
+        cache.set_many({_key(uid): _encode(ids) for uid, ids in loaded.items()}, _ttl())
+        result.update({uid: frozenset(ids) for uid, ids in loaded.items()})
+    return result
+
+
+def friend_ids(user_id: int) -> frozenset[int]:
+    return friend_ids_many([user_id])[int(user_id)]
+
+
+async def afriend_ids(user_id: int) -> frozenset[int]:
+    """friend_ids для консьюмеров: кэш, на промахе — тот же запрос через async ORM."""
+    user_id = int(user_id)
+    raw = await cache.aget(_key(user_id))
+    if raw is not None:
+        return _decode(raw)
+    ids: set[int] = set()
+    rows = Friendship.objects.filter(Q(user1_id=user_id) | Q(user2_id=user_id)).values_list("user1_id", "user2_id")
+    with replicas.primary():
+        async for a, b in rows:
+            ids.add(b if a == user_id else a)
+    await cache.aset(_key(user_id), _encode(ids), _ttl())
+    return frozenset(ids)
+
+
+def are_friends(a_id: int, b_id: int) -> bool:
+    return int(b_id) in friend_ids(a_id)
+
+
+def mutual_friend_ids(a_id: int, b_id: int) -> frozenset[int]:
+    both = friend_ids_many([a_id, b_id])
+    return both[int(a_id)] & both[int(b_id)]
+
+
+def suggest_friend_ids(user_id: int, *, limit: int = 20, exclude: Iterable[int] = ()) -> list[tuple[int, int]]:
+    """
+    Друзья друзей, ранжированные по числу общих друзей: [(user_id, mutual_count), ...].
+    Один get_many по кэшу (+ один запрос на промахи).
+    """
+    user_id = int(user_id)
+    mine = friend_ids(user_id)
+    if not mine:
+        return []
+    counter: Counter[int] = Counter()
+    for ids in friend_ids_many(mine).values():
+        counter.update(ids)
+
+    skip = set(mine) | set(exclude) | {user_id}
+    ranked = ((uid, n) for uid, n in counter.most_common() if uid not in skip)
+    out = []
+    for item in ranked:
+        out.append(item)
+        if len(out) >= limit:
+            break
+    return out
+
+
+# ---- инвалидация ----
+
+def invalidate_edge(a_id: int, b_id: int) -> None:
+    """
+    Сбросить списки обоих концов ребра после коммита. Не патчим на месте: get + set без блокировки
+    теряет правку, если два ребра одного пользователя меняются одновременно.
+    """
+    keys = [_key(a_id), _key(b_id)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,130 @@
+# chat/gateway.py
+"""
+Мультиплексный сокет /ws/gateway/: один WebSocket на клиента вместо /ws/chat/<id>/ на каждую
+открытую комнату + /ws/notifications/. Рукопожатие, JWT, имя, профиль кадров — один раз.
+
+Клиент -> сервер:
+  {"type": "subscribe",   "room": 5}            или {"type": "subscribe", "rooms": [5, 7]}
+  {"type": "subscribe",   "room": 5, "last_event_id": N}  — подписка + досылка пропущенного
+  {"type": "resume",  "room": 5, "last_event_id": N}       (chat/replay.py)
+  {"type": "unsubscribe", "room": 5}
+  {"type": "typing",  "room": 5, "value": true}
+  {"type": "message", "room": 5, "content": "..."}
+  {"type": "ping"}
+
+Сервер -> клиент:
+  {"kind": "room", "room": 5, "data": <кадр как в /ws/chat/5/>}   — события комнат
+  {"kind": "subscribed"|"unsubscribed", "room": 5}
+  {"kind": "error", "room": 5, "code": 4403|4404|4429}
+  {"kind": "notification", ...}, {"kind": "meta:init", ...}          — как в /ws/notifications/
+
+Обработчики событий групп — те же, что у ChatConsumer и NotificationsConsumer (наследование);
+кадр комнаты заворачивается в конверт склейкой строк/байтов, без перекодирования.
+Гость (без JWT) может подписываться на публичные комнаты, уведомлений не получает.
+"""
+from __future__ import annotations
+
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from notifications.consumers import NotificationsConsumer
+
+from . import frames
+from .consumers import ChatConsumer, _safe_int, user_can_join_room
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayConsumer(ChatConsumer, NotificationsConsumer):
+    stats_prefix = "gateway"
+
+    async def connect(self):
+        self.rooms: set[int] = set()
+        subprotocol = await self.setup_connection()
+        await self.accept(subprotocol=subprotocol)
+        logger.info(
+            "[WS][GATEWAY] user_id=%s proto=%s profile=%s", self.user_id, subprotocol, self.profile,
+        )
+        if self.user_id:
+            await self.start_notifications(self.user_id)
+
+    async def disconnect(self, code):
+        try:
+            for room_id in list(getattr(self, "rooms", ())):
+                await self.leave_room(room_id)
+            await self.stop_notifications()
+        except Exception as e:
+            logger.warning("Gateway disconnect cleanup error: %s", e)
+
+    def _max_rooms(self) -> int:
+        return int(getattr(settings, "CHAT_GATEWAY_MAX_ROOMS", 50))
+
+    async def receive_json(self, content, **kwargs):
+        t = (content.get("type") or "").lower()
+        if t == "ping":
+            await self.send_json({"type": "pong", "ts": timezone.now().isoformat()})
+            return
+
+        if t in ("subscribe", "unsubscribe"):
+            rooms = content.get("rooms")
+            if not isinstance(rooms, list):
+                rooms = [content.get("room")]
+            for raw in rooms[: self._max_rooms()]:
+                room_id = _safe_int(raw)
+                if t == "subscribe":
+                    await self.subscribe(room_id)
+                else:
+                    await self.unsubscribe(room_id)
+            if t == "subscribe" and len(rooms) == 1 and content.get("last_event_id") is not None:
+                room_id = _safe_int(rooms[0])
+                if room_id in self.rooms:
+                    await self.resume_room(room_id, content.get("last_event_id"))
+            return
+
+        room_id = _safe_int(content.get("room"))
+        if room_id in self.rooms:
+            await self.handle_room_frame(room_id, t, content)
+
+    async def subscribe(self, room_id) -> None:
+        if not room_id:
+            await self.send_json({"kind": "error", "room": room_id, "code": 4404})
+            return
+        if room_id in self.rooms:
+            await self.send_json({"kind": "subscribed", "room": room_id})
+            return
+        if len(self.rooms) >= self._max_rooms():
+            await self.send_json({"kind": "error", "room": room_id, "code": 4429})
+            return
+        if not await user_can_join_room(room_id, self.user):
+            await self.send_json({"kind": "error", "room": room_id, "code": 4403})
+            return
+        self.rooms.add(room_id)
+        await self.join_room(room_id)
+        await self.send_json({"kind": "subscribed", "room": room_id})
+
+    async def unsubscribe(self, room_id) -> None:
+        if room_id in self.rooms:
+            self.rooms.discard(room_id)
+            await self.leave_room(room_id)
+        await self.send_json({"kind": "unsubscribed", "room": room_id})
+
+    async def send_frame(self, event) -> None:
+        room = event.get("room")
+        if room is None or room not in self.rooms:
+            # событие без комнаты (старый воркер) или от комнаты, от которой уже отписались
+            if room is None and "data" in event:
+                await self.send_json({"kind": "room", "room": None, "data": event["data"]})
+            return
+        text, raw = frames.pick_frame(event, binary=self.binary, profile=self.profile)
+        if raw is not None:
+            raw = frames.wrap_room_bytes(room, raw)
+            await frames.arecord(f"gateway:{event['type']}", len(raw), self.profile)
+            await self.send(bytes_data=raw)
+        elif text is not None:
+            text = frames.wrap_room_text(room, text)
+            await frames.arecord(f"gateway:{event['type']}", len(text.encode()), self.profile)
+            await self.send(text_data=text)
+        else:
+            await self.send_json({"kind": "room", "room": room, "data": event.get("data") or {}})
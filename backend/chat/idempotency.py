@@ -0,0 +1,185 @@
+# chat/idempotency.py
+"""
+Идемпотентная отправка сообщений по ключу клиента.
+
+REST: заголовок Idempotency-Key у POST /api/messages/ и POST /api/conversations/{id}/messages/.
+WS:   поле idempotency_key (или temp_id/tempId, которые фронт уже шлёт) в кадре type=message.
+
+Ключ живёт в кэше CHAT_IDEMPOTENCY_TTL секунд в пространстве (пользователь, комната, ключ):
+один temp_id, случайно отправленный в две комнаты, — две разные отправки. Комната общая
+для REST и WS; если комнату из запроса не разобрать — пространство эндпоинта (путь).
+  claim()    — add(): первый запрос занимает ключ ("pending"), повтор видит занятый;
+  complete() — после коммита кладёт id созданного сообщения (store() — сразу, если уже закоммичено);
+  release()  — при ошибке освобождает ключ, чтобы ретрай мог пройти;
+  lookup()   — только посмотреть (лимитер пропускает повтор уже созданного сообщения).
+В консьюмерах — aclaim/astore/arelease: async API кэша, без синхронного I/O в event loop.
+Повтор с тем же ключом получает исходное сообщение (REST — 201 + Idempotent-Replayed: true),
+без INSERT, inc_unread_for_others, сигналов и рассылок. Пока первый запрос ещё выполняется — 409.
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+KEY = "chat:idem:{}:{}"
+REMAP_KEY = "chat:idem:remap:{}"  # старый id -> перевыпущенный (manage.py backfill_message_ids)
+HEADER = "Idempotency-Key"
+PENDING = "pending"
+MAX_KEY_LENGTH = 255
+
+
+class KeyPending(Exception):
+    """Первый запрос с этим ключом ещё выполняется (в REST — 409 с Retry-After)."""
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_IDEMPOTENCY_TTL", 900))
+
+
+def _cache_key(user_id: int, scope: str, key: str) -> str:
+    return KEY.format(int(user_id), hashlib.sha1(f"{scope}\n{key}".encode()).hexdigest())
+
+
+def room_scope(room_id) -> str:
+    return f"room:{int(room_id)}"
+
+
+def request_scope(request, view_kwargs: dict) -> str:
+    """Пространство ключа REST-отправки: комната из URL (pk) или тела запроса, иначе путь."""
+    room_id = view_kwargs.get("pk") or request.data.get("room")
+    try:
+        return room_scope(room_id)
+    except (TypeError, ValueError):
+        return request.path
+
+
+def clean_key(raw) -> Optional[str]:
+    """Пустой ключ — None (обычная отправка), слишком длинный — ValueError."""
+    key = str(raw or "").strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"idempotency key longer than {MAX_KEY_LENGTH}")
+    return key
+
+
+def claim(user_id: int, scope: str, key: str) -> Optional[str]:
+    """None — ключ наш, можно создавать; PENDING — первый запрос ещё идёт; иначе id сообщения."""
+    ck = _cache_key(user_id, scope, key)
+    if cache.add(ck, PENDING, _ttl()):
+        return None
+    return cache.get(ck) or PENDING
+
+
+async def aclaim(user_id: int, scope: str, key: str) -> Optional[str]:
+    ck = _cache_key(user_id, scope, key)
+    if await cache.aadd(ck, PENDING, _ttl()):
+        return None
+    return await cache.aget(ck) or PENDING
+
+
+def lookup(user_id: int, scope: str, key: str) -> Optional[str]:
+    """None — ключ свободен; PENDING или id сообщения — как у claim, но ключ не занимается."""
+    return cache.get(_cache_key(user_id, scope, key))
+
+
+def complete(user_id: int, scope: str, key: str, message_id) -> None:
+    # вне транзакции выполняется сразу; если внешняя транзакция откатится,
+    # ключ так и останется PENDING до истечения TTL — дубля не будет
+    transaction.on_commit(lambda: store(user_id, scope, key, message_id))
+
+
+def store(user_id: int, scope: str, key: str, message_id) -> None:
+    """Сразу записать id сообщения (уже закоммиченного)."""
+    cache.set(_cache_key(user_id, scope, key), str(message_id), _ttl())
+
+
+async def astore(user_id: int, scope: str, key: str, message_id) -> None:
+    await cache.aset(_cache_key(user_id, scope, key), str(message_id), _ttl())
+
+
+def remember_remap(mapping: dict) -> None:
+    """{старый id: новый}: ключи в кэше ещё держат старые id, повтор должен найти перевыпущенное сообщение."""
+    cache.set_many({REMAP_KEY.format(old): str(new) for old, new in mapping.items()}, _ttl())
+
+
+def remapped(message_id) -> Optional[str]:
+    return cache.get(REMAP_KEY.format(message_id))
+
+
+async def aremapped(message_id) -> Optional[str]:
+    return await cache.aget(REMAP_KEY.format(message_id))
+
+
+def release(user_id: int, scope: str, key: str) -> None:
+    cache.delete(_cache_key(user_id, scope, key))
+
+
+async def arelease(user_id: int, scope: str, key: str) -> None:
+    await cache.adelete(_cache_key(user_id, scope, key))
+
+
+def idempotent_create(view_create):
+    """Декоратор create() у view сообщений: повтор с тем же Idempotency-Key отдаёт исходное сообщение."""
+
+    @functools.wraps(view_create)
+    def wrapper(self, request, *args, **kwargs):
+        user = request.user
+        try:
+            key = clean_key(request.headers.get(HEADER))
+        except ValueError:
+            raise ValidationError({HEADER: f"Не длиннее {MAX_KEY_LENGTH} символов."})
+        if not key or not getattr(user, "is_authenticated", False):
+            return view_create(self, request, *args, **kwargs)
+
+        scope = request_scope(request, kwargs)
+        found = claim(user.id, scope, key)
+        if found == PENDING:
+            return Response(
+                {"detail": "Запрос с этим Idempotency-Key ещё выполняется."},
+                status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "1"},
+            )
+        if found is not None:
+            return _replay(request, found)
+
+        try:
+            response = view_create(self, request, *args, **kwargs)
+        except Exception:
+            release(user.id, scope, key)
+            raise
+        if response.status_code == status.HTTP_201_CREATED and isinstance(response.data, dict) and response.data.get("id"):
+            complete(user.id, scope, key, response.data["id"])
+        else:
+            release(user.id, scope, key)
+        return response
+
+    return wrapper
+
+
+def _replay(request, message_id: str) -> Response:
+    from .models import Message
+    from .serializers import MessageSerializer
+
+    msg = Message.objects.select_related("author").filter(pk=message_id).first()
+    if msg is None:
+        new_id = remapped(message_id)
+        msg = Message.objects.select_related("author").filter(pk=new_id).first() if new_id else None
+    if msg is None:
+        return Response(
+            {"id": message_id, "detail": "Сообщение уже удалено."},
+            status=status.HTTP_409_CONFLICT,
+        )
+    return Response(
+        MessageSerializer(msg, context={"request": request}).data,
+        status=status.HTTP_201_CREATED,
+        headers={"Idempotent-Replayed": "true"},
+    )
@@ -0,0 +1,65 @@
+# chat/ids.py
+"""
+UUIDv7 (RFC 9562) для Message.id: старшие 48 бит — unix-время в мс, поэтому новые
+ключи ложатся в правый край B-tree первичного ключа, а порядок id совпадает с порядком создания.
+
+Раскладка: unix_ts_ms(48) | ver=7(4) | rand_a(12) | var=0b10(2) | rand_b(62).
+rand_a используем как счётчик внутри одной миллисекунды (метод 1 из RFC, п. 6.2) —
+id, выданные одним процессом, строго возрастают.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from uuid import UUID
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+_RAND_A_MAX = 0xFFF
+
+
+def _build(ms: int, rand_a: int, rand_b: int) -> UUID:
+    value = (ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76
+    value |= (rand_a & _RAND_A_MAX) << 64
+    value |= 0b10 << 62
+    value |= rand_b & ((1 << 62) - 1)
+    return UUID(int=value)
+
+
+def uuid7() -> UUID:
+    global _last_ms, _counter
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms = ms
+            _counter = int.from_bytes(os.urandom(2), "big") & 0x7FF  # половина диапазона — запас под счётчик
+        else:
+            # та же мс (или часы ушли назад) — продолжаем от последней метки
+            _counter += 1
+            if _counter > _RAND_A_MAX:
+                _last_ms += 1
+                _counter = 0
+            ms = _last_ms
+        counter = _counter
+    return _build(ms, counter, int.from_bytes(os.urandom(8), "big"))
+
+
+def uuid7_at(dt: datetime) -> UUID:
+    """UUIDv7 с меткой времени dt (для перевыпуска id старых сообщений по created_at)."""
+    ms = int(dt.timestamp() * 1000)
+    rand = int.from_bytes(os.urandom(10), "big")
+    return _build(ms, rand >> 64, rand)
+
+
+def is_uuid7(value: UUID) -> bool:
+    return value.version == 7
+
+
+def uuid7_datetime(value: UUID) -> datetime:
+    """Момент, зашитый в UUIDv7 (точность — миллисекунда)."""
+    return datetime.fromtimestamp((value.int >> 80) / 1000, tz=dt_timezone.utc)
@@ -0,0 +1,25 @@
+# chat/management/benchutil.py
+"""Общие помощники бенчмарков и нагрузочных команд (manage.py bench_* / soak_* / loadtest_*)."""
+from __future__ import annotations
+
+from channels.routing import URLRouter
+from django.urls import re_path
+
+from chat.consumers import ChatConsumer
+
+
+def app_for(user):
+    """ASGI-приложение /ws/chat/<room>/ с заранее аутентифицированным user (None — аноним)."""
+    inner = URLRouter([re_path(r"^ws/chat/(?P<room_id>\d+)/$", ChatConsumer.as_asgi())])
+
+    async def app(scope, receive, send):
+        return await inner({**scope, "user": user}, receive, send)
+    return app
+
+
+def pct(values: list[float], q: float) -> float:
+    """Перцентиль q (0..1) без интерполяции; 0.0 для пустого списка."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
@@ -0,0 +1,69 @@
+# chat/management/commands/archive_messages.py
+"""
+Перенос старых сообщений неактивных комнат в холодный архив (chat/archive.py).
+
+  python manage.py archive_messages                         # пороги из настроек
+  python manage.py archive_messages --older-than-days 180 --inactive-days 30
+  python manage.py archive_messages --room 42 --dry-run
+
+Комната неактивна, если в ней нет сообщений новее --inactive-days. Личные диалоги не архивируются:
+/api/conversations/<id>/messages/ отдаёт историю ЛС целиком из БД и в архив не ходит.
+Из неё уходят все сообщения старше --older-than-days: архив должен быть целиком старше горячих
+строк, иначе лента не дойдёт до архивных сообщений новее оставленных. Превью диалога,
+если Chat.last_message ушло в архив, берётся из архива.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from chat import archive
+from chat.models import Chat, ChatType, Message
+from chat.versioning import bump_room
+
+
+class Command(BaseCommand):
+    help = "Перенести старые сообщения неактивных комнат в zstd-сегменты на диске"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS)
+        parser.add_argument("--inactive-days", type=int, default=settings.CHAT_ARCHIVE_INACTIVE_DAYS)
+        parser.add_argument("--room", type=int, default=None)
+        parser.add_argument("--batch", type=int, default=5000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        now = timezone.now()
+        older_than = now - timedelta(days=opts["older_than_days"])
+        inactive_since = now - timedelta(days=opts["inactive_days"])
+
+        rooms = Chat.objects.exclude(type=ChatType.PRIVATE).filter(
+            ~Exists(Message.objects.filter(room=OuterRef("pk"), created_at__gte=inactive_since)),
+            Exists(Message.objects.filter(room=OuterRef("pk"), created_at__lt=older_than)),
+        ).only("id")
+        if opts["room"] is not None:
+            rooms = rooms.filter(pk=opts["room"])
+
+        total = 0
+        for room in rooms.iterator():
+            if opts["dry_run"]:
+                n = Message.objects.filter(room=room, created_at__lt=older_than).count()
+                self.stdout.write(f"room {room.id}: would archive {n}")
+                total += n
+                continue
+            try:
+                moved = archive.archive_room(room.id, older_than, batch=opts["batch"])
+            except archive.RoomBusy:
+                self.stdout.write(f"room {room.id}: busy, skipped")
+                continue
+            if moved:
+                bump_room(room.id)
+            self.stdout.write(f"room {room.id}: archived {moved}")
+            total += moved
+
+        verb = "would archive" if opts["dry_run"] else "archived"
+        self.stdout.write(f"done: {verb} {total} messages")
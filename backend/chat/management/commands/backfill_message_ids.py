@@ -0,0 +1,141 @@
+# chat/management/commands/backfill_message_ids.py
+"""
+Перевыпуск id старых сообщений (uuid4) в UUIDv7 с меткой времени = created_at.
+
+  python manage.py backfill_message_ids --batch 5000 [--sleep 0.2] [--settle 5] [--dry-run]
+
+Идёт по created_at (индекс) порциями; каждая порция — одна транзакция, в которой вместе
+с chat_message обновляются все ссылки: Message.reply_to, HiddenMessage.message, Chat.last_message,
+MessageReaction.message (внешних ключей в БД на chat_message нет — см. миграции 0011 и 0013).
+Команду можно прерывать и перезапускать: уже перевыпущенные id пропускаются. После завершения можно включить
+CHAT_MESSAGE_CURSOR_ON_ID.
+
+Работает без остановки приложения:
+  - порция блокирует свои строки chat_message (FOR UPDATE) и таблицы ссылок (SHARE ROW EXCLUSIVE):
+    незакоммиченная вставка реакции/скрытия дожидается и переписывается вместе с порцией;
+  - запрос, проверивший старый id до коммита порции, а вставивший ссылку после, ловит повторный
+    проход по ссылкам через --settle секунд;
+  - старые id, которые держат ключи идемпотентности, ведут к новым (idempotency.remember_remap),
+    журналы replay затронутых комнат сбрасываются (resume -> resume:reset), версии комнат поднимаются —
+    клиенты перечитывают страницы с новыми id. Действия клиента по старому id до перечитывания — 404.
+"""
+from __future__ import annotations
+
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat import idempotency, replay
+from chat.ids import uuid7_at
+from chat.versioning import bump_room
+
+SELECT_SQL = """
+SELECT id, created_at, room_id FROM chat_message
+WHERE created_at > %s
+ORDER BY created_at
+LIMIT %s
+"""
+
+SELECT_TIE_SQL = """
+SELECT id, created_at, room_id FROM chat_message WHERE created_at = %s
+"""
+
+# created_at в условии — отсечение секций
+MESSAGE_SQL = (
+    "UPDATE chat_message m SET id = map.new FROM _msg_id_map map "
+    "WHERE m.id = map.old AND m.created_at = map.created_at"
+)
+
+REFERENCE_SQL = [
+    "UPDATE chat_message m SET reply_to_id = map.new FROM _msg_id_map map WHERE m.reply_to_id = map.old",
+    "UPDATE chat_hiddenmessage h SET message_id = map.new FROM _msg_id_map map WHERE h.message_id = map.old",
+    "UPDATE chat_messagereaction r SET message_id = map.new FROM _msg_id_map map WHERE r.message_id = map.old",
+    "UPDATE chat_chat c SET last_message_id = map.new FROM _msg_id_map map WHERE c.last_message_id = map.old",
+]
+
+# запись ссылок ждёт конец порции; чтения не блокируются
+LOCK_SQL = "LOCK TABLE chat_hiddenmessage, chat_messagereaction IN SHARE ROW EXCLUSIVE MODE"
+
+LOCK_ROWS_SQL = """
+SELECT 1 FROM chat_message m JOIN _msg_id_map map ON m.id = map.old AND m.created_at = map.created_at
+FOR UPDATE OF m
+"""
+
+
+class Command(BaseCommand):
+    help = "Перевыпустить uuid4-id сообщений в UUIDv7 (по created_at), вместе со всеми ссылками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=5000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между порциями, сек")
+        parser.add_argument("--settle", type=float, default=5.0,
+                            help="через сколько секунд после порции повторно переписать ссылки на её старые id")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        batch, cursor = opts["batch"], "-infinity"
+        total = rewritten = 0
+        started = time.perf_counter()
+        settling = deque()  # (время коммита порции, mapping) — ждут повторного прохода по ссылкам
+
+        while True:
+            with connection.cursor() as cur:
+                cur.execute(SELECT_SQL, [cursor, batch])
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                edge = rows[-1][1]
+                # строки с тем же created_at, что и последняя, могли не влезть в LIMIT — добираем
+                if len(rows) == batch:
+                    rows = [r for r in rows if r[1] != edge]
+                    cur.execute(SELECT_TIE_SQL, [edge])
+                    rows += cur.fetchall()
+            cursor = edge
+            total += len(rows)
+
+            mapping = [(mid, uuid7_at(created_at), created_at) for mid, created_at, _ in rows if mid.version != 7]
+            if mapping and not opts["dry_run"]:
+                self._apply(mapping, [LOCK_SQL, LOCK_ROWS_SQL, MESSAGE_SQL, *REFERENCE_SQL])
+                idempotency.remember_remap({old: new for old, new, _ in mapping})
+                for room_id in {r[2] for r in rows}:
+                    replay.reset(room_id)
+                    bump_room(room_id)
+                settling.append((time.monotonic(), mapping))
+            self._settle(settling, opts["settle"], wait=False)
+            rewritten += len(mapping)
+            self.stdout.write(f"scanned {total}, rewritten {rewritten} (up to {edge.isoformat()})")
+            if opts["sleep"]:
+                time.sleep(opts["sleep"])
+
+        self._settle(settling, opts["settle"], wait=True)
+        verb = "would rewrite" if opts["dry_run"] else "rewritten"
+        self.stdout.write(f"done: {verb} {rewritten} of {total} in {time.perf_counter() - started:.1f}s")
+
+    def _settle(self, settling: deque, delay: float, *, wait: bool) -> None:
+        while settling:
+            committed_at, mapping = settling[0]
+            left = committed_at + delay - time.monotonic()
+            if left > 0:
+                if not wait:
+                    return
+                time.sleep(left)
+            settling.popleft()
+            self._apply(mapping, [LOCK_SQL, *REFERENCE_SQL])
+
+    @transaction.atomic
+    def _apply(self, mapping, statements: list[str]) -> None:
+        olds, news, stamps = zip(*mapping)
+        with connection.cursor() as cur:
+            cur.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS _msg_id_map "
+                "(old uuid PRIMARY KEY, new uuid NOT NULL, created_at timestamptz NOT NULL) ON COMMIT DELETE ROWS"
+            )
+            cur.execute("DELETE FROM _msg_id_map")
+            cur.execute(
+                "INSERT INTO _msg_id_map SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::timestamptz[])",
+                [list(olds), list(news), list(stamps)],
+            )
+            for sql in statements:
+                cur.execute(sql)
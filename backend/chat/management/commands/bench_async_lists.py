@@ -0,0 +1,139 @@
+# chat/management/commands/bench_async_lists.py
+"""
+Бенчмарк горячих GET-списков под ASGI: async-представления (config/async_api.py)
+против прежних синхронных DRF-представлений (ASYNC_LIST_VIEWS=False).
+
+  python manage.py bench_async_lists
+  python manage.py bench_async_lists --concurrency 100 --requests 2000 --endpoints messages,notifications
+
+Запросы идут через ASGI-обработчик Django (django.test.AsyncClient: get_response_async,
+middleware в async-режиме) с JWT в Authorization — как под daphne, но без сети.
+--concurrency корутин шлют запросы без пауз, пока не наберётся --requests на эндпоинт.
+Печатает req/s, p50/p99 и число SQL-запросов на один ответ.
+
+Пишет в настроенную БД (пользователи, диалоги, комната, сообщения, уведомления удаляются
+в конце). Только на стенде.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.management.benchutil import pct
+from chat.models import Chat, Message
+from chat.services import get_or_create_private_chat
+from notifications.models import Notification
+
+MODES = ("sync", "async")
+ENDPOINTS = ("messages", "conversations", "notifications")
+
+
+class Command(BaseCommand):
+    help = "Сравнить req/s и p99 горячих списков: async-представления против DRF под ASGI"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--conversations", type=int, default=20)
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--notifications", type=int, default=100)
+        parser.add_argument("--modes", default=",".join(MODES))
+        parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        endpoints = [e.strip() for e in opts["endpoints"].split(",") if e.strip()]
+        unknown = (set(modes) - set(MODES)) | (set(endpoints) - set(ENDPOINTS))
+        if unknown:
+            raise CommandError(f"неизвестные режимы/эндпоинты: {', '.join(sorted(unknown))}")
+        if opts["concurrency"] < 1 or opts["requests"] < 1 or opts["users"] < 1:
+            raise CommandError("--concurrency, --requests и --users должны быть > 0")
+
+        tag = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        users = [
+            User.objects.create_user(email=f"bench-{tag}-{i}@example.invalid", nickname=f"bench{i}")
+            for i in range(opts["users"] + opts["conversations"])
+        ]
+        readers, peers = users[:opts["users"]], users[opts["users"]:]
+        room = Chat.objects.create(name=f"bench-{tag}")
+        Message.objects.bulk_create([
+            Message(room=room, author=readers[i % len(readers)], content=f"bench {i}")
+            for i in range(opts["messages"])
+        ])
+        chats = []
+        for reader in readers:
+            for peer in peers:
+                chat, _ = get_or_create_private_chat(reader, peer)
+                Message.objects.create(room=chat, author=peer, content="hi")
+                chats.append(chat.id)
+        Notification.objects.bulk_create([
+            Notification(user=reader, type=Notification.Types.SYSTEM, payload={"i": i})
+            for reader in readers for i in range(opts["notifications"])
+        ])
+
+        urls = {
+            "messages": f"/api/messages/?room={room.id}",
+            "conversations": "/api/conversations/",
+            "notifications": "/api/notifications/?is_read=false",
+        }
+        tokens = [f"Bearer {AccessToken.for_user(u)}" for u in readers]
+        try:
+            for endpoint in endpoints:
+                for mode in modes:
+                    # тестовые клиенты ходят с Host: testserver
+                    with override_settings(ASYNC_LIST_VIEWS=(mode == "async"),
+                                           ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                        per_req = self._count_queries(urls[endpoint], tokens[0])
+                        self.stdout.write(self._run(endpoint, mode, urls[endpoint], tokens, per_req, opts))
+        finally:
+            Message.objects.filter(room_id__in=[room.id] + chats).delete()
+            Chat.objects.filter(pk__in=[room.id] + chats).delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    def _count_queries(self, url: str, token: str) -> int:
+        # синхронный клиент: и async-путь, и DRF выполняются в этом потоке — запросы видны
+        client = Client(headers={"Authorization": token})
+        with CaptureQueriesContext(connection) as ctx:
+            res = client.get(url)
+        if res.status_code != 200:
+            raise CommandError(f"{url}: HTTP {res.status_code}")
+        return len(ctx.captured_queries)
+
+    def _run(self, endpoint: str, mode: str, url: str, tokens: list[str], per_req: int, opts) -> str:
+        latencies: list[float] = []
+        errors = {"n": 0}
+        left = {"n": opts["requests"]}
+
+        async def worker(n: int):
+            client = AsyncClient()
+            headers = {"Authorization": tokens[n % len(tokens)]}
+            while left["n"] > 0:
+                left["n"] -= 1
+                t0 = time.perf_counter()
+                res = await client.get(url, headers=headers)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if res.status_code != 200:
+                    errors["n"] += 1
+
+        async def main():
+            await asyncio.gather(*(worker(n) for n in range(opts["concurrency"])))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        return (
+            f"{endpoint:<13} {mode:<5}: {len(latencies) / max(elapsed, 1e-9):.0f} req/s "
+            f"p50={pct(latencies, 0.5):.1f}ms p99={pct(latencies, 0.99):.1f}ms "
+            f"queries/req={per_req} errors={errors['n']}"
+        )
@@ -0,0 +1,215 @@
+# chat/management/commands/bench_consumer_db.py
+"""
+Бенчмарк DB-помощников консьюмеров: async ORM (как сейчас) против прежних синхронных
+тел в database_sync_to_async.
+
+  python manage.py bench_consumer_db
+  python manage.py bench_consumer_db --workers 200 --ops 20 --modes thread,async
+
+Сценарии (каждый — --workers корутин по --ops итераций одновременно):
+  connect — рукопожатие: ChatConsumer (права на комнату, имя, профиль кадров) +
+            NotificationsConsumer (непрочитанные, активность, настройки присутствия, друзья);
+  message — создание сообщения с ключом идемпотентности (повтор send с тем же temp_id).
+Печатает ops/s, p50/p99 одной операции и число SQL-запросов на операцию.
+
+Оба режима ходят в БД через один thread-sensitive исполнитель asgiref — async ORM Django
+пока не асинхронен на уровне драйвера. Выигрыш — меньше запросов и переходов в поток на путь.
+Пишет в настроенную БД (комната, пользователи и сообщения удаляются в конце). Только на стенде.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
+
+from chat import consumers, frames, idempotency
+from chat.management.benchutil import pct
+from chat.models import Chat, ChatParticipant, ChatType, Message
+from notifications import consumers as notif
+
+MODES = ("thread", "async")
+SCENARIOS = ("connect", "message")
+
+
+# ---- прежние помощники (database_sync_to_async), для сравнения ----
+
+@database_sync_to_async
+def _thread_can_join(chat_id, user) -> bool:
+    try:
+        chat = Chat.objects.prefetch_related("participants").get(id=chat_id)
+    except Chat.DoesNotExist:
+        return False
+    if chat.type == ChatType.PRIVATE:
+        return bool(user and user.is_authenticated) and chat.participants.filter(id=user.id).exists()
+    return True
+
+
+@database_sync_to_async
+def _thread_display_name(user_id) -> str:
+    u = get_user_model().objects.get(pk=user_id)
+    for field in ("nickname", "display_name", "username", "email", "first_name"):
+        val = getattr(u, field, None)
+        if val:
+            return str(val)
+    return "User"
+
+
+@database_sync_to_async
+def _thread_profile(user_id) -> str:
+    return frames.profile_for_user(user_id)
+
+
+@database_sync_to_async
+def _thread_unread(user_id) -> int:
+    from notifications.models import Notification
+    return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+
+@database_sync_to_async
+def _thread_activity(user_id) -> None:
+    User = get_user_model()
+    u = User.objects.only("id").get(pk=user_id)
+    if hasattr(u, "last_activity"):
+        User.objects.filter(pk=user_id).update(last_activity=u.last_activity)
+
+
+@database_sync_to_async
+def _thread_presence(user_id) -> bool:
+    from users.models import UserSettings
+    try:
+        return bool(UserSettings.objects.only("online_status").get(user_id=user_id).online_status)
+    except UserSettings.DoesNotExist:
+        return True
+
+
+@database_sync_to_async
+def _thread_friends(user_id) -> list[int]:
+    from chat.friend_graph import friend_ids
+    return list(friend_ids(user_id))
+
+
+@database_sync_to_async
+def _thread_create(room_id, user_id, content, key):
+    scope = idempotency.room_scope(room_id)
+    found = idempotency.claim(user_id, scope, key)
+    if found is not None and found != idempotency.PENDING:
+        return Message.objects.filter(pk=found).first(), False
+    with transaction.atomic():
+        msg = Message.objects.create(room_id=room_id, author_id=user_id, content=content)
+        idempotency.complete(user_id, scope, key, msg.id)
+    return msg, True
+
+
+async def _connect_thread(room_id, user):
+    await _thread_can_join(room_id, user)
+    await _thread_display_name(user.id)
+    await _thread_profile(user.id)
+    await _thread_unread(user.id)
+    await _thread_activity(user.id)
+    if await _thread_presence(user.id):
+        await _thread_friends(user.id)
+
+
+async def _connect_async(room_id, user):
+    await consumers.user_can_join_room(room_id, user)
+    await consumers.get_user_display_name(user.id)
+    await consumers.get_frame_profile(user.id)
+    await notif._get_unread_count(user.id)
+    await notif._update_user_activity(user.id)
+    if await notif._can_broadcast_presence(user.id):
+        await notif._get_friend_ids(user.id)
+
+
+class Command(BaseCommand):
+    help = "Сравнить DB-помощники консьюмеров: async ORM против database_sync_to_async"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=100)
+        parser.add_argument("--ops", type=int, default=20)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--modes", default=",".join(MODES))
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        scenarios = [s.strip() for s in opts["scenarios"].split(",") if s.strip()]
+        unknown = (set(modes) - set(MODES)) | (set(scenarios) - set(SCENARIOS))
+        if unknown:
+            raise CommandError(f"неизвестные режимы/сценарии: {', '.join(sorted(unknown))}")
+        if opts["workers"] < 1 or opts["ops"] < 1 or opts["users"] < 1:
+            raise CommandError("--workers, --ops и --users должны быть > 0")
+
+        tag = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(email=f"bench-{tag}-{i}@example.invalid", nickname=f"bench{i}") for i in range(opts["users"])
+        ])
+        room = Chat.objects.create(name=f"bench-{tag}", type=ChatType.PRIVATE)
+        ChatParticipant.objects.bulk_create([ChatParticipant(chat=room, user=u) for u in users])
+
+        opened = {"n": 0}
+
+        def on_connect(sender, connection, **kwargs):
+            opened["n"] += 1
+
+        connection_created.connect(on_connect, dispatch_uid="bench_consumer_db")
+        try:
+            for scenario in scenarios:
+                for mode in modes:
+                    self.stdout.write(self._run(scenario, mode, room.id, users, opened, opts))
+        finally:
+            connection_created.disconnect(dispatch_uid="bench_consumer_db")
+            Message.objects.filter(room=room).delete()
+            room.delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    def _run(self, scenario, mode, room_id, users, opened, opts) -> str:
+        latencies: list[float] = []
+        run = uuid.uuid4().hex[:6]
+        create = _thread_create if mode == "thread" else consumers.create_message
+        connect = _connect_thread if mode == "thread" else _connect_async
+
+        async def one(w: int, i: int):
+            user = users[(w + i) % len(users)]
+            t0 = time.perf_counter()
+            if scenario == "connect":
+                await connect(room_id, user)
+            else:
+                key = f"bench-{run}-{w}-{i}"
+                await create(room_id, user.id, f"bench {w}:{i}", key)
+                await create(room_id, user.id, f"bench {w}:{i}", key)  # повтор с тем же ключом
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        async def worker(w: int):
+            for i in range(opts["ops"]):
+                await one(w, i)
+
+        async def main():
+            await asyncio.gather(*(worker(w) for w in range(opts["workers"])))
+
+        # прогрев (кэш друзей) и подсчёт запросов: под async_to_sync thread-sensitive код
+        # выполняется в этом же потоке, и CaptureQueriesContext видит его соединение
+        async_to_sync(one)(-1, 0)
+        with CaptureQueriesContext(connection) as ctx:
+            async_to_sync(one)(-2, 0)
+        per_op = len(ctx.captured_queries)
+        latencies.clear()
+
+        opened_before = opened["n"]
+        started = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        total = opts["workers"] * opts["ops"]
+        return (
+            f"{scenario:<8} {mode:<6}: ops={total} {total / max(elapsed, 1e-9):.0f} ops/s "
+            f"p50={pct(latencies, 0.5):.1f}ms p99={pct(latencies, 0.99):.1f}ms "
+            f"queries/op={per_op} db connects={opened['n'] - opened_before}"
+        )
@@ -0,0 +1,83 @@
+# chat/management/commands/bench_message_ids.py
+"""
+Бенчмарк вставки: первичный ключ uuid4 против UUIDv7 (chat/ids.py).
+
+  python manage.py bench_message_ids --rows 50000000 --batch 50000
+  python manage.py bench_message_ids --rows 2000000 --kinds v7 --keep
+
+Для каждого вида создаётся отдельная таблица bench_msg_ids_<kind> (uuid PK + created_at + room_id
++ короткий текст, как у chat_message) и заполняется порциями INSERT ... SELECT unnest(...).
+Печатает строк/с в целом и на последних 10% (когда индекс уже не влезает в shared_buffers,
+uuid4 деградирует из-за случайных страниц), а также размер индекса PK.
+Запускать только на стенде.
+"""
+from __future__ import annotations
+
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.ids import uuid7
+
+GENERATORS = {"v4": uuid.uuid4, "v7": uuid7}
+
+
+class Command(BaseCommand):
+    help = "Сравнить скорость вставки и размер PK-индекса для uuid4 и UUIDv7"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50_000_000)
+        parser.add_argument("--batch", type=int, default=50_000)
+        parser.add_argument("--kinds", default="v4,v7")
+        parser.add_argument("--keep", action="store_true", help="не удалять таблицы после замера")
+
+    def handle(self, *args, **opts):
+        kinds = [k.strip() for k in opts["kinds"].split(",") if k.strip()]
+        unknown = set(kinds) - set(GENERATORS)
+        if unknown:
+            raise CommandError(f"неизвестные виды: {', '.join(sorted(unknown))}")
+        for kind in kinds:
+            self._run(kind, opts["rows"], opts["batch"], opts["keep"])
+
+    def _run(self, kind: str, rows: int, batch: int, keep: bool) -> None:
+        table = f"bench_msg_ids_{kind}"
+        gen = GENERATORS[kind]
+        rnd = random.Random(0)
+        with connection.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute(
+                f"CREATE TABLE {table} (id uuid PRIMARY KEY, created_at timestamptz NOT NULL DEFAULT now(), "
+                f"room_id bigint NOT NULL, content text NOT NULL)"
+            )
+
+            done, tail_from = 0, int(rows * 0.9)
+            started = time.perf_counter()
+            tail_started = None
+            while done < rows:
+                size = min(batch, rows - done)
+                if tail_started is None and done >= tail_from:
+                    tail_started, tail_done = time.perf_counter(), done
+                ids = [gen() for _ in range(size)]
+                rooms = [rnd.randint(1, 10_000) for _ in range(size)]
+                cur.execute(
+                    f"INSERT INTO {table} (id, room_id, content) "
+                    f"SELECT i, r, 'bench' FROM unnest(%s::uuid[], %s::bigint[]) AS t(i, r)",
+                    [ids, rooms],
+                )
+                done += size
+            elapsed = time.perf_counter() - started
+            tail_elapsed = time.perf_counter() - (tail_started or started)
+            tail_rows = done - (tail_done if tail_started else 0)
+
+            cur.execute("SELECT pg_relation_size(%s)", [f"{table}_pkey"])
+            index_bytes = cur.fetchone()[0]
+            if not keep:
+                cur.execute(f"DROP TABLE {table}")
+
+        self.stdout.write(
+            f"{kind}: rows={done} total={elapsed:.1f}s rate={done / elapsed:,.0f}/s "
+            f"last10%={tail_rows / max(tail_elapsed, 1e-9):,.0f}/s pkey={index_bytes / 2**20:.1f}MiB"
+        )
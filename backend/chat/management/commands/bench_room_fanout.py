@@ -0,0 +1,116 @@
+# chat/management/commands/bench_room_fanout.py
+"""
+Бенчмарк рассылки в большую комнату: старые события (dict + send_json на каждого получателя)
+против предкодированных кадров (chat/frames.py).
+
+  python manage.py bench_room_fanout --members 5000 --messages 200
+  python manage.py bench_room_fanout --members 5000 --modes legacy,json --content-size 2000
+
+Работает с настроенным CHANNEL_LAYERS (InMemory / Redis): в группу добавляется --members каналов,
+на каждое сообщение — один group_send и вычитка всех каналов с тем действием, которое делает
+ChatConsumer для кадра (legacy — json.dumps словаря, json — готовый text, msgpack — готовые bytes).
+Печатает доставленных кадров/с, сообщений/с и средний размер кадра. Запускать только на стенде.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import frames
+
+MODES = ("legacy", "json", "msgpack")
+
+
+def _payload(i: int, content_size: int) -> dict:
+    # по форме — как MessageSerializer
+    return {
+        "id": str(uuid.uuid4()),
+        "room": 1,
+        "author_id": 42,
+        "display_name": "bench",
+        "author": {"id": 42, "nickname": "bench", "avatar": "/media/avatars/bench.png"},
+        "content": ("x" * content_size)[:content_size] or f"m{i}",
+        "attachment_url": None,
+        "attachment_name": "",
+        "attachment_type": "",
+        "reply_to": None,
+        "created_at": timezone.now().isoformat(),
+        "edited_at": None,
+        "meta": {},
+    }
+
+
+class Command(BaseCommand):
+    help = "Сравнить пропускную способность рассылки в комнату: dict+send_json против готовых кадров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, default=5000)
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--content-size", type=int, default=200)
+        parser.add_argument("--modes", default=",".join(MODES))
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"неизвестные режимы: {', '.join(sorted(unknown))}")
+        if "msgpack" in modes and not frames.msgpack_enabled():
+            self.stderr.write("msgpack недоступен (pip install msgpack / CHAT_WS_MSGPACK) — режим пропущен")
+            modes.remove("msgpack")
+        for mode in modes:
+            self.stdout.write(asyncio.run(self._run(mode, opts["members"], opts["messages"], opts["content_size"])))
+
+    @staticmethod
+    async def _receive(layer, name: str) -> dict:
+        # InMemoryChannelLayer.receive чистит просроченное по всем каналам на каждый вызов —
+        # на 5k каналов в одном процессе это квадрат, которого у настоящих консьюмеров нет
+        queues = getattr(layer, "channels", None)
+        if isinstance(queues, dict) and name in queues:
+            return queues[name].get_nowait()[1]
+        return await layer.receive(name)
+
+    async def _run(self, mode: str, members: int, messages: int, content_size: int) -> str:
+        layer = get_channel_layer()
+        group = f"bench_fanout_{uuid.uuid4().hex[:8]}"
+        channels = [await layer.new_channel() for _ in range(members)]
+        for name in channels:
+            await layer.group_add(group, name)
+
+        sent_bytes = 0
+        started = time.perf_counter()
+        try:
+            for i in range(messages):
+                data = _payload(i, content_size)
+                if mode == "legacy":
+                    event = {"type": "chat_message", "data": data}
+                else:
+                    event = frames.make_event("chat_message", data)
+                await layer.group_send(group, event)
+
+                for name in channels:
+                    got = await self._receive(layer, name)
+                    # то, что консьюмер делает перед записью в сокет
+                    if mode == "legacy":
+                        frame = json.dumps(got["data"]).encode()
+                    elif mode == "json":
+                        frame = got["text"].encode()
+                    else:
+                        frame = got["bytes"]
+                    sent_bytes += len(frame)
+        finally:
+            for name in channels:
+                await layer.group_discard(group, name)
+        elapsed = time.perf_counter() - started
+
+        frames_total = members * messages
+        return (
+            f"{mode}: members={members} messages={messages} total={elapsed:.2f}s "
+            f"frames/s={frames_total / elapsed:,.0f} msg/s={messages / elapsed:,.1f} "
+            f"avg_frame={sent_bytes / max(frames_total, 1):.0f}B"
+        )
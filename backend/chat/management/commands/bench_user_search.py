@@ -0,0 +1,110 @@
+# chat/management/commands/bench_user_search.py
+"""
+Бенчмарк поиска пользователей (chat.search.search_users) на синтетических данных.
+
+  python manage.py bench_user_search --users 1000000 --queries 200
+  python manage.py bench_user_search --skip-seed          # данные уже засеяны
+  python manage.py bench_user_search --cleanup            # удалить синтетических пользователей
+
+Синтетические пользователи: email bench-<n>@bench.invalid (без пароля, без UserSettings).
+Запускать только на стенде, не на боевой БД.
+"""
+from __future__ import annotations
+
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from chat.management.benchutil import pct
+from chat.search import search_users
+
+BENCH_DOMAIN = "bench.invalid"
+_SYLLABLES = ["al", "ex", "an", "der", "ma", "ri", "ka", "te", "ol", "ga", "ni", "ko", "la", "iv", "se", "rg"]
+
+
+def _word(rnd: random.Random) -> str:
+    return "".join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+
+class Command(BaseCommand):
+    help = "Засеять N синтетических пользователей и замерить латентность /api/users/search/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000)
+        parser.add_argument("--batch", type=int, default=10_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--email-share", type=float, default=0.25, help="доля запросов-префиксов почты")
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--skip-seed", action="store_true")
+        parser.add_argument("--cleanup", action="store_true")
+
+    def handle(self, *args, **opts):
+        User = get_user_model()
+        bench_qs = User.objects.filter(email__endswith=f"@{BENCH_DOMAIN}")
+
+        if opts["cleanup"]:
+            deleted, _ = bench_qs.delete()
+            self.stdout.write(f"deleted {deleted} rows")
+            return
+
+        rnd = random.Random(opts["seed"])
+        if not opts["skip_seed"]:
+            self._seed(User, bench_qs.count(), opts["users"], opts["batch"], rnd)
+
+        with connection.cursor() as cur:
+            cur.execute("ANALYZE users_user")
+
+        me = User.objects.filter(email__endswith=f"@{BENCH_DOMAIN}").order_by("id").first()
+        if me is None:
+            self.stderr.write("нет синтетических пользователей — запустите без --skip-seed")
+            return
+
+        total = bench_qs.count()
+        queries = [
+            # префикс почты с пунктуацией — путь LIKE по users_user_email_like
+            ("email", f"bench-{rnd.randrange(total)}@{BENCH_DOMAIN}"[: rnd.randint(8, 20)])
+            if rnd.random() < opts["email_share"] else ("word", _word(rnd)[: rnd.randint(2, 6)])
+            for _ in range(opts["queries"])
+        ]
+        timings = {"all": [], "email": [], "word": []}
+        for kind, q in queries:
+            started = time.perf_counter()
+            list(search_users(me, q).order_by("sort_key")[: opts["page_size"]])
+            elapsed = (time.perf_counter() - started) * 1000
+            timings["all"].append(elapsed)
+            timings[kind].append(elapsed)
+
+        users = User.objects.count()
+        for kind, values in timings.items():
+            if not values:
+                continue
+            self.stdout.write(
+                f"users={users} {kind}: queries={len(values)} p50={statistics.median(values):.1f}ms "
+                f"p95={pct(values, 0.95):.1f}ms p99={pct(values, 0.99):.1f}ms max={max(values):.1f}ms"
+            )
+
+    def _seed(self, User, existing: int, total: int, batch: int, rnd: random.Random) -> None:
+        password = make_password(None)
+        n = existing
+        started = time.perf_counter()
+        while n < total:
+            size = min(batch, total - n)
+            User.objects.bulk_create([
+                User(
+                    email=f"bench-{n + i}@{BENCH_DOMAIN}",
+                    password=password,
+                    nickname=_word(rnd),
+                    first_name=_word(rnd).capitalize(),
+                    last_name=_word(rnd).capitalize(),
+                )
+                for i in range(size)
+            ])
+            n += size
+            self.stdout.write(f"seeded {n}/{total}")
+        self.stdout.write(f"seed done in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,32 @@
+# chat/management/commands/flush_reactions.py
+"""
+Счётчики реакций в Message.meta["reactions"] (chat/reactions.py).
+
+  python manage.py flush_reactions                       # разобрать общий журнал грязных сообщений
+  python manage.py flush_reactions --rebuild             # пересчитать все сообщения с реакциями
+  python manage.py flush_reactions --rebuild --room 5    # только комнату 5
+
+Без --rebuild команда добивает журнал, если воркеры завершились раньше своих таймеров (её можно
+ставить в cron). --rebuild нужен после потери кэша или ручной правки chat_messagereaction.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from chat import reactions
+
+
+class Command(BaseCommand):
+    help = "Пересчитать счётчики реакций в Message.meta"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true")
+        parser.add_argument("--room", type=int, default=None)
+        parser.add_argument("--chunk", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        if opts["rebuild"]:
+            n = reactions.rebuild(room_id=opts["room"], chunk=opts["chunk"])
+        else:
+            n = reactions.flush_counts()
+        self.stdout.write(f"messages updated: {n}")
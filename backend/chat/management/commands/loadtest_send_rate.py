@@ -0,0 +1,142 @@
+# chat/management/commands/loadtest_send_rate.py
+"""
+Нагрузочный тест лимита отправки (chat/ratelimit.py): один спамер против обычных участников комнаты.
+
+  python manage.py loadtest_send_rate
+  python manage.py loadtest_send_rate --users 10 --spam-sockets 16 --spam-rate 500 --duration 20
+
+В публичной комнате открываются сокеты ChatConsumer (как у /ws/chat/<id>/, без JWT — пользователь
+подставляется в scope): --spam-sockets вкладок одного спамера шлют type=message по --spam-rate в секунду,
+--users обычных участников — по сообщению раз в --interval секунд, ещё один гость слушает комнату.
+Для каждого режима (off — CHAT_SEND_RATE_LIMIT выключен, on — включен) печатается задержка
+«отправил -> гость получил» у сообщений обычных участников (p50/p95/max), сколько их не дошло
+за --grace секунд, и сколько спама прошло в комнату.
+
+Пишет в настроенную БД (комната, пользователи и сообщения удаляются в конце) и использует
+настроенные CACHES / CHANNEL_LAYERS. Запускать только на стенде.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat import ratelimit
+from chat.management.benchutil import app_for, pct
+from chat.models import Chat, Message
+
+MODES = ("off", "on")
+
+
+class Command(BaseCommand):
+    help = "Показать, что один спамер не поднимает задержку доставки остальным в комнате"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5)
+        parser.add_argument("--spam-sockets", type=int, default=8)
+        parser.add_argument("--spam-rate", type=float, default=200.0)
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--interval", type=float, default=1.0)
+        parser.add_argument("--grace", type=float, default=5.0)
+        parser.add_argument("--modes", default=",".join(MODES))
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"неизвестные режимы: {', '.join(sorted(unknown))}")
+
+        tag = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        room = Chat.objects.create(name=f"loadtest-{tag}")
+        spammer = User.objects.create_user(email=f"loadtest-{tag}-spam@example.invalid")
+        users = [
+            User.objects.create_user(email=f"loadtest-{tag}-{i}@example.invalid")
+            for i in range(opts["users"])
+        ]
+        try:
+            for mode in modes:
+                # вёдра прошлого прогона не должны влиять на следующий
+                cache.delete_many([key for key, _, _ in ratelimit.send_buckets(spammer.id, room.id)])
+                cache.delete_many([ratelimit.USER_KEY.format(u.id) for u in users])
+                with override_settings(CHAT_SEND_RATE_LIMIT=(mode == "on")):
+                    self.stdout.write(asyncio.run(self._run(mode, room.id, spammer, users, opts)))
+        finally:
+            Message.objects.filter(room=room).delete()
+            room.delete()
+            User.objects.filter(pk__in=[spammer.pk] + [u.pk for u in users]).delete()
+
+    async def _run(self, mode: str, room_id: int, spammer, users, opts) -> str:
+        path = f"/ws/chat/{room_id}/"
+        listener = WebsocketCommunicator(app_for(None), path)
+        spam_socks = [WebsocketCommunicator(app_for(spammer), path) for _ in range(opts["spam_sockets"])]
+        user_socks = [WebsocketCommunicator(app_for(u), path) for u in users]
+        all_socks = [listener] + spam_socks + user_socks
+        for comm in all_socks:
+            connected, _ = await comm.connect()
+            if not connected:
+                raise CommandError("сокет не подключился")
+
+        sent_at: dict[str, float] = {}
+        latencies: list[float] = []
+        spam = {"sent": 0, "delivered": 0}
+        stop = asyncio.Event()
+
+        async def listen():
+            while True:
+                try:
+                    frame = await listener.receive_json_from(timeout=opts["grace"] + opts["duration"])
+                except Exception:
+                    return
+                # message:new в /ws/chat/ — плоский кадр сообщения (id, content, ...)
+                data = frame.get("payload") if frame.get("type") == "message:new" else frame
+                if not isinstance(data, dict) or "content" not in data or "id" not in data:
+                    continue
+                content = data["content"] or ""
+                if content in sent_at:
+                    latencies.append(time.perf_counter() - sent_at.pop(content))
+                elif content.startswith("spam"):
+                    spam["delivered"] += 1
+
+        async def flood(comm):
+            pause = 1.0 / opts["spam_rate"] if opts["spam_rate"] > 0 else 0
+            while not stop.is_set():
+                await comm.send_json_to({"type": "message", "content": "spam"})
+                spam["sent"] += 1
+                await asyncio.sleep(pause)
+
+        async def chat(comm, n: int):
+            seq = 0
+            while not stop.is_set():
+                content = f"u{n}:{seq}:{uuid.uuid4().hex[:6]}"
+                sent_at[content] = time.perf_counter()
+                await comm.send_json_to({"type": "message", "content": content})
+                seq += 1
+                await asyncio.sleep(opts["interval"])
+
+        listen_task = asyncio.create_task(listen())
+        workers = [asyncio.create_task(flood(c)) for c in spam_socks]
+        workers += [asyncio.create_task(chat(c, i)) for i, c in enumerate(user_socks)]
+        await asyncio.sleep(opts["duration"])
+        stop.set()
+        await asyncio.gather(*workers)
+
+        deadline = time.perf_counter() + opts["grace"]
+        while sent_at and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        listen_task.cancel()
+        for comm in all_socks:
+            await comm.disconnect()
+
+        ms = [x * 1000 for x in latencies]
+        return (
+            f"{mode}: users={len(users)} delivered={len(ms)} lost={len(sent_at)} "
+            f"p50={pct(ms, 0.5):.0f}ms p95={pct(ms, 0.95):.0f}ms max={max(ms, default=0):.0f}ms | "
+            f"spam sent={spam['sent']} delivered={spam['delivered']}"
+        )
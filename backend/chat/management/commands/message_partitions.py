@@ -0,0 +1,56 @@
+# chat/management/commands/message_partitions.py
+"""
+Обслуживание секций chat_message (см. chat/partitions.py).
+
+  python manage.py message_partitions list
+  python manage.py message_partitions ensure [--ahead 3]        # по cron, раз в сутки
+  python manage.py message_partitions detach --before 2025-01 [--schema chat_archive] [--dry-run]
+"""
+from __future__ import annotations
+
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import partitions
+
+
+class Command(BaseCommand):
+    help = "Создать будущие / показать / отключить старые месячные секции chat_message"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "ensure", "detach"])
+        parser.add_argument("--ahead", type=int, default=None, help="сколько месяцев вперёд (ensure)")
+        parser.add_argument("--before", default="", help="YYYY-MM: отключить секции целиком раньше этого месяца")
+        parser.add_argument("--schema", default="", help="перенести отключённые секции в эту схему")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        action = opts["action"]
+        if action == "list":
+            for p in partitions.list_partitions():
+                lo = p.lower.date().isoformat() if p.lower else "MINVALUE"
+                hi = p.upper.date().isoformat() if p.upper else "MAXVALUE"
+                self.stdout.write(f"{p.name}\t{lo} .. {hi}")
+            return
+
+        if action == "ensure":
+            created = partitions.ensure_partitions(ahead=opts["ahead"])
+            self.stdout.write(f"created: {', '.join(created) or '-'}")
+            return
+
+        if not opts["before"]:
+            raise CommandError("--before YYYY-MM обязателен для detach")
+        try:
+            before = datetime.strptime(opts["before"], "%Y-%m").replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            raise CommandError("--before: ожидается YYYY-MM")
+
+        if opts["dry_run"]:
+            limit = min(before, partitions.month_floor(datetime.now(dt_timezone.utc)))
+            names = [p.name for p in partitions.list_partitions() if p.upper is not None and p.upper <= limit]
+            self.stdout.write(f"would detach: {', '.join(names) or '-'}")
+            return
+
+        detached = partitions.detach_partitions_before(before, archive_schema=opts["schema"])
+        self.stdout.write(f"detached: {', '.join(detached) or '-'}")
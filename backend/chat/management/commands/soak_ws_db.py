@@ -0,0 +1,181 @@
+# chat/management/commands/soak_ws_db.py
+"""
+Soak-тест соединений с БД под множеством WebSocket (config/db.py, DB_POOL_MODE).
+
+  DB_POOL_MODE=off        python manage.py soak_ws_db --sockets 5000 --duration 120
+  DB_POOL_MODE=persistent python manage.py soak_ws_db --sockets 5000 --duration 120
+  DB_POOL_MODE=pool       python manage.py soak_ws_db --sockets 5000 --duration 120
+
+В процессе открывается --sockets сокетов ChatConsumer (как /ws/chat/<id>/, пользователь подставляется
+в scope) по --rooms публичным комнатам; каждый сокет раз в --interval секунд (со случайным сдвигом)
+шлёт type=message. Каждое подключение и каждая отправка — запросы async ORM консьюмера.
+
+Печатает:
+  connect p50/p99       — рукопожатие консьюмера (права, имя, профиль кадров — запросы в БД);
+  rtt p50/p99           — «отправил -> кадр пришёл в комнату» (INSERT + рассылка);
+  db connects           — сколько раз Django открыл соединение (сигнал connection_created) — churn;
+  pg backends peak      — максимум сессий этой БД в pg_stat_activity за прогон.
+Режим пула выбирается окружением (он в DATABASES) — сравнивать разные прогоны.
+На тысячах сокетов запускать с Redis-слоем (REDIS_URL): InMemoryChannelLayer.receive перебирает
+все каналы процесса на каждый вызов, и задержку начинает определять он, а не БД.
+Пишет в настроенную БД (комнаты, пользователи и сообщения удаляются в конце). Только на стенде.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+import uuid
+
+from asgiref.testing import ApplicationCommunicator
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from chat.management.benchutil import app_for, pct
+from chat.models import Chat, Message
+
+
+class _Communicator(WebsocketCommunicator):
+    # channels.testing глушит close_old_connections на время send/receive (ради транзакций тестов),
+    # а здесь меряются именно соединения — ходим в asgiref напрямую
+    async def send_input(self, message):
+        return await ApplicationCommunicator.send_input(self, message)
+
+    async def receive_output(self, timeout=1):
+        return await ApplicationCommunicator.receive_output(self, timeout)
+
+
+@database_sync_to_async
+def _pg_backends() -> int:
+    with connection.cursor() as cur:
+        cur.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+        return cur.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = "Churn соединений с БД и p99 задержки под множеством WebSocket"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=5000)
+        parser.add_argument("--rooms", type=int, default=50)
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--duration", type=float, default=60.0)
+        parser.add_argument("--interval", type=float, default=30.0)
+        parser.add_argument("--connect-batch", type=int, default=200)
+
+    def handle(self, *args, **opts):
+        if opts["sockets"] < 1 or opts["rooms"] < 1 or opts["users"] < 1:
+            raise CommandError("--sockets, --rooms и --users должны быть > 0")
+
+        tag = uuid.uuid4().hex[:8]
+        User = get_user_model()
+        rooms = [Chat.objects.create(name=f"soak-{tag}-{i}") for i in range(opts["rooms"])]
+        users = User.objects.bulk_create([
+            User(email=f"soak-{tag}-{i}@example.invalid", nickname=f"soak{i}") for i in range(opts["users"])
+        ])
+
+        opened = {"n": 0}
+
+        def on_connect(sender, connection, **kwargs):
+            opened["n"] += 1
+
+        connection_created.connect(on_connect, dispatch_uid="soak_ws_db")
+        try:
+            self.stdout.write(asyncio.run(self._run(rooms, users, opened, opts)))
+        finally:
+            connection_created.disconnect(dispatch_uid="soak_ws_db")
+            Message.objects.filter(room__in=rooms).delete()
+            Chat.objects.filter(pk__in=[r.pk for r in rooms]).delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    async def _run(self, rooms, users, opened, opts) -> str:
+        db = settings.DATABASES["default"]
+        mode = (
+            "pool" if "pool" in db.get("OPTIONS", {})
+            else f"conn_max_age={db.get('CONN_MAX_AGE', 0)}"
+        )
+
+        socks: list[_Communicator] = []
+        connect_ms: list[float] = []
+
+        async def open_one(i: int):
+            room = rooms[i % len(rooms)]
+            comm = _Communicator(app_for(users[i % len(users)]), f"/ws/chat/{room.id}/")
+            t0 = time.perf_counter()
+            connected, _ = await comm.connect(timeout=60)
+            if connected:
+                connect_ms.append((time.perf_counter() - t0) * 1000)
+                socks.append(comm)
+
+        opened_before = opened["n"]
+        for start in range(0, opts["sockets"], opts["connect_batch"]):
+            end = min(start + opts["connect_batch"], opts["sockets"])
+            await asyncio.gather(*(open_one(i) for i in range(start, end)))
+        connects_on_open = opened["n"] - opened_before
+
+        sent_at: dict[str, float] = {}
+        rtt_ms: list[float] = []
+        stop = asyncio.Event()
+        peak = {"backends": 0}
+
+        async def read(comm):
+            while True:
+                try:
+                    frame = await comm.receive_json_from(timeout=3600)
+                except Exception:
+                    return
+                content = frame.get("content") if isinstance(frame, dict) else None
+                t0 = sent_at.pop(content, None) if content else None
+                if t0 is not None:
+                    rtt_ms.append((time.perf_counter() - t0) * 1000)
+
+        async def chat(comm, n: int):
+            await asyncio.sleep(random.uniform(0, opts["interval"]))
+            seq = 0
+            while not stop.is_set():
+                content = f"soak:{n}:{seq}"
+                sent_at[content] = time.perf_counter()
+                await comm.send_json_to({"type": "message", "content": content})
+                seq += 1
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=opts["interval"])
+                except asyncio.TimeoutError:
+                    pass
+
+        async def sample():
+            while not stop.is_set():
+                peak["backends"] = max(peak["backends"], await _pg_backends())
+                await asyncio.sleep(1)
+
+        opened_before = opened["n"]
+        started = time.perf_counter()
+        readers = [asyncio.create_task(read(c)) for c in socks]
+        workers = [asyncio.create_task(chat(c, i)) for i, c in enumerate(socks)]
+        workers.append(asyncio.create_task(sample()))
+        await asyncio.sleep(opts["duration"])
+        stop.set()
+        await asyncio.gather(*workers)
+        deadline = time.perf_counter() + 10
+        while sent_at and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        connects_on_run = opened["n"] - opened_before
+
+        for task in readers:
+            task.cancel()
+        for comm in socks:
+            await comm.disconnect()
+
+        return (
+            f"{mode}: sockets={len(socks)}/{opts['sockets']} "
+            f"connect p50={pct(connect_ms, 0.5):.0f}ms p99={pct(connect_ms, 0.99):.0f}ms | "
+            f"messages={len(rtt_ms)} lost={len(sent_at)} "
+            f"rtt p50={pct(rtt_ms, 0.5):.0f}ms p99={pct(rtt_ms, 0.99):.0f}ms | "
+            f"db connects: open={connects_on_open} run={connects_on_run} "
+            f"({connects_on_run / max(elapsed, 1e-9):.1f}/s) pg backends peak={peak['backends']}"
+        )
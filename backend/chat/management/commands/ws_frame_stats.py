@@ -0,0 +1,40 @@
+# chat/management/commands/ws_frame_stats.py
+"""
+Трафик WebSocket по типам кадров и профилям (chat/frames.py: record/flush_stats).
+
+  python manage.py ws_frame_stats            # таблица: кадры, байты, средний размер
+  python manage.py ws_frame_stats --reset    # обнулить счётчики
+
+Счётчики общие для всех процессов (кэш), процессы сбрасывают их раз в CHAT_WS_STATS_FLUSH_SEC.
+Размеры — до permessage-deflate.
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+
+from chat import frames
+
+
+class Command(BaseCommand):
+    help = "Показать байты по типам WebSocket-кадров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true")
+
+    def handle(self, *args, **opts):
+        if opts["reset"]:
+            frames.reset_stats()
+            self.stdout.write("reset")
+            return
+
+        rows = sorted(frames.read_stats(), key=lambda r: r["bytes"], reverse=True)
+        if not rows:
+            self.stdout.write("no data")
+            return
+        self.stdout.write(f"{'kind':<36} {'profile':<8} {'frames':>10} {'bytes':>14} {'avg':>8}")
+        for r in rows:
+            avg = r["bytes"] / r["frames"] if r["frames"] else 0
+            self.stdout.write(f"{r['kind']:<36} {r['profile']:<8} {r['frames']:>10} {r['bytes']:>14} {avg:>8.0f}")
+        total_frames = sum(r["frames"] for r in rows)
+        total_bytes = sum(r["bytes"] for r in rows)
+        self.stdout.write(f"{'total':<36} {'':<8} {total_frames:>10} {total_bytes:>14}")
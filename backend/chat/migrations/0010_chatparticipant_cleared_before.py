@@ -0,0 +1,77 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+# Сжатие HiddenMessage в водяные знаки.
+# Для каждой пары (пользователь, чат) ищем первое видимое сообщение (не удалено и не скрыто);
+# всё скрытое до него — непрерывный префикс истории, его заменяет cleared_before = created_at
+# последнего скрытого сообщения префикса. Строки HiddenMessage под водяным знаком удаляются,
+# одиночные скрытия в середине истории остаются как есть.
+COMPACT_SQL = """
+WITH pairs AS (
+    SELECT DISTINCT h.user_id, m.room_id
+    FROM chat_hiddenmessage h
+    JOIN chat_message m ON m.id = h.message_id
+),
+bounds AS (
+    SELECT p.user_id, p.room_id, (
+        SELECT min(m.created_at)
+        FROM chat_message m
+        WHERE m.room_id = p.room_id
+          AND m.deleted_at IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM chat_hiddenmessage h
+              WHERE h.user_id = p.user_id AND h.message_id = m.id
+          )
+    ) AS first_visible
+    FROM pairs p
+),
+marks AS (
+    SELECT b.user_id, b.room_id, max(m.created_at) AS watermark
+    FROM bounds b
+    JOIN chat_hiddenmessage h ON h.user_id = b.user_id
+    JOIN chat_message m ON m.id = h.message_id AND m.room_id = b.room_id
+    WHERE b.first_visible IS NULL OR m.created_at < b.first_visible
+    GROUP BY b.user_id, b.room_id
+)
+UPDATE chat_chatparticipant cp
+SET cleared_before = marks.watermark
+FROM marks
+WHERE cp.user_id = marks.user_id
+  AND cp.chat_id = marks.room_id
+  AND (cp.cleared_before IS NULL OR cp.cleared_before < marks.watermark);
+
+DELETE FROM chat_hiddenmessage h
+USING chat_message m, chat_chatparticipant cp
+WHERE m.id = h.message_id
+  AND cp.user_id = h.user_id
+  AND cp.chat_id = m.room_id
+  AND m.created_at <= cp.cleared_before;
+"""
+
+# Откат: разворачиваем водяные знаки обратно в строки HiddenMessage.
+EXPAND_SQL = """
+INSERT INTO chat_hiddenmessage (user_id, message_id, created_at)
+SELECT cp.user_id, m.id, now()
+FROM chat_chatparticipant cp
+JOIN chat_message m ON m.room_id = cp.chat_id AND m.created_at <= cp.cleared_before
+WHERE cp.cleared_before IS NOT NULL
+ON CONFLICT (user_id, message_id) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='cleared_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(COMPACT_SQL, reverse_sql=EXPAND_SQL),
+    ]
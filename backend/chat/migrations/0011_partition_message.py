@@ -0,0 +1,154 @@
+# Generated by Django 5.2.4 on 2026-10-18 22:30
+
+from datetime import datetime, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+LEGACY = "chat_message_plegacy"
+AHEAD = 3
+
+# Индексы родителя с теми же именами, что у Django (дальнейшие миграции ссылаются на них).
+# Совпадающие индексы старой таблицы подключаются к ним без перестроения.
+PARENT_INDEXES = [
+    ("chat_message_author_id_923569d5", "(author_id)"),
+    ("chat_message_reply_to_id_afede338", "(reply_to_id)"),
+    ("chat_message_room_id_5e7d8d78", "(room_id)"),
+    ("chat_message_created_at_618078f0", "(created_at)"),
+    ("chat_messag_room_id_5feac5_idx", "(room_id, created_at)"),
+    ("chat_messag_room_id_edc775_idx", "(room_id, created_at DESC)"),
+    ("chat_message_search_gin", "USING gin (search_vector)"),
+]
+
+
+def _month(dt, n=0):
+    y, m = divmod(dt.month - 1 + n, 12)
+    return datetime(dt.year + y, m + 1, 1, tzinfo=timezone.utc)
+
+
+# граница старой секции; одна на весь прогон миграции (шаги идут отдельными транзакциями)
+BOUNDARY = _month(datetime.now(timezone.utc), 1)
+
+
+def build_unique_index(apps, schema_editor):
+    # вне транзакции (atomic=False): CONCURRENTLY; недостроенный после сбоя индекс (INVALID) — заново
+    with schema_editor.connection.cursor() as cur:
+        cur.execute(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = 'chat_message_id_created_uniq'"
+        )
+        row = cur.fetchone()
+    if row and row[0]:
+        return
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS chat_message_id_created_uniq")
+    schema_editor.execute("CREATE UNIQUE INDEX CONCURRENTLY chat_message_id_created_uniq ON chat_message (id, created_at)")
+
+
+def add_bound(apps, schema_editor):
+    # NOT VALID — без сканирования; проверка строк — отдельным шагом VALIDATE
+    schema_editor.execute("ALTER TABLE chat_message DROP CONSTRAINT IF EXISTS chat_message_legacy_bound")
+    schema_editor.execute(
+        "ALTER TABLE chat_message ADD CONSTRAINT chat_message_legacy_bound CHECK (created_at < %s) NOT VALID",
+        [BOUNDARY],
+    )
+
+
+def partition_forward(apps, schema_editor):
+    """
+    chat_message -> секционированная по created_at таблица без копирования строк:
+    старая таблица становится секцией MINVALUE .. начало следующего месяца.
+
+    Одна транзакция под ACCESS EXCLUSIVE (её берёт уже первый RENAME), но без сканирований и
+    построения индексов: уникальный индекс (id, created_at) построен CONCURRENTLY, CHECK проверен
+    VALIDATE на предыдущих шагах, поэтому ATTACH не сканирует секцию, а индексы родителя
+    подключают готовые индексы старой таблицы.
+    """
+    run = schema_editor.execute
+    boundary = BOUNDARY
+
+    run("ALTER TABLE chat_message RENAME TO %s" % LEGACY)
+    with schema_editor.connection.cursor() as cur:
+        cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [LEGACY])
+        names = [r[0] for r in cur.fetchall()]
+    for name in names:
+        if name != "chat_message_id_created_uniq":
+            run('ALTER INDEX "%s" RENAME TO "%s"' % (name, (name[:54] + "_legacy")))
+    # PK секции должен совпадать с PK родителя: готовый индекс становится PK без перестроения
+    run("ALTER TABLE %s DROP CONSTRAINT chat_message_pkey_legacy" % LEGACY)
+    run("ALTER TABLE %s ADD CONSTRAINT chat_message_plegacy_pkey PRIMARY KEY USING INDEX chat_message_id_created_uniq"
+        % LEGACY)
+
+    run(
+        "CREATE TABLE chat_message (LIKE %s INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) "
+        "PARTITION BY RANGE (created_at)" % LEGACY
+    )
+    # PK секционированной таблицы обязан включать ключ секционирования
+    run("ALTER TABLE chat_message ADD CONSTRAINT chat_message_pkey PRIMARY KEY (id, created_at)")
+
+    # проверенный CHECK -> ATTACH без полного сканирования секции
+    run("ALTER TABLE chat_message ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO (%%s)" % LEGACY, [boundary])
+    run("ALTER TABLE %s DROP CONSTRAINT chat_message_legacy_bound" % LEGACY)
+
+    for name, expr in PARENT_INDEXES:
+        run('CREATE INDEX "%s" ON chat_message %s' % (name, expr))
+
+    run(
+        "ALTER TABLE chat_message ADD CONSTRAINT chat_message_room_id_5e7d8d78_fk_chat_chat_id "
+        "FOREIGN KEY (room_id) REFERENCES chat_chat(id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    run(
+        "ALTER TABLE chat_message ADD CONSTRAINT chat_message_author_id_923569d5_fk_users_user_id "
+        "FOREIGN KEY (author_id) REFERENCES users_user(id) DEFERRABLE INITIALLY DEFERRED"
+    )
+    # FK старой таблицы теперь дублируют унаследованные от родителя
+    with schema_editor.connection.cursor() as cur:
+        cur.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f' AND conparentid = 0",
+            [LEGACY],
+        )
+        for (conname,) in cur.fetchall():
+            run('ALTER TABLE %s DROP CONSTRAINT "%s"' % (LEGACY, conname))
+
+    for i in range(1, AHEAD + 1):
+        lo = _month(boundary, i - 1)
+        run(
+            "CREATE TABLE chat_message_p%04d%02d PARTITION OF chat_message FOR VALUES FROM (%%s) TO (%%s)"
+            % (lo.year, lo.month),
+            [lo, _month(lo, 1)],
+        )
+
+
+class Migration(migrations.Migration):
+    # шаги — отдельными транзакциями: долгие (индекс, VALIDATE) не держат эксклюзивную блокировку,
+    # она нужна только короткому partition_forward. Повторный запуск после сбоя безопасен.
+    atomic = False
+
+    dependencies = [
+        ('chat', '0010_chatparticipant_cleared_before'),
+    ]
+
+    operations = [
+        # Уникальность по одному id на секционированной таблице невозможна (только вместе с created_at),
+        # поэтому ссылки на сообщение держит ORM: каскады/SET_NULL Django выполняет сам.
+        migrations.AlterField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='hiddenmessage',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='hidden_for_users', to='chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='reply_to',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='replies', to='chat.message'),
+        ),
+        # запись в chat_message продолжается: CONCURRENTLY и VALIDATE берут только SHARE UPDATE EXCLUSIVE
+        migrations.RunPython(build_unique_index),
+        migrations.RunPython(add_bound, atomic=True),
+        migrations.RunSQL("ALTER TABLE chat_message VALIDATE CONSTRAINT chat_message_legacy_bound", migrations.RunSQL.noop),
+        # необратима: обратное преобразование — копирование всей истории, делается вручную
+        migrations.RunPython(partition_forward, atomic=True),
+    ]
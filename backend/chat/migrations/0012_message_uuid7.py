@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-19 01:10
+
+import chat.ids
+from django.db import migrations, models
+
+INDEX = "chat_message_room_id_desc"
+
+
+def create_index(apps, schema_editor):
+    """
+    Индекс (room_id, id DESC) на секционированной таблице без долгой блокировки:
+    пустой индекс на родителе (ON ONLY) -> CONCURRENTLY по каждой секции -> ATTACH.
+    """
+    run = schema_editor.execute
+    run('CREATE INDEX IF NOT EXISTS "%s" ON ONLY chat_message (room_id, id DESC)' % INDEX)
+    with schema_editor.connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'chat_message'::regclass"
+        )
+        parts = [r[0] for r in cur.fetchall()]
+    for part in parts:
+        child = ("%s_%s" % (part, "room_id_desc"))[:63]
+        run('CREATE INDEX CONCURRENTLY IF NOT EXISTS "%s" ON "%s" (room_id, id DESC)' % (child, part))
+        run('ALTER INDEX "%s" ATTACH PARTITION "%s"' % (INDEX, child))
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS "%s"' % INDEX)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не работает внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('chat', '0011_partition_message'),
+    ]
+
+    operations = [
+        # только состояние: default вычисляется в Python, существующие id не трогаем
+        # (перевыпуск старых uuid4 — manage.py backfill_message_ids, батчами)
+        migrations.AlterField(
+            model_name='message',
+            name='id',
+            field=models.UUIDField(default=chat.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='message',
+                    index=models.Index(fields=['room', '-id'], name=INDEX),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_index, drop_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Сжатие HiddenMessage в водяные знаки для групповых комнат, где пользователь не участник —
+# 0010 их пропускала (писать было некуда, кроме ChatParticipant). Логика та же: непрерывный
+# скрытый префикс истории заменяется одной строкой HistoryWatermark.
+COMPACT_SQL = """
+WITH pairs AS (
+    SELECT DISTINCT h.user_id, m.room_id
+    FROM chat_hiddenmessage h
+    JOIN chat_message m ON m.id = h.message_id
+    WHERE NOT EXISTS (
+        SELECT 1 FROM chat_chatparticipant cp WHERE cp.user_id = h.user_id AND cp.chat_id = m.room_id
+    )
+),
+bounds AS (
+    SELECT p.user_id, p.room_id, (
+        SELECT min(m.created_at)
+        FROM chat_message m
+        WHERE m.room_id = p.room_id
+          AND m.deleted_at IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM chat_hiddenmessage h
+              WHERE h.user_id = p.user_id AND h.message_id = m.id
+          )
+    ) AS first_visible
+    FROM pairs p
+),
+marks AS (
+    SELECT b.user_id, b.room_id, max(m.created_at) AS watermark
+    FROM bounds b
+    JOIN chat_hiddenmessage h ON h.user_id = b.user_id
+    JOIN chat_message m ON m.id = h.message_id AND m.room_id = b.room_id
+    WHERE b.first_visible IS NULL OR m.created_at < b.first_visible
+    GROUP BY b.user_id, b.room_id
+)
+INSERT INTO chat_historywatermark (user_id, chat_id, cleared_before)
+SELECT user_id, room_id, watermark FROM marks;
+
+DELETE FROM chat_hiddenmessage h
+USING chat_message m, chat_historywatermark w
+WHERE m.id = h.message_id
+  AND w.user_id = h.user_id
+  AND w.chat_id = m.room_id
+  AND m.created_at <= w.cleared_before;
+"""
+
+# Откат: разворачиваем водяные знаки обратно в строки HiddenMessage (таблицу затем удалит CreateModel).
+EXPAND_SQL = """
+INSERT INTO chat_hiddenmessage (user_id, message_id, created_at)
+SELECT w.user_id, m.id, now()
+FROM chat_historywatermark w
+JOIN chat_message m ON m.room_id = w.chat_id AND m.created_at <= w.cleared_before
+ON CONFLICT (user_id, message_id) DO NOTHING;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_messagereaction'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cleared_before', models.DateTimeField()),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_watermarks', to='chat.chat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_watermarks', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'chat')},
+            },
+        ),
+        migrations.RunSQL(COMPACT_SQL, reverse_sql=EXPAND_SQL),
+    ]
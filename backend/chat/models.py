@@ -5,10 +5,27 @@ from uuid import uuid4
 from typing import Optional
 
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
 from mptt.models import MPTTModel, TreeForeignKey
 from django.db.models import Q, TextChoices
 
+from .ids import uuid7
+
+# Конфигурации FTS, из которых собирается Message.search_vector.
+# 'simple' — точные слова для любого языка, остальные — стемминг (см. chat/search.py).
+# ВАЖНО: при изменении списка нужна миграция (колонка генерируемая).
+MESSAGE_SEARCH_CONFIGS = ("simple", "russian", "english")
+
+
+def _message_search_vector():
+    vector = SearchVector("content", config=MESSAGE_SEARCH_CONFIGS[0])
+    for config in MESSAGE_SEARCH_CONFIGS[1:]:
+        vector = vector + SearchVector("content", config=config)
+    return vector
+
+
 def _message_upload_to(instance: "Message", filename: str) -> str:
     """
     Путь хранения вложений: media/messages/<room_id>/<uuid>/<original_name>
@@ -100,6 +117,7 @@ class Chat(models.Model):
         blank=True,
         on_delete=models.SET_NULL,
         related_name="+",
+        db_constraint=False,  # chat_message секционирована, см. Message
     )
 
     # Уникальный ключ пары участников для приватных чатов (чтобы не плодить дубликаты).
@@ -142,6 +160,9 @@ class ChatParticipant(models.Model):
     # Отключение уведомлений по конкретному чату
     is_muted = models.BooleanField(default=False)
 
+    # «Очистить историю у себя»: видны только сообщения с created_at > cleared_before
+    cleared_before = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = ("chat", "user")
         indexes = [
@@ -157,12 +178,25 @@ class ChatParticipant(models.Model):
 # Сообщения в чате
 # -----------------------------
 
+class MessageManager(models.Manager):
+    """По умолчанию не тянем search_vector (tsvector ~3x контента) в обычные выборки."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer("search_vector")
+
+
 class Message(models.Model):
     """
     Сообщение в чате, поддержка текста + вложений.
     ВАЖНО: первичный ключ — UUID (совместимо с текущей схемой БД).
+    Новые id — UUIDv7 (chat/ids.py): упорядочены по времени создания;
+    старые uuid4 перевыпускает manage.py backfill_message_ids.
+
+    Таблица секционирована помесячно по created_at (миграция 0011, chat/partitions.py):
+    в БД первичный ключ — (id, created_at), поэтому внешние ключи на сообщение
+    объявлены с db_constraint=False, а каскады выполняет Django.
     """
-    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
 
     ATTACHMENT_TYPE_IMAGE = "image"
     ATTACHMENT_TYPE_FILE = "file"
@@ -195,7 +229,8 @@ class Message(models.Model):
     attachment_name = models.CharField(max_length=255, blank=True, default="")
 
     reply_to = models.ForeignKey(
-        "self", related_name="replies", on_delete=models.SET_NULL, null=True, blank=True
+        "self", related_name="replies", on_delete=models.SET_NULL, null=True, blank=True,
+        db_constraint=False,
     )
 
     # Срок жизни сообщения (для секретных/исчезающих сообщений)
@@ -208,11 +243,22 @@ class Message(models.Model):
 
     meta = models.JSONField(default=dict, blank=True)
 
+    # Полнотекстовый поиск: вычисляется Postgres при записи, индексируется GIN
+    search_vector = models.GeneratedField(
+        expression=_message_search_vector(),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = MessageManager()
+
     class Meta:
         ordering = ["created_at"]
         indexes = [
             models.Index(fields=["room", "created_at"]),
             models.Index(fields=["room", "-created_at"]),
+            models.Index(fields=["room", "-id"], name="chat_message_room_id_desc"),
+            GinIndex(fields=["search_vector"], name="chat_message_search_gin"),
         ]
 
     def __str__(self) -> str:
@@ -256,7 +302,7 @@ class HiddenMessage(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="hidden_messages"
     )
     message = models.ForeignKey(
-        Message, on_delete=models.CASCADE, related_name="hidden_for_users"
+        Message, on_delete=models.CASCADE, related_name="hidden_for_users", db_constraint=False
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -267,6 +313,47 @@ class HiddenMessage(models.Model):
         return f"HiddenMessage user={self.user_id} message={self.message_id}"
 
 
+class HistoryWatermark(models.Model):
+    """
+    «Очистить историю у себя» в групповой комнате, где пользователь не участник (только читает).
+    Участникам водяной знак пишется в ChatParticipant.cleared_before; здесь — чтобы очистка
+    не делала читателя участником (списки участников, непрочитанные, область поиска).
+    """
+    chat = models.ForeignKey("Chat", on_delete=models.CASCADE, related_name="history_watermarks")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="history_watermarks")
+    cleared_before = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "chat")
+
+    def __str__(self) -> str:
+        return f"HistoryWatermark user={self.user_id} chat={self.chat_id}"
+
+
+class MessageReaction(models.Model):
+    """
+    Реакция пользователя на сообщение (одна строка на пару пользователь+эмодзи).
+    Счётчики по эмодзи денормализованы в Message.meta["reactions"] и пересчитываются
+    пачками (chat/reactions.py), чтобы горячее сообщение не упиралось в блокировку своей строки.
+    """
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, related_name="reactions", db_constraint=False
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="message_reactions"
+    )
+    emoji = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["message", "user", "emoji"], name="chat_reaction_uniq"),
+        ]
+
+    def __str__(self) -> str:
+        return f"MessageReaction {self.emoji} user={self.user_id} message={self.message_id}"
+
+
 
 # ===== ДРУЗЬЯ / БЛОК =====
 
@@ -6,3 +6,26 @@ class ChatMessageCursorPagination(CursorPagination):
     ordering = "-created_at"
     page_size_query_param = "page_size"
     max_page_size = 100
+
+
+class MessageSearchCursorPagination(CursorPagination):
+    """Курсор по релевантности; при равном rank DRF добирает по смещению."""
+    page_size = 20
+    ordering = ("-rank", "-created_at")
+    page_size_query_param = "page_size"
+    max_page_size = 50
+
+
+class UserSearchCursorPagination(CursorPagination):
+    """Keyset по sort_key (корзина релевантности + id), см. chat.search.search_users."""
+    page_size = 20
+    ordering = "sort_key"
+    page_size_query_param = "page_size"
+    max_page_size = 50
+
+
+class ChatCursorPagination(CursorPagination):
+    page_size = 50
+    ordering = "-created_at"
+    page_size_query_param = "page_size"
+    max_page_size = 200
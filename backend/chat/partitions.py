@@ -0,0 +1,142 @@
+# chat/partitions.py
+"""
+Помесячное секционирование chat_message по created_at (Postgres RANGE partitioning).
+
+Схему создаёт миграция 0011: старая таблица целиком подключена как секция
+chat_message_plegacy (MINVALUE .. начало месяца миграции + 1), дальше — по секции на месяц:
+chat_message_pYYYYMM. DEFAULT-секции нет намеренно: она мешает упорядоченному Append
+(ORDER BY created_at LIMIT по секциям) — поэтому будущие секции нужно создавать заранее:
+
+  python manage.py message_partitions ensure          # по cron, раз в сутки
+  python manage.py message_partitions list
+  python manage.py message_partitions detach --before 2025-01 --schema chat_archive
+
+Отключённая секция — обычная таблица: её можно выгрузить (pg_dump -t) и удалить
+или оставить в схеме архива. Сообщения из неё из приложения больше не видны.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+PARENT_TABLE = "chat_message"
+PARTITION_PREFIX = "chat_message_p"
+
+_BOUND_RE = re.compile(r"FROM \((?P<lo>[^)]*)\) TO \((?P<hi>[^)]*)\)")
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    lower: Optional[datetime]  # None — MINVALUE
+    upper: Optional[datetime]  # None — MAXVALUE
+
+
+def _ahead() -> int:
+    return int(getattr(settings, "CHAT_MESSAGE_PARTITIONS_AHEAD", 3))
+
+
+def month_floor(dt: datetime) -> datetime:
+    dt = dt.astimezone(dt_timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(dt: datetime, n: int) -> datetime:
+    y, m = divmod(dt.month - 1 + n, 12)
+    return dt.replace(year=dt.year + y, month=m + 1)
+
+
+def partition_name(month_start: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month_start.year:04d}{month_start.month:02d}"
+
+
+def _parse_bound(raw: str) -> Optional[datetime]:
+    raw = raw.strip()
+    if raw in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(raw.strip("'")).astimezone(dt_timezone.utc)
+
+
+def list_partitions() -> list[Partition]:
+    """Секции chat_message по возрастанию нижней границы."""
+    with connection.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            """,
+            [PARENT_TABLE],
+        )
+        rows = cur.fetchall()
+    parts = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        if not m:
+            continue
+        parts.append(Partition(name, _parse_bound(m["lo"]), _parse_bound(m["hi"])))
+    parts.sort(key=lambda p: p.lower or datetime.min.replace(tzinfo=dt_timezone.utc))
+    return parts
+
+
+def _covered(parts: list[Partition], moment: datetime) -> bool:
+    return any(
+        (p.lower is None or p.lower <= moment) and (p.upper is None or moment < p.upper)
+        for p in parts
+    )
+
+
+def ensure_partitions(ahead: Optional[int] = None, now: Optional[datetime] = None) -> list[str]:
+    """Создаёт недостающие месячные секции: текущий месяц + ahead вперёд. Возвращает имена новых."""
+    ahead = _ahead() if ahead is None else ahead
+    start = month_floor(now or timezone.now())
+    parts = list_partitions()
+    created = []
+    with connection.cursor() as cur:
+        for i in range(ahead + 1):
+            lo = add_months(start, i)
+            if _covered(parts, lo):
+                continue
+            hi = add_months(lo, 1)
+            name = partition_name(lo)
+            cur.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" '
+                "FOR VALUES FROM (%s) TO (%s)",
+                [lo, hi],
+            )
+            parts.append(Partition(name, lo, hi))
+            created.append(name)
+    return created
+
+
+def detach_partition(name: str, *, archive_schema: str = "", concurrently: bool = True) -> None:
+    """
+    Отключает секцию от chat_message. CONCURRENTLY не блокирует запись в родителя,
+    но не работает внутри транзакции (в тестах — concurrently=False).
+    """
+    with connection.cursor() as cur:
+        cur.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"'
+            + (" CONCURRENTLY" if concurrently else "")
+        )
+        if archive_schema:
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"')
+            cur.execute(f'ALTER TABLE "{name}" SET SCHEMA "{archive_schema}"')
+
+
+def detach_partitions_before(before: datetime, **kwargs) -> list[str]:
+    """Отключает все секции, целиком лежащие раньше before. Текущий месяц не трогаем."""
+    limit = min(month_floor(before), month_floor(timezone.now()))
+    detached = []
+    for p in list_partitions():
+        if p.upper is not None and p.upper <= limit:
+            detach_partition(p.name, **kwargs)
+            detached.append(p.name)
+    return detached
@@ -0,0 +1,207 @@
+# chat/ratelimit.py
+"""
+Лимит частоты отправки сообщений — токен-бакеты, общие для REST
+(MessageViewSet.create, ConversationMessagesView.create) и WS (ChatConsumer / GatewayConsumer).
+
+Каждая отправка снимает по токену из двух вёдер:
+  user — CHAT_SEND_RATE_USER токенов/с, ёмкость CHAT_SEND_BURST_USER (пользователь во всех комнатах);
+  room — CHAT_SEND_RATE_ROOM токенов/с, ёмкость CHAT_SEND_BURST_ROOM (потолок рассылки в комнату).
+Снимается всё или ничего: отказ по ведру пользователя не тратит токены комнаты, поэтому один
+спамер упирается в свой лимит задолго до лимита комнаты и не отнимает пропускную способность
+у остальных (manage.py loadtest_send_rate).
+
+Состояние — в кэше. На Redis проверка и списание — один Lua-скрипт: атомарно между процессами,
+время берётся у Redis (часы воркеров не важны). На прочих бэкендах (LocMem в деве и тестах —
+он и так живёт в пределах процесса) — get_many/set_many под блокировкой процесса.
+Кэш недоступен — пропускаем: лимитер не должен ронять отправку.
+
+Лимит проверяется после ключа идемпотентности (chat/idempotency.py): повтор уже созданного
+сообщения получает исходный результат, а не отказ, и токенов не тратит.
+В консьюмерах — acheck_send: тот же вызов в пуле потоков, без блокирующего I/O в event loop.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.throttling import BaseThrottle
+
+from . import idempotency
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = "chat:rl:user:{}"
+ROOM_KEY = "chat:rl:room:{}"
+
+# KEYS — вёдра; ARGV[1] — цена, дальше пары (rate, burst) на каждое ведро.
+# Возвращает строку: "0" — токены списаны, иначе секунды до повтора.
+CONSUME_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+  local rate = tonumber(ARGV[2 * i])
+  local burst = tonumber(ARGV[2 * i + 1])
+  local v = redis.call('HMGET', KEYS[i], 't', 'ts')
+  local left = tonumber(v[1]) or burst
+  local ts = tonumber(v[2]) or now
+  left = math.min(burst, left + math.max(0, now - ts) * rate)
+  tokens[i] = left
+  if left < cost then
+    wait = math.max(wait, (cost - left) / rate)
+  end
+end
+for i = 1, #KEYS do
+  local rate = tonumber(ARGV[2 * i])
+  local burst = tonumber(ARGV[2 * i + 1])
+  local left = tokens[i]
+  if wait == 0 then
+    left = left - cost
+  end
+  redis.call('HSET', KEYS[i], 't', tostring(left), 'ts', tostring(now))
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst / rate * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+_lock = threading.Lock()
+_script = None
+
+Bucket = tuple[str, float, float]  # (ключ, токенов/с, ёмкость)
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "CHAT_SEND_RATE_LIMIT", True))
+
+
+def send_buckets(user_id: Optional[int], room_id: Optional[int]) -> list[Bucket]:
+    buckets: list[Bucket] = []
+    if user_id:
+        buckets.append((
+            USER_KEY.format(int(user_id)),
+            float(getattr(settings, "CHAT_SEND_RATE_USER", 1.0)),
+            float(getattr(settings, "CHAT_SEND_BURST_USER", 10)),
+        ))
+    if room_id:
+        buckets.append((
+            ROOM_KEY.format(int(room_id)),
+            float(getattr(settings, "CHAT_SEND_RATE_ROOM", 20.0)),
+            float(getattr(settings, "CHAT_SEND_BURST_ROOM", 100)),
+        ))
+    return buckets
+
+
+class RateLimited(Exception):
+    """Отправка сверх лимита; wait — через сколько секунд повторить."""
+
+    def __init__(self, wait: float):
+        super().__init__(wait)
+        self.wait = wait
+
+
+def check_send(user_id: Optional[int], room_id: Optional[int]) -> float:
+    """0 — можно отправлять (токены уже списаны); иначе через сколько секунд повторить."""
+    if not enabled():
+        return 0.0
+    buckets = send_buckets(user_id, room_id)
+    if not buckets:
+        return 0.0
+    try:
+        return consume(buckets)
+    except Exception as e:
+        logger.warning("Send rate limiter unavailable: %s", e)
+        return 0.0
+
+
+async def acheck_send(user_id: Optional[int], room_id: Optional[int]) -> float:
+    if not enabled():
+        return 0.0
+    # только кэш, без БД: thread_sensitive не нужен и не занимает общий поток ORM
+    return await sync_to_async(check_send, thread_sensitive=False)(user_id, room_id)
+
+
+def consume(buckets: list[Bucket], cost: float = 1.0) -> float:
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        return _consume_redis(backend, buckets, cost)
+    return _consume_local(buckets, cost)
+
+
+def _consume_redis(backend: RedisCache, buckets: list[Bucket], cost: float) -> float:
+    global _script
+    keys = [backend.make_and_validate_key(key) for key, _, _ in buckets]
+    client = backend._cache.get_client(keys[0], write=True)
+    if _script is None:
+        _script = client.register_script(CONSUME_LUA)
+    args: list = [cost]
+    for _, rate, burst in buckets:
+        args += [rate, burst]
+    return float(_script(keys=keys, args=args, client=client))
+
+
+def _consume_local(buckets: list[Bucket], cost: float) -> float:
+    with _lock:
+        now = time.time()
+        state = cache.get_many([key for key, _, _ in buckets])
+        tokens, wait = [], 0.0
+        for key, rate, burst in buckets:
+            left, ts = state.get(key) or (burst, now)
+            left = min(burst, left + max(0.0, now - ts) * rate)
+            tokens.append(left)
+            if left < cost:
+                wait = max(wait, (cost - left) / rate)
+        timeout = max(math.ceil(burst / rate) for _, rate, burst in buckets) + 1
+        cache.set_many(
+            {key: (left - (0 if wait else cost), now) for (key, _, _), left in zip(buckets, tokens)},
+            timeout,
+        )
+        return wait
+
+
+class SendRateThrottle(BaseThrottle):
+    """DRF-троттл для create у view сообщений: те же вёдра, что и у WS-отправки."""
+
+    def allow_request(self, request, view) -> bool:
+        self.retry_after = None
+        if request.method != "POST" or getattr(view, "action", "create") != "create":
+            return True
+        user = request.user
+        if not getattr(user, "is_authenticated", False):
+            return True
+        if self._is_replay(request, view, user):
+            return True
+        room_id = view.kwargs.get("pk") or request.data.get("room")
+        try:
+            room_id = int(room_id) if room_id else None
+        except (TypeError, ValueError):
+            room_id = None
+        wait = check_send(user.id, room_id)
+        if wait:
+            self.retry_after = wait
+            return False
+        return True
+
+    @staticmethod
+    def _is_replay(request, view, user) -> bool:
+        # повтор с Idempotency-Key уже созданного (или ещё создаваемого) сообщения —
+        # ответ даст idempotent_create, лимит не трогаем
+        try:
+            key = idempotency.clean_key(request.headers.get(idempotency.HEADER))
+        except ValueError:
+            return False
+        if not key:
+            return False
+        scope = idempotency.request_scope(request, view.kwargs)
+        return idempotency.lookup(user.id, scope, key) is not None
+
+    def wait(self) -> Optional[float]:
+        return self.retry_after
@@ -0,0 +1,227 @@
+# chat/reactions.py
+"""
+Реакции на сообщения.
+
+Кто и чем отреагировал — строки MessageReaction (у каждой своя строка, блокировок между
+пользователями нет). Сводные счётчики {эмодзи: n} денормализованы в Message.meta["reactions"],
+чтобы лента отдавала их без JOIN. Обновлять meta на каждую реакцию — значит выстроить
+всех реагирующих в очередь на блокировку одной строки горячего сообщения, поэтому:
+
+  - реакция пишет только свою строку и после коммита кладёт сообщение в общий журнал «грязных»
+    в кэше (chat:reactions:dirty:<seq>, номера — cache.incr, как в chat/replay.py);
+  - не чаще раза в CHAT_REACTION_FLUSH_SEC (на все процессы) журнал разбирается: счётчики
+    записей пересчитываются из MessageReaction и пишутся одним UPDATE (пересчёт, а не дельты —
+    повторная обработка безвредна); если сброс ещё рано, его добивает таймер в фоне;
+  - клиентам сразу уходит маленькое событие reaction:delta, а не всё сообщение.
+
+Журнал общий: если процесс завершился раньше своего таймера, записи разберёт следующий сброс
+в любом процессе или manage.py flush_reactions (можно по cron). Сброс сначала сдвигает отметку
+«разобрано до», потом читает записи; писатель, увидевший отметку не ниже своего номера, ставит
+запись заново — так запись между incr и set не теряется. Вытесненные из кэша записи
+восстанавливает manage.py flush_reactions --rebuild.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import math
+import threading
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import Message, MessageReaction
+from .versioning import bump_room
+
+logger = logging.getLogger(__name__)
+
+MAX_EMOJI_LENGTH = 32
+
+DIRTY_KEY = "chat:reactions:dirty:{}"       # -> (message_id, room_id, created_at)
+SEQ_KEY = "chat:reactions:dirty:seq"         # последний выданный номер
+DONE_KEY = "chat:reactions:dirty:done"       # номера до него включительно разобраны
+GATE_KEY = "chat:reactions:flush-gate"       # не чаще раза в интервал на все процессы
+DIRTY_TTL = 24 * 3600
+MAX_BACKLOG = 100_000  # если отметка пропала из кэша — разбираем не больше стольких последних
+
+_timer: Optional[threading.Timer] = None
+_lock = threading.Lock()
+
+UPDATE_SQL = """
+UPDATE chat_message m
+SET meta = CASE
+    WHEN v.r = '{}'::jsonb THEN COALESCE(m.meta, '{}'::jsonb) - 'reactions'
+    ELSE jsonb_set(COALESCE(m.meta, '{}'::jsonb), '{reactions}', v.r)
+END
+FROM unnest(%s::uuid[], %s::timestamptz[], %s::jsonb[]) AS v(id, created_at, r)
+WHERE m.id = v.id AND m.created_at = v.created_at
+"""
+
+
+def _interval() -> float:
+    return float(getattr(settings, "CHAT_REACTION_FLUSH_SEC", 2))
+
+
+def clean_emoji(raw) -> Optional[str]:
+    emoji = str(raw or "").strip()
+    if not emoji or len(emoji) > MAX_EMOJI_LENGTH:
+        return None
+    return emoji
+
+
+def add_reaction(message: Message, user, emoji: str) -> bool:
+    """True — реакция новая (нужна рассылка), False — уже была."""
+    _, created = MessageReaction.objects.get_or_create(message=message, user=user, emoji=emoji)
+    if created:
+        _touch(message)
+    return created
+
+
+def remove_reaction(message: Message, user, emoji: str) -> bool:
+    deleted, _ = MessageReaction.objects.filter(message=message, user=user, emoji=emoji).delete()
+    if deleted:
+        _touch(message)
+    return bool(deleted)
+
+
+def counts_for(message_id) -> dict[str, int]:
+    """Точные счётчики из таблицы (для ответа на саму реакцию)."""
+    rows = (
+        MessageReaction.objects.filter(message_id=message_id)
+        .values("emoji").annotate(n=Count("id")).order_by("-n", "emoji")
+    )
+    return {r["emoji"]: r["n"] for r in rows}
+
+
+def _touch(message: Message) -> None:
+    mid, room_id, created_at = str(message.pk), message.room_id, message.created_at
+
+    def _apply():
+        # в журнал — после коммита: иначе пересчёт не увидит собственную строку
+        _enqueue(mid, room_id, created_at)
+        maybe_flush()
+    transaction.on_commit(_apply)
+
+
+def _next_seq() -> int:
+    try:
+        return cache.incr(SEQ_KEY)
+    except ValueError:
+        # счётчика нет (первая реакция / кэш потерян) — начинаем журнал заново вместе с отметкой
+        if cache.add(SEQ_KEY, 0, None):
+            cache.set(DONE_KEY, 0, None)
+        return cache.incr(SEQ_KEY)
+
+
+def _enqueue(mid: str, room_id: int, created_at) -> None:
+    while True:
+        seq = _next_seq()
+        cache.set(DIRTY_KEY.format(seq), (mid, room_id, created_at), DIRTY_TTL)
+        # сброс мог забрать номер раньше, чем мы записали под ним сообщение, — тогда повторяем
+        if (cache.get(DONE_KEY) or 0) < seq:
+            return
+
+
+def maybe_flush() -> int:
+    global _timer
+    interval = _interval()
+    if interval <= 0 or cache.add(GATE_KEY, 1, max(1, math.ceil(interval))):
+        return flush_counts()
+    with _lock:
+        if _timer is None:
+            _timer = threading.Timer(interval, _flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    return 0
+
+
+def _flush_in_background() -> None:
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        if _has_pending():
+            maybe_flush()
+    except Exception as e:
+        logger.warning("Reaction counters flush failed: %s", e)
+    finally:
+        connection.close()
+
+
+def _has_pending() -> bool:
+    marks = cache.get_many([SEQ_KEY, DONE_KEY])
+    return marks.get(SEQ_KEY, 0) > marks.get(DONE_KEY, 0)
+
+
+def flush_counts(chunk: int = 1000) -> int:
+    """Разобрать общий журнал грязных сообщений (все процессы). Возвращает число сообщений."""
+    total = 0
+    while True:
+        marks = cache.get_many([SEQ_KEY, DONE_KEY])
+        current = marks.get(SEQ_KEY)
+        if current is None:
+            return total
+        done = marks.get(DONE_KEY)
+        if done is None or done > current:
+            done = max(0, current - MAX_BACKLOG)
+        if done >= current:
+            return total
+        upto = min(current, done + chunk)
+        cache.set(DONE_KEY, upto, None)  # сначала забираем номера, потом читаем (см. _enqueue)
+        keys = [DIRTY_KEY.format(i) for i in range(done + 1, upto + 1)]
+        batch = {mid: (room_id, created_at) for mid, room_id, created_at in cache.get_many(keys).values()}
+        if batch:
+            try:
+                total += write_counts(batch)
+            except Exception:
+                # вернём в журнал — запишем при следующем сбросе
+                for mid, (room_id, created_at) in batch.items():
+                    _enqueue(mid, room_id, created_at)
+                raise
+        cache.delete_many(keys)
+
+
+def write_counts(batch: dict[str, tuple]) -> int:
+    """batch: {message_id: (room_id, created_at)} -> один UPDATE по всем сообщениям."""
+    ids = sorted(batch)  # один порядок блокировок у всех процессов
+    counts: dict[str, dict[str, int]] = {mid: {} for mid in ids}
+    rows = (
+        MessageReaction.objects.filter(message_id__in=ids)
+        .values("message_id", "emoji").annotate(n=Count("id"))
+    )
+    for r in rows:
+        counts[str(r["message_id"])][r["emoji"]] = r["n"]
+
+    with connection.cursor() as cur:
+        cur.execute(UPDATE_SQL, [
+            ids,
+            [batch[mid][1] for mid in ids],
+            [json.dumps(counts[mid], ensure_ascii=False) for mid in ids],
+        ])
+    for room_id in {batch[mid][0] for mid in ids}:
+        bump_room(room_id)
+    return len(ids)
+
+
+def rebuild(message_ids: Optional[Iterable] = None, room_id: Optional[int] = None, chunk: int = 1000) -> int:
+    """Полный пересчёт: сообщения с реакциями и сообщения со «осиротевшими» счётчиками в meta."""
+    qs = Message.objects.all()
+    if room_id is not None:
+        qs = qs.filter(room_id=room_id)
+    if message_ids is not None:
+        qs = qs.filter(pk__in=list(message_ids))
+    else:
+        with_rows = MessageReaction.objects.values("message_id")
+        qs = qs.filter(pk__in=with_rows) | qs.filter(meta__has_key="reactions")
+    total, batch = 0, {}
+    for mid, rid, created_at in qs.values_list("id", "room_id", "created_at").iterator(chunk_size=chunk):
+        batch[str(mid)] = (rid, created_at)
+        if len(batch) >= chunk:
+            total += write_counts(batch)
+            batch = {}
+    if batch:
+        total += write_counts(batch)
+    return total
@@ -0,0 +1,137 @@
+# chat/replay.py
+"""
+Короткий журнал событий комнаты для переподключения без потерь.
+
+Каждое «значимое» событие комнаты (message:new/edit/delete/delete_batch, reaction:delta)
+получает event_id — растущий номер в пределах комнаты — и кладётся в кэш
+(chat:replay:<room>:<event_id>) вместе с готовыми кадрами (chat/frames.py) на CHAT_REPLAY_TTL секунд.
+event_id есть и в самом кадре, клиент запоминает наибольший увиденный.
+
+event_id берётся до рассылки, и два воркера могут разослать N+1 раньше N: клиент, увидевший
+N+1 и отключившийся, не видел N. Поэтому resume отдаёт журнал с запасом — начиная с
+N - CHAT_REPLAY_OVERLAP, — а клиент отбрасывает кадры с уже виденным event_id (держит
+множество последних id, а не только максимум). Дыра в запасе не ошибка: журнал пишется до
+рассылки, значит событие без записи ещё не разослано и придёт по уже оформленной подписке.
+
+После реконнекта клиент шлёт {"type": "resume", "last_event_id": N} и получает кадры
+из журнала как есть, затем {"type": "resume:ok", "replayed": k}. Если отстал больше чем на
+CHAT_REPLAY_SIZE событий, журнал протух, сброшен или в нём нет события после N —
+{"type": "resume:reset"}, и клиент перечитывает страницу через REST, как раньше.
+
+Порядок «подписка -> чтение журнала» даёт дубли вместо дыр: событие, пришедшее между ними,
+клиент увидит дважды (сообщения он и так дедуплицирует по id). presence/typing не журналируются.
+Консьюмеры пишут и читают журнал через amake_room_event / aevents_since (async API кэша).
+"""
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import frames
+
+LOG_KEY = "chat:replay:{}:{}"
+SEQ_KEY = "chat:replay:seq:{}"
+
+
+def _size() -> int:
+    return int(getattr(settings, "CHAT_REPLAY_SIZE", 200))
+
+
+def _overlap() -> int:
+    return int(getattr(settings, "CHAT_REPLAY_OVERLAP", 16))
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_REPLAY_TTL", 300))
+
+
+def next_event_id(room_id: int) -> int:
+    key = SEQ_KEY.format(room_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # счётчика нет (первое событие / кэш потерян): стартуем с текущих микросекунд,
+        # чтобы новые id были больше любых выданных раньше и старый last_event_id не «совпал»
+        start = time.time_ns() // 1000
+        if cache.add(key, start, None):
+            return start
+        return cache.incr(key)
+
+
+async def anext_event_id(room_id: int) -> int:
+    key = SEQ_KEY.format(room_id)
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        start = time.time_ns() // 1000
+        if await cache.aadd(key, start, None):
+            return start
+        return await cache.aincr(key)
+
+
+def reset(room_id: int) -> None:
+    """Сбросить журнал комнаты: кадры в нём устарели (перевыпуск id), resume получит resume:reset."""
+    cache.delete(SEQ_KEY.format(room_id))
+
+
+def _room_event(handler: str, frame: dict, room_id: int, event_id: int) -> dict:
+    event = frames.make_event(handler, {**frame, "event_id": event_id}, room=room_id)
+    event["event_id"] = event_id
+    return event
+
+
+def make_room_event(handler: str, frame: dict, room_id: int) -> dict:
+    """frames.make_event + event_id в кадре + запись в журнал комнаты."""
+    event_id = next_event_id(room_id)
+    event = _room_event(handler, frame, room_id, event_id)
+    cache.set(LOG_KEY.format(room_id, event_id), event, _ttl())
+    return event
+
+
+async def amake_room_event(handler: str, frame: dict, room_id: int) -> dict:
+    event_id = await anext_event_id(room_id)
+    event = _room_event(handler, frame, room_id, event_id)
+    await cache.aset(LOG_KEY.format(room_id, event_id), event, _ttl())
+    return event
+
+
+def _log_keys(room_id: int, last_event_id: int, current: Optional[int]) -> Optional[list[str]]:
+    """Ключи журнала от last_event_id - overlap до current; None — клиент отстал или счётчик сброшен."""
+    if current is None or last_event_id > current or current - last_event_id > _size():
+        return None
+    first = last_event_id - _overlap() + 1
+    return [LOG_KEY.format(room_id, i) for i in range(first, current + 1)]
+
+
+def _collect(keys: list[str], found: dict, required: int) -> Optional[list[dict]]:
+    """Последние required ключей (после last_event_id) обязательны, в запасе перед ними — нет."""
+    events = []
+    for i, key in enumerate(keys):
+        if key in found:
+            events.append(found[key])
+        elif i >= len(keys) - required:
+            return None
+    return events
+
+
+def events_since(room_id: int, last_event_id: int) -> Optional[list[dict]]:
+    """
+    События журнала по порядку, начиная с last_event_id - CHAT_REPLAY_OVERLAP (запас на
+    разосланные не по порядку); None — восстановить нельзя, нужен REST.
+    """
+    current = cache.get(SEQ_KEY.format(room_id))
+    keys = _log_keys(room_id, last_event_id, current)
+    if not keys:
+        return keys
+    return _collect(keys, cache.get_many(keys), current - last_event_id)
+
+
+async def aevents_since(room_id: int, last_event_id: int) -> Optional[list[dict]]:
+    current = await cache.aget(SEQ_KEY.format(room_id))
+    keys = _log_keys(room_id, last_event_id, current)
+    if not keys:
+        return keys
+    return _collect(keys, await cache.aget_many(keys), current - last_event_id)
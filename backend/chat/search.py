@@ -0,0 +1,148 @@
+# chat/search.py
+"""
+Поиск на Postgres FTS.
+
+Сообщения: Message.search_vector — генерируемая колонка (simple + russian + english) с GIN-индексом.
+Запрос строим в конфигурации языка пользователя (interface_language): стеммированные
+лексемы совпадут со своей частью вектора, а 'simple' — с точными словами на любом языке.
+
+Пользователи: User.search_document (simple, GIN) — префиксный поиск по словам
+(nickname / email и слова адреса / имя / фамилия). Запрос с пунктуацией ("john.smith@exa")
+ищется только как префикс lower(email)/lower(nickname) по btree text_pattern_ops; запрос
+из двух символов — как целое слово или префикс ника/почты. Точные и префиксные совпадения — выше.
+"""
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import BigIntegerField, Case, Exists, ExpressionWrapper, F, OuterRef, Q, QuerySet, Value, When
+from django.db.models.functions import Lower
+
+from .blocks import exclude_blocked
+from .models import Chat, ChatParticipant, ChatType, Message, MESSAGE_SEARCH_CONFIGS
+from .services import visible_messages
+
+# interface_language -> конфигурация FTS (должна входить в MESSAGE_SEARCH_CONFIGS)
+LANGUAGE_SEARCH_CONFIGS = {
+    "ru": "russian",
+    "en": "english",
+}
+DEFAULT_SEARCH_CONFIG = "simple"
+
+MIN_QUERY_LENGTH = 2
+
+
+def search_config_for(user) -> str:
+    lang = (getattr(user, "interface_language", "") or "").lower()[:2]
+    config = LANGUAGE_SEARCH_CONFIGS.get(lang, DEFAULT_SEARCH_CONFIG)
+    return config if config in MESSAGE_SEARCH_CONFIGS else DEFAULT_SEARCH_CONFIG
+
+
+def user_can_read_room(user, chat: Chat) -> bool:
+    """Как и в ChatConsumer: групповые комнаты открыты, приватные — только участникам."""
+    if chat.type != ChatType.PRIVATE:
+        return True
+    return ChatParticipant.objects.filter(chat=chat, user=user).exists()
+
+
+def search_messages(user, q: str, room_id: Optional[int] = None) -> QuerySet:
+    """
+    Возвращает queryset сообщений с аннотацией rank (по убыванию релевантности).
+    Без room_id ищем только по чатам, где пользователь — участник.
+    Учитываются deleted_at, cleared_before и HiddenMessage текущего пользователя.
+    Проверку доступа к конкретной комнате делает вызывающий (user_can_read_room).
+    """
+    q = (q or "").strip()
+    if len(q) < MIN_QUERY_LENGTH:
+        return Message.objects.none()
+
+    query = SearchQuery(q, config=search_config_for(user), search_type="websearch")
+
+    qs = Message.objects.filter(search_vector=query, deleted_at__isnull=True)
+    if room_id is not None:
+        qs = qs.filter(room_id=room_id)
+    else:
+        qs = qs.filter(
+            Exists(ChatParticipant.objects.filter(chat_id=OuterRef("room_id"), user=user))
+        )
+
+    return (
+        visible_messages(qs, user, room_id)
+        .annotate(rank=SearchRank(F("search_vector"), query, cover_density=True))
+        .select_related("room", "author")
+    )
+
+
+# ------------------ Пользователи ------------------
+
+USER_MIN_QUERY_LENGTH = 2
+USER_MAX_QUERY_TERMS = 5
+# запрос короче — только целые слова и начало ника/почты: префикс из двух букв есть почти у всех
+USER_PREFIX_MIN_LENGTH = 3
+
+# sort_key = bucket * SPAN + id: один монотонный ключ для курсора (без OFFSET)
+USER_BUCKET_EXACT = 0
+USER_BUCKET_PREFIX = 1
+USER_BUCKET_OTHER = 2
+USER_BUCKET_SPAN = 1 << 40
+
+_TSQUERY_SPECIAL = re.compile(r"[&|!():*<>'\\\s]+")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def build_prefix_tsquery(q: str, prefix: bool = True) -> Optional[str]:
+    """'John Sm' -> "'john':* & 'sm':*" (сырой tsquery, спецсимволы вырезаны); prefix=False — без ':*'."""
+    terms = [t for t in _TSQUERY_SPECIAL.split(q.lower()) if t][:USER_MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    suffix = ":*" if prefix else ""
+    return " & ".join(f"'{t}'{suffix}" for t in terms)
+
+
+def search_users(user, q: str) -> QuerySet:
+    """
+    Префиксный поиск пользователей по User.search_document (GIN).
+    Исключаем себя и всех, с кем есть блокировка в любую сторону (NOT EXISTS).
+    Аннотация sort_key: точное совпадение ника/почты, затем префикс, затем прочие; внутри — по id.
+    """
+    UserModel = get_user_model()
+    q = (q or "").strip()
+    if len(q) < USER_MIN_QUERY_LENGTH:
+        return UserModel.objects.none()
+
+    raw = build_prefix_tsquery(q, prefix=len(q) >= USER_PREFIX_MIN_LENGTH)
+    if not raw:
+        return UserModel.objects.none()
+
+    ql = q.lower()
+    bucket = Case(
+        When(Q(nickname_lower=ql) | Q(email_lower=ql), then=Value(USER_BUCKET_EXACT)),
+        When(Q(nickname_lower__startswith=ql) | Q(email_lower__startswith=ql), then=Value(USER_BUCKET_PREFIX)),
+        default=Value(USER_BUCKET_OTHER),
+        output_field=BigIntegerField(),
+    )
+    by_prefix = Q(nickname_lower__startswith=ql) | Q(email_lower__startswith=ql)
+    by_words = Q(search_document=SearchQuery(raw, config="simple", search_type="raw"))
+    if _PUNCTUATION.search(ql) and not any(c.isspace() for c in ql):
+        # одно слово с точкой/@/дефисом — начало почты или ника: только LIKE 'q%' по users_user_*_like
+        # (в tsquery оно распалось бы на общие слова вроде домена)
+        match = by_prefix
+    elif len(ql) < USER_PREFIX_MIN_LENGTH:
+        match = by_words | by_prefix
+    else:
+        match = by_words
+    qs = (
+        UserModel.objects
+        .annotate(nickname_lower=Lower("nickname"), email_lower=Lower("email"))
+        .filter(match)
+        .exclude(pk=user.pk)
+    )
+    return (
+        exclude_blocked(qs, user)
+        .annotate(sort_key=ExpressionWrapper(
+            bucket * Value(USER_BUCKET_SPAN) + F("id"), output_field=BigIntegerField(),
+        ))
+    )
@@ -6,6 +6,7 @@ from mimetypes import guess_type
 from django.utils import timezone
 from rest_framework import serializers
 
+from . import archive
 from .models import Folder, Chat, Label, Message, ChatParticipant
 from .models import FriendRequest, FriendRequestStatus, Friendship, Block
 
@@ -83,6 +84,28 @@ class UserMiniSerializer(serializers.Serializer):
         return None
 
 
+def serialize_users_mini(rows, request=None) -> list[dict]:
+    """
+    Быстрый путь для списков: то же, что UserMiniSerializer(many=True), но по строкам
+    .values("id", "nickname", "email", "avatar") без объектов модели и полей DRF.
+    """
+    from django.contrib.auth import get_user_model
+
+    storage = get_user_model()._meta.get_field("avatar").storage
+    out = []
+    for r in rows:
+        avatar = None
+        if r.get("avatar"):
+            url = storage.url(r["avatar"])
+            avatar = request.build_absolute_uri(url) if request else url
+        out.append({
+            "id": r["id"],
+            "nickname": r.get("nickname") or r.get("email") or f"user:{r['id']}",
+            "avatar": avatar,
+        })
+    return out
+
+
 # ===== Messages =====
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -222,6 +245,24 @@ class MessageSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class MessageBatchSerializer(serializers.Serializer):
+    """Тело пакетных операций: {"ids": [uuid, ...]} (не больше MAX_IDS)."""
+    MAX_IDS = 500
+
+    ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=MAX_IDS)
+
+
+class MarkReadBatchSerializer(serializers.Serializer):
+    """{"rooms": [id, ...]} и/или {"ids": [uuid, ...]} — чаты берутся из сообщений."""
+    rooms = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=500)
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False, max_length=500)
+
+    def validate(self, attrs):
+        if not attrs.get("rooms") and not attrs.get("ids"):
+            raise serializers.ValidationError("Нужно передать rooms или ids.")
+        return attrs
+
+
 # ===== Conversations (Личные сообщения) =====
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -245,11 +286,48 @@ class ConversationSerializer(serializers.ModelSerializer):
 
     def get_other_user(self, obj) -> Optional[dict]:
         request_user = self.context["request"].user
-        other = obj.participants.exclude(pk=request_user.pk).first()
+        if "participants" in getattr(obj, "_prefetched_objects_cache", {}):
+            # список диалогов подгружает участников заранее — без запроса на строку
+            other = next((u for u in obj.participants.all() if u.pk != request_user.pk), None)
+        else:
+            other = obj.participants.exclude(pk=request_user.pk).first()
         return UserMiniSerializer(other, context=self.context).data if other else None
 
+    def _link(self, obj) -> Optional[ChatParticipant]:
+        # одна строка участника на чат для unread_count и cleared_before
+        cache = self.context.setdefault("_participant_links", {})
+        if obj.pk not in cache:
+            request_user = self.context["request"].user
+            cache[obj.pk] = (
+                ChatParticipant.objects.filter(chat=obj, user=request_user)
+                .only("unread_count", "cleared_before").first()
+            )
+        return cache[obj.pk]
+
+    def _last_message(self, obj) -> Optional[Message]:
+        try:
+            lm = obj.last_message
+        except Message.DoesNotExist:
+            lm = None
+        if lm is None and obj.last_message_id:
+            # строка ушла в холодный архив — превью оттуда (async-список кладёт их в контекст заранее)
+            previews = self.context.setdefault("_archived_previews", {})
+            if obj.pk not in previews:
+                previews[obj.pk] = archive.latest_message(obj.pk)
+            lm = previews[obj.pk]
+        return lm
+
+    def _visible_last_message(self, obj):
+        lm = self._last_message(obj)
+        if not lm:
+            return None
+        link = self._link(obj)
+        if link and link.cleared_before and lm.created_at <= link.cleared_before:
+            return None
+        return lm
+
     def get_last_message_text(self, obj) -> Optional[str]:
-        lm = obj.last_message
+        lm = self._visible_last_message(obj)
         if not lm:
             return None
         if lm.content:
@@ -257,11 +335,11 @@ class ConversationSerializer(serializers.ModelSerializer):
         return lm.attachment_name or "Вложение"
 
     def get_last_message_created_at(self, obj):
-        return obj.last_message.created_at if obj.last_message else None
+        lm = self._visible_last_message(obj)
+        return lm.created_at if lm else None
 
     def get_unread_count(self, obj) -> int:
-        request_user = self.context["request"].user
-        link = ChatParticipant.objects.filter(chat=obj, user=request_user).only("unread_count").first()
+        link = self._link(obj)
         return link.unread_count if link else 0
 
 
@@ -4,12 +4,13 @@ from typing import Tuple
 
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Exists, F, OuterRef, Q, QuerySet
 from django.utils import timezone
-from django.db.models import Q
 
-from .models import Chat, ChatParticipant, ChatType, Message
+from .models import Chat, ChatParticipant, ChatType, HiddenMessage, HistoryWatermark, Message
 from .models import FriendRequest, FriendRequestStatus, Friendship, Block
+from .versioning import bump_users, bump_private_participants
+from . import friend_graph
 
 User = get_user_model()
 
@@ -35,6 +36,7 @@ def get_or_create_private_chat(current_user: User, other_user: User) -> Tuple[Ch
             ChatParticipant(chat=chat, user=current_user),
             ChatParticipant(chat=chat, user=other_user),
         ])
+        bump_users(current_user.id, other_user.id)
         created = True
     return chat, created
 
@@ -43,12 +45,136 @@ def mark_conversation_read(chat: Chat, user: User) -> None:
     ChatParticipant.objects.filter(chat=chat, user=user).update(
         last_read_at=timezone.now(), unread_count=0
     )
+    bump_users(user.id)
 
 
 def inc_unread_for_others(chat: Chat, author: User) -> None:
     ChatParticipant.objects.filter(chat=chat).exclude(user=author).update(
         unread_count=F("unread_count") + 1
     )
+    bump_private_participants(chat.id)
+
+
+# ------------------ Видимость истории для пользователя ------------------
+
+def _watermarks(user: User, room_id: int) -> QuerySet:
+    # участник — ChatParticipant.cleared_before, читатель группы — HistoryWatermark; одним запросом
+    return (
+        ChatParticipant.objects.filter(chat_id=room_id, user=user, cleared_before__isnull=False)
+        .values_list("cleared_before", flat=True)
+        .union(HistoryWatermark.objects.filter(chat_id=room_id, user=user).values_list("cleared_before", flat=True))
+    )
+
+
+def history_watermark(user: User, room_id: int):
+    """Водяной знак «очистить историю у себя» в комнате или None."""
+    return max(_watermarks(user, room_id), default=None)
+
+
+async def ahistory_watermark(user: User, room_id: int):
+    return max([mark async for mark in _watermarks(user, room_id)], default=None)
+
+
+def visible_messages(qs: QuerySet, user: User, room_id: int | None = None) -> QuerySet:
+    """
+    Убирает из queryset сообщений то, что пользователь скрыл у себя:
+    историю до водяного знака (history_watermark) и отдельные HiddenMessage.
+    С room_id водяной знак читается заранее и становится простым created_at > …;
+    без него (поиск по всем чатам) — коррелированный NOT EXISTS.
+    """
+    if room_id is not None:
+        cleared_before = history_watermark(user, room_id)
+        if cleared_before is not None:
+            qs = qs.filter(created_at__gt=cleared_before)
+    else:
+        qs = qs.filter(
+            ~Exists(ChatParticipant.objects.filter(
+                chat_id=OuterRef("room_id"), user=user, cleared_before__gte=OuterRef("created_at"),
+            )),
+            ~Exists(HistoryWatermark.objects.filter(
+                chat_id=OuterRef("room_id"), user=user, cleared_before__gte=OuterRef("created_at"),
+            )),
+        )
+    return qs.filter(~Exists(HiddenMessage.objects.filter(user=user, message_id=OuterRef("pk"))))
+
+
+async def avisible_messages(qs: QuerySet, user: User, room_id: int) -> QuerySet:
+    """visible_messages для одной комнаты в async-представлении: водяной знак читается async ORM."""
+    cleared_before = await ahistory_watermark(user, room_id)
+    if cleared_before is not None:
+        qs = qs.filter(created_at__gt=cleared_before)
+    return qs.filter(~Exists(HiddenMessage.objects.filter(user=user, message_id=OuterRef("pk"))))
+
+
+@transaction.atomic
+def clear_history(chat: Chat, user: User):
+    """
+    «Очистить историю у себя»: одна запись водяного знака вместо строки HiddenMessage на сообщение.
+    Участнику — в его ChatParticipant, читателю групповой комнаты — в HistoryWatermark
+    (строку участника не создаём: очистка не должна делать его участником).
+    Скрытия под водяным знаком становятся лишними и удаляются. Возвращает водяной знак.
+    """
+    now = timezone.now()
+    updated = ChatParticipant.objects.filter(chat=chat, user=user).update(
+        cleared_before=now, unread_count=0, last_read_at=now,
+    )
+    if not updated:
+        HistoryWatermark.objects.update_or_create(chat=chat, user=user, defaults={"cleared_before": now})
+    HiddenMessage.objects.filter(user=user, message__room=chat, message__created_at__lte=now).delete()
+    bump_users(user.id)
+    return now
+
+
+# ------------------ Пакетные операции с сообщениями ------------------
+
+def hide_messages(user: User, message_ids) -> int:
+    """«Удалить у себя» пачкой: один SELECT существующих id + один INSERT ... ON CONFLICT DO NOTHING."""
+    # только сообщения комнат, которые пользователь может читать (как user_can_read_room)
+    existing = list(
+        Message.objects.filter(id__in=message_ids)
+        .filter(
+            ~Q(room__type=ChatType.PRIVATE)
+            | Exists(ChatParticipant.objects.filter(chat_id=OuterRef("room_id"), user=user))
+        )
+        .values_list("id", flat=True)
+    )
+    HiddenMessage.objects.bulk_create(
+        [HiddenMessage(user=user, message_id=mid) for mid in existing],
+        ignore_conflicts=True,
+    )
+    bump_users(user.id)  # bulk_create не шлёт сигналов
+    return len(existing)
+
+
+@transaction.atomic
+def delete_messages_for_all(user: User, message_ids) -> dict[int, list[str]]:
+    """
+    «Удалить у всех» пачкой: автор удаляет свои, staff/superuser — любые.
+    Возвращает {room_id: [message_id, ...]} реально удалённых — для рассылки по комнатам.
+    """
+    qs = Message.objects.filter(id__in=message_ids)
+    if not (user.is_staff or user.is_superuser):
+        qs = qs.filter(author=user)
+
+    by_room: dict[int, list[str]] = {}
+    for mid, room_id in qs.values_list("id", "room_id"):
+        by_room.setdefault(room_id, []).append(str(mid))
+    if not by_room:
+        return by_room
+
+    Message.objects.filter(id__in=[m for ids in by_room.values() for m in ids]).delete()
+    for room_id in by_room:
+        bump_private_participants(room_id)  # last_message мог обнулиться
+    return by_room
+
+
+def mark_rooms_read(user: User, room_ids) -> int:
+    """Пометить прочитанными несколько чатов одним UPDATE."""
+    updated = ChatParticipant.objects.filter(user=user, chat_id__in=room_ids).update(
+        last_read_at=timezone.now(), unread_count=0
+    )
+    bump_users(user.id)
+    return updated
 
 
 def maybe_set_expires_at(message: Message) -> None:
@@ -66,11 +192,7 @@ def _pair(a_id: int, b_id: int):
     return x, y
 
 def are_friends(a, b) -> bool:
-    x, y = _pair(a.id, b.id)
-    return Friendship.objects.filter(user1_id=x, user2_id=y).exists()
-
-def block_exists(a, b) -> bool:
-    return Block.objects.filter(Q(blocker=a, blocked=b) | Q(blocker=b, blocked=a)).exists()
+    return friend_graph.are_friends(a.id, b.id)
 
 def send_friend_request(from_user, to_user) -> FriendRequest:
     if from_user.id == to_user.id:
@@ -0,0 +1,74 @@
+# chat/signals.py
+"""
+Поднимаем версии списков (chat/versioning.py) и сбрасываем кэши при записи моделей чата.
+Массовые .update()/bulk_create() сигналов не шлют — там версии поднимаются явно в services.
+"""
+from __future__ import annotations
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import friend_graph
+from .blocks import invalidate_block_ids
+from .models import Block, Chat, Folder, Friendship, HiddenMessage, Label, Message
+from .versioning import bump_folders, bump_private_partners, bump_private_participants, bump_room, bump_users
+
+# поля пользователя, которые видны в списках диалогов собеседников
+PROFILE_FIELDS = frozenset({"nickname", "email", "avatar"})
+
+
+@receiver(post_save, sender=Message, dispatch_uid="chat.versions.message_save")
+@receiver(post_delete, sender=Message, dispatch_uid="chat.versions.message_delete")
+def _on_message_write(sender, instance: Message, **kwargs):
+    # Только кэш, без запросов: сигнал срабатывает на каждую строку массового удаления.
+    # Списки диалогов (ЛС) поднимаются явно там, где меняются last_message/unread.
+    if instance.room_id:
+        bump_room(instance.room_id)
+
+
+@receiver(post_save, sender=HiddenMessage, dispatch_uid="chat.versions.hidden_save")
+@receiver(post_delete, sender=HiddenMessage, dispatch_uid="chat.versions.hidden_delete")
+def _on_hidden_write(sender, instance: HiddenMessage, **kwargs):
+    bump_users(instance.user_id)
+
+
+@receiver(post_save, sender=Chat, dispatch_uid="chat.versions.chat_save")
+@receiver(post_delete, sender=Chat, dispatch_uid="chat.versions.chat_delete")
+def _on_chat_write(sender, instance: Chat, **kwargs):
+    bump_folders()
+    if kwargs.get("signal") is post_save:
+        bump_private_participants(instance.pk)
+
+
+@receiver(post_save, sender=Folder, dispatch_uid="chat.versions.folder_save")
+@receiver(post_delete, sender=Folder, dispatch_uid="chat.versions.folder_delete")
+@receiver(post_save, sender=Label, dispatch_uid="chat.versions.label_save")
+@receiver(post_delete, sender=Label, dispatch_uid="chat.versions.label_delete")
+@receiver(m2m_changed, sender=Chat.folders.through, dispatch_uid="chat.versions.chat_folders")
+@receiver(m2m_changed, sender=Chat.labels.through, dispatch_uid="chat.versions.chat_labels")
+@receiver(m2m_changed, sender=Folder.labels.through, dispatch_uid="chat.versions.folder_labels")
+def _on_folder_write(sender, **kwargs):
+    bump_folders()
+
+
+@receiver(post_save, sender=Block, dispatch_uid="chat.blocks.block_save")
+@receiver(post_delete, sender=Block, dispatch_uid="chat.blocks.block_delete")
+def _on_block_write(sender, instance: Block, **kwargs):
+    invalidate_block_ids(instance.blocker_id, instance.blocked_id)
+    # блокировка скрывает диалоги из списков обоих
+    bump_users(instance.blocker_id, instance.blocked_id)
+
+
+@receiver(post_save, sender=Friendship, dispatch_uid="chat.friend_graph.friendship_save")
+@receiver(post_delete, sender=Friendship, dispatch_uid="chat.friend_graph.friendship_delete")
+def _on_friendship_write(sender, instance: Friendship, **kwargs):
+    friend_graph.invalidate_edge(instance.user1_id, instance.user2_id)
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid="chat.versions.user_save")
+def _on_user_write(sender, instance, created: bool, update_fields=None, **kwargs):
+    # новый пользователь ни в одном ЛС ещё не состоит; last_login и прочее списки не меняет
+    if created or (update_fields is not None and not PROFILE_FIELDS & set(update_fields)):
+        return
+    bump_private_partners(instance.pk)
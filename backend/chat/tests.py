@@ -1,3 +1,1537 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from . import friend_graph
+from .blocks import block_exists
+from .models import Block, Chat, ChatParticipant, ChatType, Folder, Friendship, HiddenMessage, Label, Message, MessageReaction
+from .services import accept_friend_request, block_user, get_or_create_private_chat, remove_friend, send_friend_request
+
+
+class ConditionalListTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="etag@example.com", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="world")
+        Message.objects.create(room=self.room, author=self.user, content="hello")
+
+    def test_messages_304_until_room_changes(self):
+        url = f"/api/messages/?room={self.room.id}"
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        etag = res["ETag"]
+
+        # неизменённый опрос — 304 и ни одного запроса в БД
+        with self.assertNumQueries(0):
+            res2 = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res2.status_code, 304)
+
+        # новое сообщение поднимает версию комнаты (после коммита)
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(room=self.room, author=self.user, content="again")
+        res3 = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res3.status_code, 200)
+        self.assertNotEqual(res3["ETag"], etag)
+
+    def test_hide_changes_user_version(self):
+        url = f"/api/messages/?room={self.room.id}"
+        etag = self.client.get(url)["ETag"]
+        msg = Message.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/messages/{msg.id}/hide/")
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data["results"]), 0)
+
+    def test_profile_save_changes_partner_conversation_list(self):
+        other = get_user_model().objects.create_user(email="partner@example.com", password="pass12345")
+        get_or_create_private_chat(self.user, other)
+        url = "/api/conversations/"
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save(update_fields=["last_login"])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.nickname = "Renamed"
+            other.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data[0]["other_user"]["nickname"], "Renamed")
+
+    def test_if_modified_since_alone_is_not_304(self):
+        from django.utils.http import http_date
+
+        url = f"/api/messages/?room={self.room.id}"
+        res = self.client.get(url)
+        self.assertNotIn("Last-Modified", res)
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(room=self.room, author=self.user, content="same second")
+        res = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data["results"]), 2)
+
+    def test_folders_304(self):
+        etag = self.client.get("/api/folders/")["ETag"]
+        self.assertEqual(self.client.get("/api/folders/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/folders/", {"name": "Work"}, format="json")
+        self.assertEqual(self.client.get("/api/folders/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class MessageSearchTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email="search@example.com", password="pass12345", interface_language="ru")
+        self.other = User.objects.create_user(email="other@example.com", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="world")
+        ChatParticipant.objects.create(chat=self.room, user=self.user)
+
+    def test_stemmed_ranked_and_hidden_excluded(self):
+        a = Message.objects.create(room=self.room, author=self.other, content="Завтра встречаемся у метро")
+        b = Message.objects.create(room=self.room, author=self.other, content="встречи встреча встречаемся")
+        c = Message.objects.create(room=self.room, author=self.other, content="встречаемся вечером")
+        Message.objects.create(room=self.room, author=self.other, content="совсем другое")
+        HiddenMessage.objects.create(user=self.user, message=c)
+
+        res = self.client.get("/api/messages/search/", {"q": "встречаться"})
+        self.assertEqual(res.status_code, 200)
+        ids = [r["id"] for r in res.data["results"]]
+        self.assertEqual(ids, [str(b.id), str(a.id)])
+
+    def test_private_room_requires_membership(self):
+        dm = Chat.objects.create(name="dm", type=ChatType.PRIVATE)
+        Message.objects.create(room=dm, author=self.other, content="секрет")
+        res = self.client.get("/api/messages/search/", {"q": "секрет", "room": dm.id})
+        self.assertEqual(res.status_code, 403)
+        # без room ищем только по своим чатам
+        res = self.client.get("/api/messages/search/", {"q": "секрет"})
+        self.assertEqual(res.data["results"], [])
+
+
+class UserSearchTests(APITestCase):
+    def setUp(self):
+        self.User = get_user_model()
+        self.me = self.User.objects.create_user(email="me@example.com", password="pass12345", nickname="me")
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def test_exact_then_prefix_then_word_and_blocks_excluded(self):
+        other = self.User.objects.create_user(email="z@example.com", password="x", nickname="zed", first_name="Alex")
+        prefix = self.User.objects.create_user(email="p@example.com", password="x", nickname="Alexander")
+        exact = self.User.objects.create_user(email="e@example.com", password="x", nickname="alex")
+        blocked = self.User.objects.create_user(email="b@example.com", password="x", nickname="alex2")
+        Block.objects.create(blocker=blocked, blocked=self.me)
+
+        res = self.client.get("/api/users/search/", {"q": "Alex"})
+        self.assertEqual(res.status_code, 200)
+        ids = [u["id"] for u in res.data["results"]]
+        self.assertEqual(ids, [exact.id, prefix.id, other.id])
+
+    def test_partial_email_and_email_words(self):
+        john = self.User.objects.create_user(email="john.smith@example.com", password="x", nickname="js")
+        self.User.objects.create_user(email="johnny@example.com", password="x", nickname="jj")
+        for q in ("john.smith@exa", "john.sm", "smith", "JOHN.SMITH@EXAMPLE.COM"):
+            res = self.client.get("/api/users/search/", {"q": q})
+            self.assertEqual([u["id"] for u in res.data["results"]], [john.id], q)
+
+    def test_two_letter_query_matches_whole_words_and_nickname_start(self):
+        li = self.User.objects.create_user(email="w@example.com", password="x", nickname="wen", last_name="Li")
+        self.User.objects.create_user(email="l@example.com", password="x", nickname="x", last_name="Lindgren")
+        lina = self.User.objects.create_user(email="n@example.com", password="x", nickname="lina")
+        res = self.client.get("/api/users/search/", {"q": "li"})
+        self.assertEqual([u["id"] for u in res.data["results"]], [lina.id, li.id])
+
+    def test_keyset_pages(self):
+        for i in range(5):
+            self.User.objects.create_user(email=f"u{i}@example.com", password="x", nickname=f"kate{i}")
+        url, seen = "/api/users/search/?q=kat&page_size=2", []
+        while url:
+            res = self.client.get(url)
+            seen += [u["id"] for u in res.data["results"]]
+            url = res.data["next"]
+        self.assertEqual(len(set(seen)), 5)
+
+
+class BlockFilteringTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.me = User.objects.create_user(email="me@example.com", password="x", nickname="me")
+        self.friend = User.objects.create_user(email="f@example.com", password="x", nickname="friend")
+        self.foe = User.objects.create_user(email="foe@example.com", password="x", nickname="foe")
+        for u in (self.friend, self.foe):
+            Friendship.objects.create(user1=self.me, user2=u)
+            get_or_create_private_chat(self.me, u)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def test_lists_hide_blocked_users(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            block_user(self.foe, self.me)
+
+        friends = self.client.get("/api/friends/").data
+        self.assertEqual([u["id"] for u in friends], [self.friend.id])
+
+        convs = self.client.get("/api/conversations/").data
+        self.assertEqual([c["other_user"]["id"] for c in convs], [self.friend.id])
+
+    def test_block_exists_is_cached_and_invalidated(self):
+        self.assertFalse(block_exists(self.me, self.foe))
+        with self.assertNumQueries(0):
+            self.assertFalse(block_exists(self.me, self.foe))
+        with self.captureOnCommitCallbacks(execute=True):
+            block_user(self.me, self.foe)
+        self.assertTrue(block_exists(self.foe, self.me))
+
+
+class FriendGraphTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.a, self.b, self.c, self.d = [
+            User.objects.create_user(email=f"{n}@example.com", password="x", nickname=n) for n in "abcd"
+        ]
+        for x, y in ((self.a, self.b), (self.b, self.c), (self.b, self.d), (self.a, self.d)):
+            Friendship.objects.create(user1=x, user2=y)
+
+    def test_friendship_change_invalidates_both_sides(self):
+        self.assertFalse(friend_graph.are_friends(self.a.id, self.c.id))
+        friend_graph.friend_ids(self.c.id)  # прогреваем обе стороны
+
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_friend_request(send_friend_request(self.a, self.c))
+        self.assertTrue(friend_graph.are_friends(self.a.id, self.c.id))
+        self.assertTrue(friend_graph.are_friends(self.c.id, self.a.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(self.a.id, self.c.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            remove_friend(self.a, self.c)
+        self.assertFalse(friend_graph.are_friends(self.a.id, self.c.id))
+        self.assertFalse(friend_graph.are_friends(self.c.id, self.a.id))
+
+    def test_suggestions_and_mutual(self):
+        self.assertEqual(friend_graph.mutual_friend_ids(self.a.id, self.b.id), {self.d.id})
+        # c — друг b; d уже друг a
+        self.assertEqual(friend_graph.suggest_friend_ids(self.a.id), [(self.c.id, 1)])
+
+        client = APIClient()
+        client.force_authenticate(self.a)
+        res = client.get("/api/friends/suggestions/")
+        self.assertEqual(res.data, [{"id": self.c.id, "nickname": "c", "avatar": None, "mutual_count": 1}])
+        res = client.get("/api/friends/")
+        self.assertEqual([u["id"] for u in res.data], [self.b.id, self.d.id])
+
+    def test_suggestions_limit_is_parsed_defensively(self):
+        client = APIClient()
+        client.force_authenticate(self.a)
+        for limit in ("abc", "-5", "0", "100000"):
+            res = client.get("/api/friends/suggestions/", {"limit": limit})
+            self.assertEqual(res.status_code, 200, limit)
+        self.assertEqual(client.get("/api/friends/suggestions/", {"limit": "0"}).data[0]["id"], self.c.id)
+
+
+class FolderTreeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email="t@example.com", password="x"))
+        self.root = Folder.objects.create(name="Root")
+        self.child = Folder.objects.create(name="B-child", parent=self.root)
+        self.leaf = Folder.objects.create(name="A-leaf", parent=self.child)
+        self.other = Folder.objects.create(name="Other")
+        label = Label.objects.create(name="hot")
+        chat = Chat.objects.create(name="general")
+        chat.folders.add(self.leaf)
+        chat.labels.add(label)
+
+    def test_tree_two_queries_then_cached(self):
+        with self.assertNumQueries(3):  # корень + папки диапазоном + чаты
+            res = self.client.get(f"/api/folders/tree/?root={self.root.id}")
+        self.assertEqual(len(res.data), 1)
+        node = res.data[0]
+        self.assertEqual(node["id"], self.root.id)
+        self.assertEqual([c["id"] for c in node["children"]], [self.child.id])
+        leaf = node["children"][0]["children"][0]
+        self.assertEqual(leaf["chats"][0]["name"], "general")
+        self.assertEqual(leaf["chats"][0]["labels"][0]["name"], "hot")
+
+        with self.assertNumQueries(1):  # только корень, дерево из кэша
+            self.client.get(f"/api/folders/tree/?root={self.root.id}")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Folder.objects.create(name="C-new", parent=self.root)
+        res = self.client.get(f"/api/folders/tree/?root={self.root.id}")
+        self.assertEqual(len(res.data[0]["children"]), 2)
+
+    def test_full_forest(self):
+        res = self.client.get("/api/folders/tree/")
+        self.assertEqual([n["name"] for n in res.data], ["Other", "Root"])
+
+
+class FolderChatListTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email="c@example.com", password="x"))
+        self.root = Folder.objects.create(name="Root")
+        self.sub = Folder.objects.create(name="Sub", parent=self.root)
+        self.a = Chat.objects.create(name="a")
+        self.b = Chat.objects.create(name="b")
+        self.a.folders.add(self.root, self.sub)  # в двух папках — не должен задвоиться
+        self.b.folders.add(self.sub)
+
+    def test_folder_and_descendants_without_distinct(self):
+        res = self.client.get(f"/api/chats/?folder={self.root.id}")
+        self.assertEqual([c["id"] for c in res.data["results"]], [self.a.id])
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(f"/api/chats/?folder={self.root.id}&descendants=1")
+        self.assertEqual([c["id"] for c in res.data["results"]], [self.b.id, self.a.id])
+
+        sql = next(q["sql"] for q in ctx.captured_queries if 'FROM "chat_chat"' in q["sql"])
+        self.assertNotIn("DISTINCT", sql)
+        with connection.cursor() as cur:
+            cur.execute("EXPLAIN " + sql)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        self.assertNotIn("Unique", plan)
+
+
+class MessageBatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="batch@example.com", password="x")
+        self.other = User.objects.create_user(email="batch2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room1 = Chat.objects.create(name="r1")
+        self.room2 = Chat.objects.create(name="r2")
+        self.mine = [Message.objects.create(room=r, author=self.user, content="m") for r in (self.room1, self.room1, self.room2)]
+        self.foreign = Message.objects.create(room=self.room1, author=self.other, content="f")
+
+    def test_bulk_hide_idempotent(self):
+        ids = [str(m.id) for m in self.mine]
+        res = self.client.post("/api/messages/bulk-hide/", {"ids": ids}, format="json")
+        self.assertEqual(res.data["hidden"], 3)
+        self.client.post("/api/messages/bulk-hide/", {"ids": ids}, format="json")
+        self.assertEqual(HiddenMessage.objects.filter(user=self.user).count(), 3)
+
+    def test_bulk_delete_one_event_per_room(self):
+        from unittest import mock
+
+        ids = [str(m.id) for m in self.mine] + [str(self.foreign.id)]
+        with mock.patch("chat.views.get_channel_layer") as gcl:
+            sent = []
+
+            async def group_send(group, event):
+                sent.append((group, event))
+            gcl.return_value.group_send = group_send
+            res = self.client.post("/api/messages/bulk-delete/", {"ids": ids}, format="json")
+
+        self.assertEqual(res.data, {"deleted": 3, "skipped": 1})
+        self.assertTrue(Message.objects.filter(id=self.foreign.id).exists())
+        self.assertEqual(sorted(g for g, _ in sent), [f"chat_{self.room1.id}", f"chat_{self.room2.id}"])
+        by_group = dict(sent)
+        self.assertEqual(by_group[f"chat_{self.room1.id}"]["type"], "chat_delete_batch")
+        self.assertEqual(len(json.loads(by_group[f"chat_{self.room1.id}"]["text"])["payload"]["ids"]), 2)
+
+    def test_mark_read_single_update(self):
+        for room in (self.room1, self.room2):
+            ChatParticipant.objects.create(chat=room, user=self.user, unread_count=5)
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.post(
+                "/api/messages/mark-read/", {"rooms": [self.room1.id, self.room2.id]}, format="json"
+            )
+        self.assertEqual(res.data["updated"], 2)
+        self.assertEqual(sum(q["sql"].startswith("UPDATE") for q in ctx.captured_queries), 1)
+        self.assertFalse(ChatParticipant.objects.filter(user=self.user, unread_count__gt=0).exists())
+
+    def test_mark_read_ignores_foreign_chats(self):
+        from unittest import mock
+
+        stranger = get_user_model().objects.create_user(email="stranger@example.com", password="x")
+        dm, _ = get_or_create_private_chat(self.other, stranger)
+        dm_msg = Message.objects.create(room=dm, author=stranger, content="secret")
+        with mock.patch("chat.views.notify_user") as notify:
+            res = self.client.post(
+                "/api/messages/mark-read/", {"rooms": [dm.id], "ids": [str(dm_msg.id)]}, format="json"
+            )
+        self.assertEqual(res.data["updated"], 0)
+        notify.assert_not_called()
+
+
+class ClearHistoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="wm@example.com", password="x")
+        self.other = User.objects.create_user(email="wm2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat, _ = get_or_create_private_chat(self.user, self.other)
+        self.old = [Message.objects.create(room=self.chat, author=self.other, content=f"old{i}") for i in range(3)]
+
+    def test_clear_is_one_watermark(self):
+        res = self.client.post(f"/api/conversations/{self.chat.id}/clear/")
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(HiddenMessage.objects.filter(user=self.user).exists())
+
+        fresh = Message.objects.create(room=self.chat, author=self.other, content="new")
+        res = self.client.get(f"/api/conversations/{self.chat.id}/messages/")
+        self.assertEqual([m["id"] for m in res.data], [str(fresh.id)])
+
+        # у собеседника история на месте
+        self.client.force_authenticate(self.other)
+        res = self.client.get(f"/api/conversations/{self.chat.id}/messages/")
+        self.assertEqual(len(res.data), 4)
+
+    def test_preview_hidden_below_watermark(self):
+        Chat.objects.filter(pk=self.chat.pk).update(last_message=self.old[-1])
+        self.client.post(f"/api/conversations/{self.chat.id}/clear/")
+        res = self.client.get(f"/api/conversations/{self.chat.id}/")
+        self.assertIsNone(res.data["last_message_text"])
+
+    def test_migration_compacts_prefix_runs(self):
+        import importlib
+
+        mig = importlib.import_module("chat.migrations.0010_chatparticipant_cleared_before")
+        tail = Message.objects.create(room=self.chat, author=self.other, content="tail")
+        later = Message.objects.create(room=self.chat, author=self.other, content="later")
+        # непрерывный префикс old0..old2 + одиночное скрытие later после видимого tail
+        for m in self.old + [later]:
+            HiddenMessage.objects.create(user=self.user, message=m)
+
+        with connection.cursor() as cur:
+            cur.execute(mig.COMPACT_SQL)
+
+        link = ChatParticipant.objects.get(chat=self.chat, user=self.user)
+        self.assertEqual(link.cleared_before, self.old[-1].created_at)
+        self.assertEqual(
+            list(HiddenMessage.objects.filter(user=self.user).values_list("message_id", flat=True)),
+            [later.id],
+        )
+        res = self.client.get(f"/api/conversations/{self.chat.id}/messages/")
+        self.assertEqual([m["id"] for m in res.data], [str(tail.id)])
+
+    def test_group_clear_does_not_join_room(self):
+        room = Chat.objects.create(name="readers")
+        Message.objects.create(room=room, author=self.other, content="before")
+        res = self.client.post(f"/api/chats/{room.id}/clear-history/")
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(ChatParticipant.objects.filter(chat=room, user=self.user).exists())
+
+        after = Message.objects.create(room=room, author=self.other, content="after")
+        res = self.client.get(f"/api/messages/?room={room.id}")
+        self.assertEqual([m["id"] for m in res.data["results"]], [str(after.id)])
+
+    def test_hide_skips_foreign_private_chats(self):
+        stranger = get_user_model().objects.create_user(email="wm3@example.com", password="x")
+        foreign, _ = get_or_create_private_chat(self.other, stranger)
+        msg = Message.objects.create(room=foreign, author=stranger, content="dm")
+        res = self.client.post("/api/messages/bulk-hide/", {"ids": [str(msg.id), str(self.old[0].id)]}, format="json")
+        self.assertEqual(res.data["hidden"], 1)
+        self.assertFalse(HiddenMessage.objects.filter(message_id=msg.id).exists())
+
+
+class MessagePartitionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="part@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="history")
+
+    def _plan(self, sql: str) -> str:
+        with connection.cursor() as cur:
+            cur.execute("EXPLAIN " + sql)
+            return "\n".join(row[0] for row in cur.fetchall())
+
+    def test_cursor_page_prunes_future_partitions(self):
+        from django.utils import timezone
+        from . import partitions
+
+        Message.objects.bulk_create([Message(room=self.room, author=self.user, content=str(i)) for i in range(35)])
+        res = self.client.get(f"/api/messages/?room={self.room.id}")
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(res.data["next"])
+        self.assertEqual(len(res.data["results"]), 5)
+
+        sql = next(q["sql"] for q in ctx.captured_queries if 'FROM "chat_message"' in q["sql"])
+        plan = self._plan(sql)
+        future = partitions.partition_name(partitions.add_months(partitions.month_floor(timezone.now()), 2))
+        self.assertIn("chat_message_plegacy", plan)
+        self.assertNotIn(future, plan)
+
+    def test_ensure_and_detach(self):
+        from . import partitions
+
+        created = partitions.ensure_partitions(ahead=5)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(partitions.ensure_partitions(ahead=5), [])
+
+        partitions.detach_partition(created[-1], concurrently=False)
+        self.assertNotIn(created[-1], [p.name for p in partitions.list_partitions()])
+
+
+class MessageIdTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="ids@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="ids")
+
+    def test_uuid7_monotonic(self):
+        from .ids import is_uuid7, uuid7
+
+        ids = [uuid7() for _ in range(5000)]
+        self.assertTrue(all(is_uuid7(u) and u.variant == "specified in RFC 4122" for u in ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(Message.objects.create(room=self.room, content="x").id.version, 7)
+
+    def test_backfill_rewrites_ids_and_references(self):
+        import uuid
+        from io import StringIO
+
+        from django.core.management import call_command
+        from .ids import uuid7_datetime
+
+        old = [Message.objects.create(id=uuid.uuid4(), room=self.room, content=str(i)) for i in range(3)]
+        reply = Message.objects.create(id=uuid.uuid4(), room=self.room, content="re", reply_to=old[0])
+        HiddenMessage.objects.create(user=self.user, message=old[1])
+        MessageReaction.objects.create(user=self.user, message=old[2], emoji="👍")
+        Chat.objects.filter(pk=self.room.pk).update(last_message=reply)
+
+        from . import idempotency
+
+        idempotency.store(self.user.id, idempotency.room_scope(self.room.id), "k1", old[0].id)
+        call_command("backfill_message_ids", batch=2, settle=0, stdout=StringIO())
+
+        msgs = list(Message.objects.order_by("created_at"))
+        self.assertTrue(all(m.id.version == 7 for m in msgs))
+        self.assertEqual([m.content for m in msgs], ["0", "1", "2", "re"])
+        self.assertEqual(sorted(msgs, key=lambda m: m.id), msgs)
+        self.assertEqual(uuid7_datetime(msgs[0].id), msgs[0].created_at.replace(
+            microsecond=msgs[0].created_at.microsecond // 1000 * 1000))
+        self.assertEqual(msgs[3].reply_to_id, msgs[0].id)
+        self.assertEqual(HiddenMessage.objects.get(user=self.user).message_id, msgs[1].id)
+        self.assertEqual(MessageReaction.objects.get(user=self.user).message_id, msgs[2].id)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_id, msgs[3].id)
+        # ключ идемпотентности со старым id ведёт к перевыпущенному сообщению, а не к 409
+        res = self.client.post("/api/messages/", {"room": self.room.id, "content": "0"}, format="json",
+                               HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual((res.status_code, res.data["id"]), (201, str(msgs[0].id)))
+
+    def test_cursor_on_id(self):
+        from django.test import override_settings
+
+        Message.objects.bulk_create([Message(room=self.room, content=str(i)) for i in range(35)])
+        with override_settings(CHAT_MESSAGE_CURSOR_ON_ID=True):
+            first = self.client.get(f"/api/messages/?room={self.room.id}")
+            with CaptureQueriesContext(connection) as ctx:
+                second = self.client.get(first.data["next"])
+        got = [m["content"] for m in first.data["results"] + second.data["results"]]
+        self.assertEqual(got, [str(i) for i in reversed(range(35))])
+        sql = next(q["sql"] for q in ctx.captured_queries if 'FROM "chat_message"' in q["sql"])
+        self.assertIn('"chat_message"."id" <', sql)
+
+
+class MessageArchiveTests(APITestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from datetime import timedelta
+
+        from django.test import override_settings
+        from django.utils import timezone
+
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        self.settings_ctx = override_settings(CHAT_ARCHIVE_DIR=tmp)
+        self.settings_ctx.enable()
+        self.addCleanup(self.settings_ctx.disable)
+
+        User = get_user_model()
+        self.user = User.objects.create_user(email="arch@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="old-room")
+        base = timezone.now() - timedelta(days=800)
+        self.msgs = []
+        for i in range(50):
+            m = Message.objects.create(room=self.room, author=self.user, content=f"m{i}")
+            Message.objects.filter(pk=m.pk).update(created_at=base + timedelta(minutes=i))
+            self.msgs.append(m)
+        Chat.objects.filter(pk=self.room.pk).update(last_message=self.msgs[-1])
+        HiddenMessage.objects.create(user=self.user, message=self.msgs[10])
+
+    def _archive(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        call_command("archive_messages", stdout=StringIO())
+
+    def test_archive_moves_all_old_rows(self):
+        from . import archive
+
+        self._archive()
+        self.assertFalse(Message.objects.filter(room=self.room).exists())
+        self.assertTrue(archive.has_archive(self.room.id))
+        self.assertEqual(len(list(archive.iter_archived_desc(self.room.id))), 50)
+        # повторный запуск ничего не дублирует
+        self._archive()
+        self.assertEqual(len(list(archive.iter_archived_desc(self.room.id))), 50)
+
+    def test_stale_last_message_does_not_hide_newer_archive(self):
+        # last_message старше части архивируемых строк (ЛС через POST /api/messages/ его не обновляют)
+        Chat.objects.filter(pk=self.room.pk).update(last_message=self.msgs[5])
+        self._archive()
+        url, seen = f"/api/messages/?room={self.room.id}", []
+        while url:
+            res = self.client.get(url)
+            seen += [m["content"] for m in res.data["results"]]
+            url = res.data["next"]
+        self.assertEqual(seen, [f"m{i}" for i in reversed(range(50)) if i != 10])
+
+    def test_private_rooms_are_not_archived(self):
+        from . import archive
+
+        other = get_user_model().objects.create_user(email="arch3@example.com", password="x")
+        chat, _ = get_or_create_private_chat(self.user, other)
+        Message.objects.filter(room=self.room).update(room=chat)
+        self._archive()
+        self.assertFalse(archive.has_archive(chat.id))
+        res = self.client.get(f"/api/conversations/{chat.id}/messages/")
+        self.assertEqual(len(res.data), 49)
+
+    def test_recovery_keeps_unarchived_rows_of_a_timestamp_tie(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from . import archive
+
+        # все строки на одной метке; «сбой» после записи первых 20 в сегмент, до удаления из БД
+        Message.objects.filter(room=self.room).update(created_at=timezone.now() - timedelta(days=800))
+        tie = Message.objects.filter(room=self.room).order_by("created_at", "id")
+        rows = [
+            {**row, "id": str(row["id"]), "reply_to_id": None}
+            for row in tie.values(*archive.ARCHIVE_FIELDS)[:20]
+        ]
+        archive.SegmentWriter(self.room.id).append(rows)
+
+        self.assertEqual(archive.archive_room(self.room.id, timezone.now() - timedelta(days=365)), 30)
+        self.assertFalse(Message.objects.filter(room=self.room).exists())
+        ids = [r["id"] for r in archive.iter_archived_desc(self.room.id)]
+        self.assertEqual(sorted(ids), sorted(str(m.id) for m in self.msgs))
+
+    def test_concurrent_run_skips_locked_room(self):
+        from datetime import timedelta
+
+        from django.db import connections
+        from django.utils import timezone
+
+        from . import archive
+
+        other = connections.create_connection("default")
+        self.addCleanup(other.close)
+        with other.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s, %s)", [archive.ARCHIVE_LOCK, self.room.id])
+        with self.assertRaises(archive.RoomBusy):
+            archive.archive_room(self.room.id, timezone.now() - timedelta(days=365))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 50)
+
+    def test_conversation_preview_from_archive(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from . import archive
+
+        other = get_user_model().objects.create_user(email="arch2@example.com", password="x")
+        chat, _ = get_or_create_private_chat(self.user, other)
+        old = Message.objects.create(room=chat, author=other, content="long ago")
+        Message.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=800))
+        Chat.objects.filter(pk=chat.pk).update(last_message=old)
+        archive.archive_room(chat.id, timezone.now() - timedelta(days=365))
+        self.assertFalse(Message.objects.filter(pk=old.pk).exists())
+
+        convs = self.client.get("/api/conversations/").data
+        self.assertEqual([c["last_message_text"] for c in convs], ["long ago"])
+
+    def test_feed_pages_from_hot_into_archive(self):
+        self._archive()
+        url = f"/api/messages/?room={self.room.id}"
+        seen = []
+        pages = 0
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            seen += [m["content"] for m in res.data["results"]]
+            url = res.data["next"]
+            pages += 1
+        expected = [f"m{i}" for i in reversed(range(50)) if i != 10]
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)  # пустая горячая + 30 + 19 из архива
+        self.assertEqual(res.data["previous"], None)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        from django.test import override_settings
+
+        cache.clear()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        ctx = override_settings(MEDIA_ROOT=tmp, CHAT_EXPORT_CHUNK_SIZE=3)
+        ctx.enable()
+        self.addCleanup(ctx.disable)
+
+        User = get_user_model()
+        self.user = User.objects.create_user(email="exp@example.com", password="x")
+        self.other = User.objects.create_user(email="exp2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat, _ = get_or_create_private_chat(self.user, self.other)
+        self.msgs = [Message.objects.create(room=self.chat, author=self.other, content=f"m{i}") for i in range(7)]
+        HiddenMessage.objects.create(user=self.user, message=self.msgs[3])
+
+    def _body(self, res) -> bytes:
+        self.assertTrue(res.streaming)
+        return b"".join(res.streaming_content)
+
+    def test_ndjson_streams_visible_history_in_order(self):
+        import json
+
+        res = self.client.get(f"/api/conversations/{self.chat.id}/export/")
+        self.assertEqual(res["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in self._body(res).splitlines()]
+        self.assertEqual([r["content"] for r in rows], ["m0", "m1", "m2", "m4", "m5", "m6"])
+
+    def test_zip_contains_messages_and_attachments(self):
+        import io
+        import json
+        import zipfile
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        Message.objects.create(
+            room=self.chat, author=self.user, attachment=SimpleUploadedFile("a.txt", b"hello"),
+            attachment_name="a.txt", attachment_type="file",
+        )
+        res = self.client.get(f"/api/conversations/{self.chat.id}/export/?as=zip")
+        zf = zipfile.ZipFile(io.BytesIO(self._body(res)))
+        rows = [json.loads(line) for line in zf.read("messages.ndjson").splitlines()]
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(zf.read(rows[-1]["attachment"]), b"hello")
+
+    def test_group_room_export_requires_access(self):
+        room = Chat.objects.create(name="pub")
+        Message.objects.create(room=room, author=self.other, content="hi")
+        res = self.client.get(f"/api/chats/{room.id}/export/")
+        self.assertEqual(self._body(res).count(b"\n"), 1)
+        self.assertEqual(self.client.get(f"/api/chats/{room.id}/export/?as=tar").status_code, 400)
+
+    def test_asgi_streams_chunk_by_chunk(self):
+        from unittest import mock
+
+        from django.test import AsyncClient
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        from . import export
+
+        client = AsyncClient()
+        headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+        url = f"/api/conversations/{self.chat.id}/export/"
+        produced = []
+
+        def two_chunks(room, user, request):
+            for part in (b"first\n", b"second\n"):
+                produced.append(part)
+                yield part
+
+        async def fetch():
+            res = await client.get(url, headers=headers)
+            self.assertTrue(res.is_async)
+            seen = []
+            async for chunk in res.streaming_content:
+                seen.append((chunk, len(produced)))
+            return seen
+
+        # первый кусок уходит до того, как сгенерирован второй — ответ не собирается целиком
+        with mock.patch.object(export, "stream_ndjson", two_chunks):
+            self.assertEqual(async_to_sync(fetch)(), [(b"first\n", 1), (b"second\n", 2)])
+
+        async def body():
+            res = await client.get(url, headers=headers)
+            return b"".join([chunk async for chunk in res.streaming_content])
+
+        self.assertEqual(async_to_sync(body)().count(b"\n"), 6)
+
+
+class FrameTests(APITransactionTestCase):
+    # консьюмер ходит в БД через database_sync_to_async, который закрывает соединение теста
+    def setUp(self):
+        from django.urls import re_path
+        from channels.routing import URLRouter
+
+        from .consumers import ChatConsumer
+
+        self.room = Chat.objects.create(name="fanout")
+        self.app = URLRouter([re_path(r"^ws/chat/(?P<room_id>\d+)/$", ChatConsumer.as_asgi())])
+
+    def _exchange(self, subprotocols, event, during=None):
+        import contextlib
+
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from channels.testing import WebsocketCommunicator
+
+        async def run():
+            comm = WebsocketCommunicator(self.app, f"/ws/chat/{self.room.id}/", subprotocols=subprotocols)
+            connected, proto = await comm.connect()
+            self.assertTrue(connected)
+            await comm.receive_output()  # presence join
+            with during or contextlib.nullcontext():
+                await get_channel_layer().group_send(f"chat_{self.room.id}", event)
+                out = await comm.receive_output()
+            await comm.disconnect()
+            return proto, out
+
+        return async_to_sync(run)()
+
+    def test_event_serialized_once_and_written_verbatim(self):
+        from unittest import mock
+
+        from . import frames
+
+        event = frames.make_event("chat_message", {"id": "m1", "room": self.room.id, "content": "hi"})
+        no_encode = mock.patch("json.dumps", side_effect=AssertionError("re-encoded"))
+        proto, out = self._exchange([], event, during=no_encode)
+        self.assertIsNone(proto)
+        self.assertEqual(out["text"], event["text"])
+
+    def test_msgpack_subprotocol(self):
+        from . import frames
+
+        if not frames.msgpack_enabled():
+            self.skipTest("msgpack не установлен")
+
+        event = frames.make_event("chat_delete", {"type": "message:delete", "payload": {"id": "m1"}})
+        proto, out = self._exchange([frames.SUBPROTOCOL_MSGPACK, frames.SUBPROTOCOL_JSON], event)
+        self.assertEqual(proto, frames.SUBPROTOCOL_MSGPACK)
+        self.assertEqual(frames.decode_msgpack(out["bytes"]), {"type": "message:delete", "payload": {"id": "m1"}})
+
+    def test_legacy_event_still_delivered(self):
+        proto, out = self._exchange(["humy.json"], {"type": "chat_delete", "id": "m1"})
+        self.assertEqual(proto, "humy.json")
+        self.assertEqual(json.loads(out["text"]), {"type": "message:delete", "payload": {"id": "m1"}})
+
+    def test_conversation_create_serializes_once(self):
+        from unittest import mock
+
+        User = get_user_model()
+        a = User.objects.create_user(email="fa@example.com", password="x")
+        b = User.objects.create_user(email="fb@example.com", password="x")
+        chat, _ = get_or_create_private_chat(a, b)
+        client = APIClient()
+        client.force_authenticate(a)
+        with mock.patch("chat.views.MessageSerializer.to_representation", autospec=True,
+                        side_effect=lambda self, inst: {"id": str(inst.id), "content": inst.content}) as rep, \
+                mock.patch("chat.views.get_channel_layer") as gcl:
+            sent = []
+
+            async def group_send(group, event):
+                sent.append(event)
+            gcl.return_value.group_send = group_send
+            res = client.post(f"/api/conversations/{chat.id}/messages/", {"content": "hey"}, format="json")
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(rep.call_count, 1)
+        broadcast = json.loads(sent[0]["text"])
+        self.assertIsNotNone(broadcast.pop("event_id"))
+        self.assertEqual(broadcast, res.data)
+
+
+class FrameProfileTests(APITestCase):
+    def setUp(self):
+        from . import frames
+
+        frames.flush_stats()  # накопленное другими тестами консьюмеров
+        cache.clear()
+
+    def test_low_profile_variant_encoded_once(self):
+        from . import frames
+
+        frame = {
+            "id": "m1", "content": "x" * 300, "reply_to": None, "attachment": "a/b.png",
+            "author": {"id": 1, "nickname": "n", "avatar": "http://h/a.png"},
+            "payload": {"preview": "p" * 100},
+        }
+        event = frames.make_event("chat_message", frame)
+        low = json.loads(event["low_text"])
+        self.assertEqual(low["author"], {"id": 1, "nickname": "n"})
+        self.assertNotIn("reply_to", low)
+        self.assertNotIn("attachment", low)
+        self.assertEqual(len(low["content"]), 300)  # текст сообщения не режем, только превью
+        self.assertEqual(len(low["payload"]["preview"]), 40)
+        self.assertEqual(frames.pick_frame(event, binary=False, profile="low")[0], event["low_text"])
+        self.assertEqual(frames.pick_frame(event, binary=False, profile="full")[0], event["text"])
+        # если урезать нечего — второго кадра нет
+        self.assertNotIn("low_text", frames.make_event("chat_delete", {"type": "message:delete", "payload": {"id": "1"}}))
+
+    def test_profile_from_user_settings(self):
+        from users.models import UserSettings
+
+        from . import frames
+
+        user = get_user_model().objects.create_user(email="low@example.com", password="x")
+        self.assertEqual(frames.profile_for_user(user.id), frames.PROFILE_FULL)
+        UserSettings.objects.filter(user=user).update(data_usage=UserSettings.DATA_USAGE_LOW)
+        self.assertEqual(frames.profile_for_user(user.id), frames.PROFILE_LOW)
+        self.assertEqual(frames.profile_for_user(None), frames.PROFILE_FULL)
+
+    def test_stats_accumulate_in_cache(self):
+        from . import frames
+
+        frames.record("chat:chat_message", 100)
+        frames.record("chat:chat_message", 50)
+        frames.record("chat:chat_message", 20, frames.PROFILE_LOW)
+        frames.flush_stats()
+        frames.record("chat:chat_message", 10)
+        frames.flush_stats()
+        rows = {(r["kind"], r["profile"]): r for r in frames.read_stats()}
+        self.assertEqual(rows[("chat:chat_message", "full")]["frames"], 3)
+        self.assertEqual(rows[("chat:chat_message", "full")]["bytes"], 160)
+        self.assertEqual(rows[("chat:chat_message", "low")]["bytes"], 20)
+        frames.reset_stats()
+        self.assertEqual(frames.read_stats(), [])
+
+    def test_deflate_accept_respects_client_window(self):
+        from autobahn.websocket.compress import PerMessageDeflateOffer
+
+        from config.ws_compression import make_accept
+
+        accept = make_accept(11, 4, False)
+        self.assertIsNone(accept([]))
+        res = accept([PerMessageDeflateOffer(request_max_window_bits=9)])
+        self.assertEqual(res.window_bits, 9)
+        self.assertEqual(accept([PerMessageDeflateOffer()]).window_bits, 11)
+
+    def test_deflate_accept_honours_server_no_context_takeover_request(self):
+        from autobahn.websocket.compress import PerMessageDeflateOffer
+
+        from config.ws_compression import make_accept
+
+        res = make_accept(11, 4, False)([PerMessageDeflateOffer(request_no_context_takeover=True)])
+        self.assertTrue(res.no_context_takeover)
+        self.assertIn("server_no_context_takeover", res.get_extension_string())
+        self.assertFalse(make_accept(11, 4, False)([PerMessageDeflateOffer()]).no_context_takeover)
+
+
+class GatewayTests(APITransactionTestCase):
+    def setUp(self):
+        from django.urls import path
+        from channels.routing import URLRouter
+
+        from .gateway import GatewayConsumer
+
+        User = get_user_model()
+        self.user = User.objects.create_user(email="gw@example.com", password="x")
+        self.other = User.objects.create_user(email="gw2@example.com", password="x")
+        self.public = Chat.objects.create(name="gw-public")
+        third = User.objects.create_user(email="gw3@example.com", password="x")
+        self.foreign, _ = get_or_create_private_chat(self.other, third)
+        inner = URLRouter([path("ws/gateway/", GatewayConsumer.as_asgi())])
+        user = self.user
+
+        async def app(scope, receive, send):
+            return await inner({**scope, "user": user}, receive, send)
+        self.app = app
+
+    def test_rooms_and_notifications_share_one_socket(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from channels.testing import WebsocketCommunicator
+
+        from . import frames
+
+        public_id, foreign_id, user_id = self.public.id, self.foreign.id, self.user.id
+
+        async def run():
+            layer = get_channel_layer()
+            comm = WebsocketCommunicator(self.app, "/ws/gateway/")
+            connected, _ = await comm.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await comm.receive_json_from())["kind"], "meta:init")
+
+            await comm.send_json_to({"type": "subscribe", "rooms": [public_id, foreign_id]})
+            got = [await comm.receive_json_from() for _ in range(3)]
+            self.assertIn({"kind": "subscribed", "room": public_id}, got)
+            self.assertIn({"kind": "error", "room": foreign_id, "code": 4403}, got)
+            presence = next(g for g in got if g.get("kind") == "room")
+            self.assertEqual((presence["room"], presence["data"]["event"]), (public_id, "join"))
+
+            event = frames.make_event("chat_message", {"id": "m1", "content": "hi"}, room=public_id)
+            await layer.group_send(f"chat_{public_id}", event)
+            self.assertEqual(await comm.receive_json_from(),
+                             {"kind": "room", "room": public_id, "data": {"id": "m1", "content": "hi"}})
+
+            await layer.group_send(f"user_{user_id}", {"type": "dm_badge", "preview": "yo"})
+            note = await comm.receive_json_from()
+            self.assertEqual((note["kind"], note["type"], note["payload"]), ("notification", "dm.badge", {"preview": "yo"}))
+
+            await comm.send_json_to({"type": "unsubscribe", "room": public_id})
+            self.assertEqual(await comm.receive_json_from(), {"kind": "unsubscribed", "room": public_id})
+            await layer.group_send(f"chat_{public_id}", event)
+            self.assertTrue(await comm.receive_nothing(timeout=0.2))
+            await comm.disconnect()
+
+        async_to_sync(run)()
+
+    def test_msgpack_envelope_wraps_frame_without_reencoding(self):
+        from . import frames
+
+        if not frames.msgpack_enabled():
+            self.skipTest("msgpack не установлен")
+        raw = frames.make_event("chat_message", {"id": "m1"}, room=7)["bytes"]
+        self.assertEqual(frames.decode_msgpack(frames.wrap_room_bytes(7, raw)),
+                         {"kind": "room", "room": 7, "data": {"id": "m1"}})
+        self.assertEqual(json.loads(frames.wrap_room_text(7, '{"id":"m1"}')),
+                         {"kind": "room", "room": 7, "data": {"id": "m1"}})
+
+
+class ReplayTests(APITransactionTestCase):
+    def setUp(self):
+        from django.urls import re_path
+        from channels.routing import URLRouter
+
+        from .consumers import ChatConsumer
+
+        cache.clear()
+        self.room = Chat.objects.create(name="replay")
+        self.app = URLRouter([re_path(r"^ws/chat/(?P<room_id>\d+)/$", ChatConsumer.as_asgi())])
+
+    def test_events_since_gap_and_limits(self):
+        from django.test import override_settings
+
+        from . import replay
+
+        ids = [replay.make_room_event("chat_message", {"id": f"m{i}"}, self.room.id)["event_id"] for i in range(5)]
+        self.assertEqual(ids, list(range(ids[0], ids[0] + 5)))
+        with override_settings(CHAT_REPLAY_OVERLAP=0):
+            got = replay.events_since(self.room.id, ids[1])
+            self.assertEqual([json.loads(e["text"])["id"] for e in got], ["m2", "m3", "m4"])
+            self.assertEqual(replay.events_since(self.room.id, ids[-1]), [])
+        with override_settings(CHAT_REPLAY_OVERLAP=2):
+            got = replay.events_since(self.room.id, ids[2])
+            self.assertEqual([json.loads(e["text"])["id"] for e in got], ["m1", "m2", "m3", "m4"])
+        self.assertIsNone(replay.events_since(self.room.id, ids[-1] + 10))  # счётчик сброшен
+        with override_settings(CHAT_REPLAY_SIZE=2):
+            self.assertIsNone(replay.events_since(self.room.id, ids[0]))  # слишком отстал
+        cache.delete(replay.LOG_KEY.format(self.room.id, ids[1]))
+        self.assertEqual(len(replay.events_since(self.room.id, ids[2])), 4)  # дыра в запасе — не ошибка
+        cache.delete(replay.LOG_KEY.format(self.room.id, ids[3]))
+        self.assertIsNone(replay.events_since(self.room.id, ids[2]))  # дыра после last_event_id
+
+    def test_resume_returns_event_broadcast_out_of_order(self):
+        from . import replay
+
+        # N выдан, но записан и разослан позже N+1: клиент видел только N+1
+        late = replay.next_event_id(self.room.id)
+        seen = replay.make_room_event("chat_message", {"id": "m1"}, self.room.id)["event_id"]
+        self.assertEqual(seen, late + 1)
+        got = replay.events_since(self.room.id, seen)
+        self.assertEqual([e["event_id"] for e in got], [seen])  # N ещё не разослан — придёт по подписке
+        cache.set(replay.LOG_KEY.format(self.room.id, late),
+                  replay._room_event("chat_message", {"id": "m0"}, self.room.id, late), 60)
+        got = replay.events_since(self.room.id, seen)
+        self.assertEqual([e["event_id"] for e in got], [late, seen])
+
+    def test_resume_frame_replays_missed_events(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+
+        from . import replay
+
+        room_id = self.room.id
+        first = replay.make_room_event("chat_message", {"id": "m0"}, room_id)["event_id"]
+        for i in (1, 2):
+            replay.make_room_event("chat_delete", {"type": "message:delete", "payload": {"id": f"m{i}"}}, room_id)
+
+        async def run():
+            comm = WebsocketCommunicator(self.app, f"/ws/chat/{room_id}/")
+            await comm.connect()
+            await comm.receive_json_from()  # presence join
+            await comm.send_json_to({"type": "resume", "last_event_id": first})
+            got = [await comm.receive_json_from() for _ in range(4)]
+            await comm.send_json_to({"type": "resume", "last_event_id": 1})
+            reset = await comm.receive_json_from()
+            await comm.disconnect()
+            return got, reset
+
+        got, reset = async_to_sync(run)()
+        # m0 — запас перед last_event_id, клиент отбросит его по event_id
+        self.assertEqual([g["event_id"] for g in got[:3]], [first, first + 1, first + 2])
+        self.assertEqual([g["payload"]["id"] for g in got[1:3]], ["m1", "m2"])
+        self.assertEqual(got[3], {"type": "resume:ok", "room": room_id, "replayed": 3})
+        self.assertEqual(reset, {"type": "resume:reset", "room": room_id})
+
+
+class IdempotencyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="idem@example.com", password="x")
+        self.other = User.objects.create_user(email="idem2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat, _ = get_or_create_private_chat(self.user, self.other)
+
+    def test_conversation_retry_returns_original(self):
+        from unittest import mock
+
+        url = f"/api/conversations/{self.chat.id}/messages/"
+        with mock.patch("chat.views.get_channel_layer") as gcl, \
+                mock.patch("chat.views.inc_unread_for_others") as inc:
+            sent = []
+
+            async def group_send(group, event):
+                sent.append(event)
+            gcl.return_value.group_send = group_send
+            with self.captureOnCommitCallbacks(execute=True):
+                first = self.client.post(url, {"content": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k-1")
+            again = self.client.post(url, {"content": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k-1")
+            with self.captureOnCommitCallbacks(execute=True):
+                other = self.client.post(url, {"content": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k-2")
+
+        self.assertEqual((first.status_code, again.status_code), (201, 201))
+        self.assertEqual(again.data["id"], first.data["id"])
+        self.assertEqual(again["Idempotent-Replayed"], "true")
+        self.assertNotEqual(other.data["id"], first.data["id"])
+        self.assertEqual(Message.objects.filter(room=self.chat).count(), 2)
+        self.assertEqual((inc.call_count, len(sent)), (2, 2))
+
+    def test_pending_key_conflicts_and_failed_create_releases(self):
+        from . import idempotency
+
+        room = Chat.objects.create(name="idem")
+        self.assertIsNone(idempotency.claim(self.user.id, idempotency.room_scope(room.id), "busy"))
+        res = self.client.post("/api/messages/", {"room": room.id, "content": "x"}, format="json",
+                               HTTP_IDEMPOTENCY_KEY="busy")
+        self.assertEqual(res.status_code, 409)
+
+        bad = self.client.post("/api/messages/", {"room": 10**9, "content": "x"}, format="json",
+                               HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(bad.status_code, 400)
+        ok = self.client.post("/api/messages/", {"room": room.id, "content": "x"}, format="json",
+                              HTTP_IDEMPOTENCY_KEY="k")
+        self.assertEqual(ok.status_code, 201)
+
+    def test_ws_retry_does_not_insert_twice(self):
+        from .consumers import create_message
+
+        room = Chat.objects.create(name="idem-ws")
+        create = async_to_sync(create_message)
+        first, created = create(room.id, self.user.id, "hi", "tmp-1")
+        again, created_again = create(room.id, self.user.id, "hi", "tmp-1")
+        self.assertEqual((created, created_again), (True, False))
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(Message.objects.filter(room=room).count(), 1)
+
+        # тот же temp_id в другой комнате — другая отправка
+        elsewhere = Chat.objects.create(name="idem-ws-2")
+        second, created_second = create(elsewhere.id, self.user.id, "hi", "tmp-1")
+        self.assertTrue(created_second)
+        self.assertEqual(second.room_id, elsewhere.id)
+
+
+class WsIdempotencyTests(APITransactionTestCase):
+    def setUp(self):
+        from django.urls import re_path
+        from channels.routing import URLRouter
+
+        from .consumers import ChatConsumer
+
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email="idem-ws@example.com", password="x")
+        self.room = Chat.objects.create(name="idem-ws-frames")
+        inner = URLRouter([re_path(r"^ws/chat/(?P<room_id>\d+)/$", ChatConsumer.as_asgi())])
+        user = self.user
+
+        async def app(scope, receive, send):
+            return await inner({**scope, "user": user}, receive, send)
+        self.app = app
+
+    def test_pending_and_deleted_retries_get_a_reply(self):
+        import uuid
+
+        from channels.testing import WebsocketCommunicator
+
+        from . import idempotency
+
+        room_id, scope = self.room.id, idempotency.room_scope(self.room.id)
+        self.assertIsNone(idempotency.claim(self.user.id, scope, "tmp-1"))  # первая отправка ещё идёт
+
+        async def send(temp_id):
+            comm = WebsocketCommunicator(self.app, f"/ws/chat/{room_id}/")
+            await comm.connect()
+            await comm.receive_json_from()  # presence join
+            await comm.send_json_to({"type": "message", "content": "hi", "temp_id": temp_id})
+            reply = await comm.receive_json_from()
+            await comm.disconnect()
+            return reply
+
+        self.assertEqual(async_to_sync(send)("tmp-1"), {
+            "type": "message:pending", "room": room_id, "reason": "in_progress", "retry_after": 1, "temp_id": "tmp-1",
+        })
+        idempotency.complete(self.user.id, scope, "tmp-1", uuid.uuid4())  # сообщение с тех пор удалено
+        self.assertEqual(async_to_sync(send)("tmp-1"),
+                         {"type": "message:pending", "room": room_id, "reason": "deleted", "temp_id": "tmp-1"})
+        self.assertFalse(Message.objects.filter(room=self.room).exists())
+
+
+class ConsumerDbHelperTests(APITestCase):
+    def test_room_access_is_one_query(self):
+        from .consumers import user_can_join_room
+
+        User = get_user_model()
+        member = User.objects.create_user(email="acc1@example.com", password="x")
+        stranger = User.objects.create_user(email="acc2@example.com", password="x")
+        private = Chat.objects.create(name="acc-private", type=ChatType.PRIVATE)
+        ChatParticipant.objects.create(chat=private, user=member)
+        public = Chat.objects.create(name="acc-public")
+
+        can_join = async_to_sync(user_can_join_room)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(can_join(private.id, member))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertFalse(can_join(private.id, stranger))
+        self.assertFalse(can_join(private.id, None))
+        self.assertTrue(can_join(public.id, None))
+        self.assertFalse(can_join(10**9, member))
+
+
+class AsyncListViewTests(APITestCase):
+    """Async-списки (chat/async_views.py) отдают то же, что DRF-представления."""
+
+    def setUp(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="alist@example.com", password="x")
+        self.other = User.objects.create_user(email="alist2@example.com", password="x")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def _both(self, url):
+        fast = self.client.get(url)
+        with override_settings(ASYNC_LIST_VIEWS=False):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertEqual(fast.json(), slow.json())
+        return fast
+
+    def test_message_feed_matches_drf(self):
+        room = Chat.objects.create(name="alist")
+        msgs = Message.objects.bulk_create([Message(room=room, content=str(i)) for i in range(33)])
+        HiddenMessage.objects.create(user=self.user, message=msgs[-1])
+
+        first = self._both(f"/api/messages/?room={room.id}")
+        self.assertEqual(first.json()["results"][0]["content"], "31")
+        second = self._both(first.json()["next"])
+        self.assertEqual(len(second.json()["results"]), 2)
+        self._both(second.json()["previous"])
+
+        again = self.client.get(f"/api/messages/?room={room.id}", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+    def test_conversations_match_drf_and_bad_token_falls_back(self):
+        chat, _ = get_or_create_private_chat(self.user, self.other)
+        Message.objects.create(room=chat, author=self.other, content="hi")
+        res = self._both("/api/conversations/")
+        self.assertEqual(res.json()[0]["other_user"]["id"], self.other.id)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer broken")
+        self.assertEqual(self.client.get("/api/conversations/").status_code, 401)
+
+
+class ReactionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="react@example.com", password="x")
+        self.other = User.objects.create_user(email="react2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Chat.objects.create(name="reactions")
+        self.msg = Message.objects.create(room=self.room, author=self.user, content="hello")
+        self.sent = []
+
+    def _patch_layer(self):
+        from unittest import mock
+
+        patcher = mock.patch("chat.views.get_channel_layer")
+        gcl = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        async def group_send(group, event):
+            self.sent.append(json.loads(event["text"]))
+        gcl.return_value.group_send = group_send
+
+    def test_edit_is_author_only_and_broadcasts_delta(self):
+        self._patch_layer()
+        url = f"/api/messages/{self.msg.id}/"
+        res = self.client.patch(url, {"content": "hello, world"}, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.msg.refresh_from_db()
+        self.assertEqual(self.msg.content, "hello, world")
+        self.assertIsNotNone(self.msg.edited_at)
+
+        frame = self.sent[-1]
+        self.assertEqual(frame["type"], "message:edit")
+        self.assertEqual(set(frame["payload"]), {"id", "content", "edited_at"})
+        self.assertIn("event_id", frame)
+
+        stranger = APIClient()
+        stranger.force_authenticate(self.other)
+        self.assertEqual(stranger.patch(url, {"content": "hijack"}, format="json").status_code, 403)
+        self.assertEqual(self.client.patch(url, {"content": "  "}, format="json").status_code, 400)
+        self.assertEqual(len(self.sent), 1)
+
+    @override_settings(CHAT_REACTION_FLUSH_SEC=0)
+    def test_reaction_toggle_sends_deltas_and_flushes_counts(self):
+        self._patch_layer()
+        url = f"/api/messages/{self.msg.id}/reactions/"
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.client.post(url, {"emoji": "👍"}, format="json")
+        again = self.client.post(url, {"emoji": "👍"}, format="json")
+        self.assertEqual((first.status_code, again.status_code), (201, 200))
+        self.assertEqual(first.data["counts"], {"👍": 1})
+        self.assertFalse(again.data["changed"])
+
+        self.msg.refresh_from_db()
+        self.assertEqual(self.msg.meta["reactions"], {"👍": 1})
+        self.assertEqual([f["payload"]["delta"] for f in self.sent], [1])
+
+        mine = self.client.get(url)
+        self.assertEqual((mine.data["counts"], mine.data["mine"]), ({"👍": 1}, ["👍"]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            gone = self.client.delete(f"{url}?emoji=👍")
+        self.assertTrue(gone.data["changed"])
+        self.assertEqual([f["payload"]["delta"] for f in self.sent], [1, -1])
+        self.msg.refresh_from_db()
+        self.assertNotIn("reactions", self.msg.meta)
+
+    def test_private_room_reactions_need_membership(self):
+        chat, _ = get_or_create_private_chat(self.other, get_user_model().objects.create_user(email="r3@example.com"))
+        msg = Message.objects.create(room=chat, author=self.other, content="secret")
+        url = f"/api/messages/{msg.id}/reactions/"
+        self.assertEqual(self.client.post(url, {"emoji": "🔥"}, format="json").status_code, 404)
+        self.assertEqual(APIClient().get(url).status_code, 404)
+
+    def test_rebuild_recounts_from_rows(self):
+        from . import reactions
+        from .models import MessageReaction
+
+        MessageReaction.objects.create(message=self.msg, user=self.user, emoji="❤")
+        MessageReaction.objects.create(message=self.msg, user=self.other, emoji="❤")
+        stale = Message.objects.create(room=self.room, author=self.user, content="x", meta={"reactions": {"😀": 3}})
+
+        self.assertEqual(reactions.rebuild(room_id=self.room.id), 2)
+        self.msg.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual(self.msg.meta["reactions"], {"❤": 2})
+        self.assertNotIn("reactions", stale.meta)
+
+    @override_settings(CHAT_REACTION_FLUSH_SEC=60)
+    def test_flush_command_drains_shared_dirty_journal(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from . import reactions
+        from .models import MessageReaction
+
+        # реакция в «другом процессе»: строка записана, сброс ещё рано — сообщение только в журнале
+        cache.add(reactions.GATE_KEY, 1, 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(reactions.add_reaction(self.msg, self.other, "🎉"))
+        reactions._timer.cancel()
+        reactions._timer = None
+        self.msg.refresh_from_db()
+        self.assertNotIn("reactions", self.msg.meta)
+
+        out = StringIO()
+        call_command("flush_reactions", stdout=out)
+        self.assertIn("messages updated: 1", out.getvalue())
+        self.msg.refresh_from_db()
+        self.assertEqual(self.msg.meta["reactions"], {"🎉": 1})
+        self.assertEqual(MessageReaction.objects.count(), 1)
+        self.assertEqual(reactions.flush_counts(), 0)
+
+
+class SendRateLimitTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(email="rl@example.com", password="x")
+        self.other = User.objects.create_user(email="rl2@example.com", password="x")
+        self.room = Chat.objects.create(name="rl")
+
+    @override_settings(CHAT_SEND_RATE_USER=0.01, CHAT_SEND_BURST_USER=2,
+                       CHAT_SEND_RATE_ROOM=0.01, CHAT_SEND_BURST_ROOM=3)
+    def test_user_bucket_denies_without_spending_room_tokens(self):
+        from . import ratelimit
+
+        waits = [ratelimit.check_send(self.user.id, self.room.id) for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertTrue(all(w > 0 for w in waits[2:]))
+        # спамер не съел остаток комнаты: другой пользователь ещё проходит
+        self.assertEqual(ratelimit.check_send(self.other.id, self.room.id), 0.0)
+        self.assertGreater(ratelimit.check_send(self.other.id, self.room.id), 0)
+
+    @override_settings(CHAT_SEND_RATE_USER=0.01, CHAT_SEND_BURST_USER=1)
+    def test_rest_send_returns_429_with_retry_after(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = "/api/messages/"
+        self.assertEqual(client.post(url, {"room": self.room.id, "content": "a"}, format="json").status_code, 201)
+        res = client.post(url, {"room": self.room.id, "content": "b"}, format="json")
+        self.assertEqual(res.status_code, 429)
+        self.assertIn("Retry-After", res)
+        # остальные действия не троттлятся
+        self.assertEqual(client.get(url, {"room": self.room.id}).status_code, 200)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+    @override_settings(CHAT_SEND_RATE_USER=0.01, CHAT_SEND_BURST_USER=1)
+    def test_retry_of_sent_message_is_not_rate_limited(self):
+        from . import ratelimit
+        from .consumers import create_message
+
+        create = async_to_sync(create_message)
+        first, _ = create(self.room.id, self.user.id, "hi", "tmp-1", limit=True)
+        again, created = create(self.room.id, self.user.id, "hi", "tmp-1", limit=True)
+        self.assertEqual((again.pk, created), (first.pk, False))
+        with self.assertRaises(ratelimit.RateLimited):
+            create(self.room.id, self.user.id, "new", "tmp-2", limit=True)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        res = client.post("/api/messages/", {"room": self.room.id, "content": "x"}, format="json",
+                          HTTP_IDEMPOTENCY_KEY="tmp-1")
+        self.assertEqual((res.status_code, res.data["id"]), (201, str(first.pk)))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+
+class DatabaseConfigTests(APITestCase):
+    BASE = {"DB_NAME": "humy", "DB_USER": "u", "DB_PASSWORD": "p", "DB_HOST": "db", "DB_PORT": "5432"}
+
+    def _config(self, **extra):
+        import environ
+        from unittest import mock
+
+        from config import db
+
+        with mock.patch.dict("os.environ", {**self.BASE, **extra}):
+            return db.database_config(environ.Env())
+
+    def test_modes(self):
+        from unittest import mock
+
+        from django.core.exceptions import ImproperlyConfigured
+
+        self.assertEqual(self._config()["CONN_MAX_AGE"], 60)
+        self.assertNotIn("CONN_MAX_AGE", self._config(DB_POOL_MODE="off"))
+        persistent = self._config(DB_POOL_MODE="persistent", DB_CONN_MAX_AGE="120")
+        self.assertEqual((persistent["CONN_MAX_AGE"], persistent["CONN_HEALTH_CHECKS"]), (120, True))
+        bouncer = self._config(DB_POOL_MODE="pgbouncer")
+        self.assertTrue(bouncer["DISABLE_SERVER_SIDE_CURSORS"])
+
+        with self.assertRaises(ImproperlyConfigured):
+            self._config(DB_POOL_MODE="bogus")
+        with mock.patch("config.db._has_psycopg3", return_value=False), self.assertRaises(ImproperlyConfigured):
+            self._config(DB_POOL_MODE="pool")
+
+    def test_replica_hosts(self):
+        import environ
+        from unittest import mock
+
+        from config import db
+
+        with mock.patch.dict("os.environ", {**self.BASE, "DB_REPLICA_HOSTS": "r1:6432,r2"}):
+            env = environ.Env()
+            replicas = db.replica_configs(env, db.database_config(env))
+        self.assertEqual(sorted(replicas), ["replica1", "replica2"])
+        self.assertEqual((replicas["replica1"]["HOST"], replicas["replica1"]["PORT"]), ("r1", "6432"))
+        self.assertEqual(replicas["replica2"]["PORT"], "5432")
+        self.assertEqual(replicas["replica2"]["TEST"], {"MIRROR": "default"})
+
+
+class ReplicaRoutingTests(APITestCase):
+    def setUp(self):
+        from unittest import mock
+
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email="replica@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch("config.replicas.replica_aliases", return_value=["replica1"])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _read_db(self) -> str:
+        from types import SimpleNamespace
+
+        from config.replicas import ReplicaRouter, replica_reads
+
+        @replica_reads
+        def view(request):
+            return ReplicaRouter().db_for_read(Message)
+        return view(SimpleNamespace(user=self.user))
+
+    def test_reads_from_replica_until_own_write(self):
+        from config import replicas
+
+        self.assertEqual(self._read_db(), "replica1")
+        self.assertEqual(replicas.ReplicaRouter().db_for_write(Message), "default")
+        with replicas.primary():
+            self.assertEqual(replicas.ReplicaRouter().db_for_read(Message), "default")
+
+        room = Chat.objects.create(name="replica")
+        res = self.client.post("/api/messages/", {"room": room.id, "content": "mine"}, format="json")
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(self._read_db(), "default")
+
+        cache.delete(replicas.STICKY_KEY.format(self.user.id))
+        self.assertEqual(self._read_db(), "replica1")
+
+    def test_recently_changed_list_is_read_from_primary(self):
+        import time
+
+        from config import replicas
+
+        self.assertTrue(replicas.changed_recently(time.time_ns()))
+        self.assertFalse(replicas.changed_recently(time.time_ns() - 3600 * 10**9))
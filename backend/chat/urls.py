@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
+
 from .views import (
     FolderViewSet,
     ChatViewSet,
@@ -25,6 +27,9 @@ router.register(r'friends', FriendsViewSet, basename='friends')
 router.register(r'block', BlockViewSet, basename='block')
 
 urlpatterns = [
+    # горячие GET-списки — async (chat/async_views.py); прочие методы они передают DRF
+    path('messages/', async_views.message_list, name='message-list-async'),
+    path('conversations/', async_views.conversation_list, name='conversations-list-async'),
     path('', include(router.urls)),
     path('conversations/<int:pk>/messages/', ConversationMessagesView.as_view(), name='conversation-messages'),
     path('users/search/', UserSearchView.as_view(), name='user-search'),
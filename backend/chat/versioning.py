@@ -0,0 +1,184 @@
+# chat/versioning.py
+"""
+Дешёвые валидаторы для списков (ETag).
+
+Храним в кэше «версию» (time_ns последнего изменения):
+  - комнаты       chat:ver:room:<id>   — сообщения комнаты
+  - пользователя  chat:ver:user:<id>   — его диалоги, скрытые сообщения, непрочитанные
+  - папок         chat:ver:folders     — дерево папок и чаты в них
+
+Версии поднимаются при записи (см. chat/signals.py и services), а list-эндпоинты
+сравнивают их с If-None-Match, не обращаясь к таблицам сообщений.
+Если версии в кэше нет (вытеснена/рестарт) — создаём новую, клиент просто получит 200.
+Last-Modified не отдаём: у него секундная точность, и запись в ту же секунду, что и прошлый
+ответ, получила бы 304 по If-Modified-Since.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+
+from config import replicas
+
+ROOM_KEY = "chat:ver:room:{}"
+USER_KEY = "chat:ver:user:{}"
+FOLDERS_KEY = "chat:ver:folders"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_LIST_VERSION_TTL", 7 * 24 * 3600))
+
+
+def _get(key: str) -> int:
+    ver = cache.get(key)
+    if ver is None:
+        ver = time.time_ns()
+        # add() не перетрёт версию, которую параллельно успел выставить другой процесс
+        if not cache.add(key, ver, _ttl()):
+            ver = cache.get(key, ver)
+    return int(ver)
+
+
+async def _aget(key: str) -> int:
+    ver = await cache.aget(key)
+    if ver is None:
+        ver = time.time_ns()
+        if not await cache.aadd(key, ver, _ttl()):
+            ver = await cache.aget(key, ver)
+    return int(ver)
+
+
+def _bump(keys: Iterable[str]) -> None:
+    keys = list(keys)
+    if not keys:
+        return
+
+    def _apply():
+        now = time.time_ns()
+        cache.set_many({k: now for k in keys}, _ttl())
+
+    # Внутри транзакции — только после коммита, иначе параллельный опрос
+    # закэширует старые данные под новой версией. Вне транзакции выполняется сразу.
+    transaction.on_commit(_apply)
+
+
+# ---- комнаты ----
+
+def room_version(room_id: int) -> int:
+    return _get(ROOM_KEY.format(int(room_id)))
+
+
+async def aroom_version(room_id: int) -> int:
+    return await _aget(ROOM_KEY.format(int(room_id)))
+
+
+def bump_room(room_id: int) -> None:
+    _bump([ROOM_KEY.format(int(room_id))])
+
+
+# ---- пользователи ----
+
+def user_version(user_id: int) -> int:
+    return _get(USER_KEY.format(int(user_id)))
+
+
+async def auser_version(user_id: int) -> int:
+    return await _aget(USER_KEY.format(int(user_id)))
+
+
+def bump_users(*user_ids: int) -> None:
+    _bump(USER_KEY.format(int(uid)) for uid in user_ids if uid)
+
+
+def bump_private_participants(chat_id: int) -> None:
+    """Поднимает версии участников ЛС (их список диалогов). Для групп — ничего не делает."""
+    from .models import ChatParticipant, ChatType
+
+    user_ids = list(
+        ChatParticipant.objects
+        .filter(chat_id=chat_id, chat__type=ChatType.PRIVATE)
+        .values_list("user_id", flat=True)
+    )
+    bump_users(*user_ids)
+
+
+def bump_private_partners(user_id: int) -> None:
+    """Поднимает версии собеседников пользователя по ЛС: в их списках диалогов его ник и аватар."""
+    from .models import ChatParticipant, ChatType
+
+    partner_ids = list(
+        ChatParticipant.objects
+        .filter(
+            chat__type=ChatType.PRIVATE,
+            chat__member_links__user_id=user_id,
+        )
+        .exclude(user_id=user_id)
+        .values_list("user_id", flat=True)
+        .distinct()
+    )
+    bump_users(*partner_ids)
+
+
+# ---- папки ----
+
+def folders_version() -> int:
+    return _get(FOLDERS_KEY)
+
+
+def bump_folders() -> None:
+    _bump([FOLDERS_KEY])
+
+
+# ---- conditional GET ----
+
+def make_etag(*parts) -> str:
+    raw = "|".join(str(p) for p in parts)
+    return quote_etag(hashlib.blake2b(raw.encode(), digest_size=12).hexdigest())
+
+
+class ConditionalListMixin:
+    """
+    Примесь для ViewSet: list() отвечает 304, если версии не изменились.
+    Наследник реализует get_list_versions() -> список версий (time_ns) или None,
+    если для текущего запроса валидаторов нет (тогда обычный ответ).
+    """
+
+    def get_list_versions(self, request) -> Optional[list[int]]:
+        return None
+
+    def list(self, request, *args, **kwargs):
+        versions = self.get_list_versions(request)
+        if not versions:
+            return super().list(request, *args, **kwargs)
+
+        etag = list_etag(request, versions)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            response = not_modified
+        elif replicas.changed_recently(max(versions)):
+            # реплика могла ещё не догнать изменение — старый список под новым ETag не отдаём
+            with replicas.primary():
+                response = super().list(request, *args, **kwargs)
+        else:
+            response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag)
+
+
+def list_etag(request, versions: list[int]) -> str:
+    """ETag списка — общий для ConditionalListMixin и async-списков."""
+    user_id = getattr(request.user, "pk", None)
+    return make_etag(request.get_full_path(), user_id, *versions)
+
+
+def set_validators(response, etag: str):
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Authorization"])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -6,20 +6,22 @@ from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.http import QueryDict
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from rest_framework import status, viewsets, generics, mixins
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
-from rest_framework.pagination import CursorPagination
+from rest_framework.pagination import CursorPagination, _reverse_ordering
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from .models import (
-    Folder, Chat, Message, HiddenMessage, ChatType,
-    FriendRequest, FriendRequestStatus, Friendship, Block,
+    Folder, Chat, ChatParticipant, Message, HiddenMessage, ChatType,
+    FriendRequest, FriendRequestStatus, Block,
 )
 from .serializers import (
     FolderSerializer,
@@ -30,18 +32,34 @@ from .serializers import (
     ConversationCreateSerializer,
     FriendRequestSerializer, FriendRequestCreateSerializer,
     FriendshipSerializer, BlockSerializer, UserMiniSerializer,
+    serialize_users_mini,
+    MessageBatchSerializer, MarkReadBatchSerializer,
 )
 from .permissions import IsChatParticipant
+from .pagination import ChatCursorPagination, MessageSearchCursorPagination, UserSearchCursorPagination
+from .search import search_messages, search_users, user_can_read_room
+from .blocks import block_exists, exclude_blocked, exclude_blocked_chats, get_block_ids
+from .friend_graph import friend_ids, mutual_friend_ids, suggest_friend_ids
+from .folder_tree import get_folder_tree
+from . import archive, reactions, replay
+from .export import EXPORT_KINDS, export_response
+from .idempotency import idempotent_create
+from .ratelimit import SendRateThrottle
 from .services import (
     get_or_create_private_chat,
     mark_conversation_read,
     inc_unread_for_others,
     maybe_set_expires_at,
-    are_friends, block_exists,
+    are_friends,
     send_friend_request, accept_friend_request, reject_friend_request,
     remove_friend, block_user, unblock_user,
+    hide_messages, delete_messages_for_all, mark_rooms_read,
+    visible_messages, clear_history,
 )
 
+from .versioning import ConditionalListMixin, room_version, user_version, folders_version, bump_private_participants
+
+from config.replicas import replica_reads
 from notifications.utils import notify_user
 
 User = get_user_model()
@@ -54,9 +72,18 @@ def _other_participant(chat: Chat, me: User) -> Optional[User]:
     return None
 
 
+def _bounded_int(raw, *, default: int, maximum: int) -> int:
+    """Число из query-параметра в пределах 1..maximum; мусор и пустое значение — default."""
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, maximum))
+
+
 # ======================= FOLDER =======================
 
-class FolderViewSet(viewsets.ModelViewSet):
+class FolderViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     queryset = (
         Folder.objects.all()
         .select_related("parent")
@@ -79,6 +106,23 @@ class FolderViewSet(viewsets.ModelViewSet):
 
         return qs
 
+    def get_list_versions(self, request):
+        return [folders_version()]
+
+    @action(detail=False, methods=["get"])
+    def tree(self, request):
+        """
+        GET /api/folders/tree/[?root=<id>]
+        Всё дерево (или поддерево root) с чатами и метками — см. chat/folder_tree.py.
+        """
+        root = None
+        root_id = request.query_params.get("root")
+        if root_id:
+            if not str(root_id).isdigit():
+                return Response({"detail": "root должен быть числом."}, status=status.HTTP_400_BAD_REQUEST)
+            root = get_object_or_404(Folder, pk=root_id)
+        return Response(get_folder_tree(root))
+
     def get_serializer_class(self):
         if self.action in ["retrieve", "create", "update", "partial_update"]:
             return FolderSerializer
@@ -88,30 +132,167 @@ class FolderViewSet(viewsets.ModelViewSet):
 # ======================= CHAT (public) =======================
 
 class ChatViewSet(viewsets.ModelViewSet):
+    """
+    ?folder=<id>                — чаты папки (EXISTS по таблице связи, без JOIN + DISTINCT)
+    ?folder=<id>&descendants=1  — включая все вложенные папки (диапазон MPTT)
+    """
     queryset = Chat.objects.all().prefetch_related("folders", "labels")
     serializer_class = ChatSerializer
+    pagination_class = ChatCursorPagination
 
     def get_queryset(self):
         qs = super().get_queryset()
         folder = self.request.query_params.get("folder") or self.request.query_params.get("folders")
-        if folder:
-            qs = qs.filter(folders__id=folder)
-        return qs.distinct()
+        if not folder:
+            return qs
+        if not str(folder).isdigit():
+            raise ValidationError({"folder": "Ожидается id папки."})
+
+        links = Chat.folders.through.objects.filter(chat_id=OuterRef("pk"))
+        descendants = str(self.request.query_params.get("descendants", "")).lower() in ("1", "true", "yes")
+        if descendants:
+            root = Folder.objects.filter(pk=folder).values("tree_id", "lft", "rght").first()
+            if root is None:
+                return qs.none()
+            links = links.filter(
+                folder__tree_id=root["tree_id"],
+                folder__lft__gte=root["lft"],
+                folder__rght__lte=root["rght"],
+            )
+        else:
+            links = links.filter(folder_id=folder)
+        return qs.filter(Exists(links))
+
+    @action(detail=True, methods=["get"], permission_classes=[IsAuthenticated])
+    def export(self, request, pk=None):
+        """GET /api/chats/{id}/export/?as=ndjson|zip — потоковая выгрузка истории комнаты."""
+        chat = self.get_object()
+        if not user_can_read_room(request.user, chat):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        kind = request.query_params.get("as", "ndjson")
+        if kind not in EXPORT_KINDS:
+            return Response({"detail": "as: ndjson или zip."}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(chat, request.user, request, kind)
+
+    @action(detail=True, methods=["post"], url_path="clear-history", permission_classes=[IsAuthenticated])
+    def clear_history(self, request, pk=None):
+        """POST /api/chats/{id}/clear-history/ — скрыть у себя всю текущую историю чата."""
+        chat = self.get_object()
+        if not user_can_read_room(request.user, chat):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        return Response({"cleared_before": clear_history(chat, request.user)})
 
 
 # ======================= MESSAGE (public rooms) =======================
 
 class MessageCursorPagination(CursorPagination):
+    """
+    Курсор по горячей таблице; когда в комнате ?room= горячие сообщения кончились,
+    next ведёт в холодный архив (chat/archive.py): ?archive_before=<позиция>.
+    """
     page_size = 30
     ordering = "-created_at"
+    archive_query_param = "archive_before"
+
+    def get_ordering(self, request, queryset, view):
+        # id — UUIDv7, тот же порядок, но уникальный ключ: курсор без offset на совпадающих created_at
+        if getattr(settings, "CHAT_MESSAGE_CURSOR_ON_ID", False):
+            return ("-id",)
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.archive_mode, self.archive_next = False, None
+        room_id = request.query_params.get("room")
+        room_id = int(room_id) if room_id and str(room_id).isdigit() else None
+        token = request.query_params.get(self.archive_query_param)
+        if room_id is not None and token is not None:
+            return self._paginate_archive(room_id, token, request)
+
+        page = super().paginate_queryset(queryset, request, view)
+        self._link_archive(page, room_id)
+        return page
+
+    async def apaginate_queryset(self, queryset, request, room_id: int, view=None):
+        """
+        paginate_queryset для async-списка (chat/async_views.py): тот же курсор DRF,
+        страница читается async ORM. Архивные страницы (?archive_before=) — только синхронный путь.
+        """
+        self.archive_mode, self.archive_next = False, None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            order = self.ordering[0]
+            op = "__lt" if self.cursor.reverse != order.startswith("-") else "__gt"
+            queryset = queryset.filter(**{order.lstrip("-") + op: current_position})
+
+        results = [obj async for obj in queryset[offset:offset + self.page_size + 1]]
+        page = results[:self.page_size]
+        following = (
+            self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(page) else None
+        )
+        if reverse:
+            page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following is not None
+            self.next_position, self.previous_position = current_position, following
+        else:
+            self.has_next = following is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position, self.previous_position = following, current_position
+        self.page = page
+        self._link_archive(page, room_id)
+        return page
+
+    def _link_archive(self, page, room_id: Optional[int]) -> None:
+        going_back = self.cursor is not None and self.cursor.reverse
+        if room_id is not None and not self.has_next and not going_back and archive.has_archive(room_id):
+            # архив целиком старше горячих строк — продолжаем со следующей за последней показанной
+            self.archive_next = (
+                archive.encode_position(archive.to_us(page[-1].created_at), page[-1].id) if page else ""
+            )
 
-
-class MessageViewSet(viewsets.ModelViewSet):
+    def _paginate_archive(self, room_id: int, token: str, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position = None
+        if token:
+            position = archive.decode_position(token)
+            if position is None:
+                raise NotFound(self.invalid_cursor_message)
+        messages, next_position = archive.read_page(room_id, request.user, position, self.page_size)
+        self.archive_mode = True
+        self.has_next, self.has_previous = next_position is not None, False
+        self.archive_next = archive.encode_position(*next_position) if next_position else None
+        return messages
+
+    def get_next_link(self):
+        if self.archive_next is not None:
+            url = remove_query_param(self.base_url, self.cursor_query_param)
+            return replace_query_param(url, self.archive_query_param, self.archive_next)
+        if self.archive_mode:
+            return None
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.archive_mode:
+            return None
+        return super().get_previous_link()
+
+
+class MessageViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     pagination_class = MessageCursorPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
+    throttle_classes = [SendRateThrottle]
     parser_classes = (MultiPartParser, FormParser, JSONParser)
-    http_method_names = ["get", "post", "delete", "head", "options"]
+    http_method_names = ["get", "post", "patch", "delete", "head", "options"]
 
     def get_queryset(self):
         qs = (
@@ -124,11 +305,29 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         user = self.request.user
         if user and getattr(user, "is_authenticated", False):
-            hidden_ids = HiddenMessage.objects.filter(user=user).values_list("message_id", flat=True)
-            qs = qs.exclude(id__in=hidden_ids)
+            qs = visible_messages(qs, user, int(room_id) if room_id and str(room_id).isdigit() else None)
 
         return qs.order_by("-created_at")
 
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_list_versions(self, request):
+        # валидаторы есть только у списка одной комнаты
+        room_id = request.query_params.get("room")
+        if not room_id or not str(room_id).isdigit():
+            return None
+        versions = [room_version(int(room_id))]
+        user = request.user
+        if user and getattr(user, "is_authenticated", False):
+            versions.append(user_version(user.id))
+        return versions
+
+    @idempotent_create
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer: MessageSerializer) -> None:
         user = self.request.user
         is_auth = bool(getattr(user, "is_authenticated", False))
@@ -167,6 +366,40 @@ class MessageViewSet(viewsets.ModelViewSet):
             meta=meta or {},
         )
 
+    def partial_update(self, request, *args, **kwargs):
+        """
+        PATCH /api/messages/{id}/ {"content": "..."} — правка текста, только автором.
+        В комнату уходит дельта message:edit (id, content, edited_at), а не всё сообщение.
+        """
+        instance: Message = self.get_object()
+        user = request.user
+        if not (user and user.is_authenticated):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        if not instance.author_id or instance.author_id != user.id:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        if "content" not in request.data:
+            raise ValidationError({"content": "Обязательное поле."})
+        content = str(request.data.get("content") or "").strip()
+        if not content and not instance.attachment:
+            raise ValidationError({"content": "Нужно оставить текст или вложение."})
+
+        if content != instance.content:
+            instance.content = content
+            instance.edited_at = timezone.now()
+            instance.save(update_fields=["content", "edited_at"])
+
+            payload = {"id": str(instance.id), "content": instance.content, "edited_at": instance.edited_at}
+            channel_layer = get_channel_layer()
+            async_to_sync(channel_layer.group_send)(
+                f"chat_{instance.room_id}",
+                replay.make_room_event(
+                    "chat_edit", {"type": "message:edit", "payload": payload}, instance.room_id,
+                ),
+            )
+
+        return Response(MessageSerializer(instance, context={"request": request}).data)
+
     def destroy(self, request, *args, **kwargs):
         instance: Message = self.get_object()
         for_all = str(request.query_params.get("for_all", "")).lower() in ("1", "true", "yes")
@@ -189,11 +422,12 @@ class MessageViewSet(viewsets.ModelViewSet):
         msg_id = str(instance.id)
 
         instance.hard_delete()
+        bump_private_participants(room_id)
 
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f"chat_{room_id}",
-            {"type": "chat_delete", "id": msg_id},
+            replay.make_room_event("chat_delete", {"type": "message:delete", "payload": {"id": msg_id}}, room_id),
         )
 
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -212,31 +446,171 @@ class MessageViewSet(viewsets.ModelViewSet):
         HiddenMessage.objects.get_or_create(user=user, message=msg)
         return Response({"status": "hidden"}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=["get", "post", "delete"])
+    def reactions(self, request, pk=None):
+        """
+        GET    /api/messages/{id}/reactions/               — {"counts": {эмодзи: n}, "mine": [...]}
+        POST   /api/messages/{id}/reactions/ {"emoji": ...} — поставить реакцию
+        DELETE /api/messages/{id}/reactions/?emoji=...      — снять свою реакцию
+        Счётчики в ленте (meta.reactions) сводятся пачками, см. chat/reactions.py;
+        в комнату уходит reaction:delta только если реакция действительно появилась/исчезла.
+        """
+        user = request.user
+        msg = get_object_or_404(
+            Message.objects.select_related("room").filter(deleted_at__isnull=True), pk=pk,
+        )
+        is_auth = bool(user and user.is_authenticated)
+        if request.method == "GET":
+            can_read = user_can_read_room(user, msg.room) if is_auth else msg.room.type != ChatType.PRIVATE
+            if not can_read:
+                raise NotFound()
+            mine = []
+            if is_auth:
+                mine = list(
+                    msg.reactions.filter(user=user).order_by("created_at").values_list("emoji", flat=True)
+                )
+            return Response({"id": str(msg.id), "counts": reactions.counts_for(msg.id), "mine": mine})
+
+        if not is_auth:
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        if not user_can_read_room(user, msg.room):
+            raise NotFound()
+
+        raw = request.data.get("emoji") if request.method == "POST" else request.query_params.get("emoji")
+        emoji = reactions.clean_emoji(raw)
+        if not emoji:
+            raise ValidationError({"emoji": f"От 1 до {reactions.MAX_EMOJI_LENGTH} символов."})
+
+        if request.method == "POST":
+            changed, delta = reactions.add_reaction(msg, user, emoji), 1
+        else:
+            changed, delta = reactions.remove_reaction(msg, user, emoji), -1
+
+        if changed:
+            payload = {"id": str(msg.id), "emoji": emoji, "delta": delta, "user_id": user.id}
+            channel_layer = get_channel_layer()
+            async_to_sync(channel_layer.group_send)(
+                f"chat_{msg.room_id}",
+                replay.make_room_event("chat_reaction", {"type": "reaction:delta", "payload": payload}, msg.room_id),
+            )
+        return Response(
+            {"id": str(msg.id), "emoji": emoji, "changed": changed, "counts": reactions.counts_for(msg.id)},
+            status=status.HTTP_201_CREATED if request.method == "POST" and changed else status.HTTP_200_OK,
+        )
+
+    # ---- пакетные операции ----
+
+    @action(detail=False, methods=["post"], url_path="bulk-hide", permission_classes=[IsAuthenticated])
+    def bulk_hide(self, request):
+        """POST /api/messages/bulk-hide/ {"ids": [...]} — скрыть у себя пачкой."""
+        ser = MessageBatchSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        hidden = hide_messages(request.user, ser.validated_data["ids"])
+        return Response({"hidden": hidden})
+
+    @action(detail=False, methods=["post"], url_path="bulk-delete", permission_classes=[IsAuthenticated])
+    def bulk_delete(self, request):
+        """
+        POST /api/messages/bulk-delete/ {"ids": [...]} — удалить у всех (свои; staff — любые).
+        В каждую затронутую комнату уходит одно событие message:delete_batch.
+        """
+        ser = MessageBatchSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        by_room = delete_messages_for_all(request.user, ser.validated_data["ids"])
+
+        channel_layer = get_channel_layer()
+        for room_id, ids in by_room.items():
+            async_to_sync(channel_layer.group_send)(
+                f"chat_{room_id}",
+                replay.make_room_event(
+                    "chat_delete_batch", {"type": "message:delete_batch", "payload": {"ids": ids}}, room_id,
+                ),
+            )
+        deleted = sum(len(ids) for ids in by_room.values())
+        return Response({"deleted": deleted, "skipped": len(ser.validated_data["ids"]) - deleted})
+
+    @action(detail=False, methods=["post"], url_path="mark-read", permission_classes=[IsAuthenticated])
+    def mark_read(self, request):
+        """POST /api/messages/mark-read/ {"rooms": [...]} или {"ids": [...]} — прочитать чаты пачкой."""
+        ser = MarkReadBatchSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        room_ids = set(ser.validated_data.get("rooms") or [])
+        if ser.validated_data.get("ids"):
+            room_ids.update(
+                Message.objects.filter(id__in=ser.validated_data["ids"]).values_list("room_id", flat=True)
+            )
+        # только чаты, где вызывающий — участник: чужие id не должны слать dm_read в чужие ЛС
+        room_ids = set(
+            ChatParticipant.objects.filter(user=request.user, chat_id__in=room_ids).values_list("chat_id", flat=True)
+        )
+        updated = mark_rooms_read(request.user, room_ids)
+
+        # собеседникам в ЛС — dm_read, как при чтении диалога
+        others = (
+            ChatParticipant.objects
+            .filter(chat_id__in=room_ids, chat__type=ChatType.PRIVATE)
+            .exclude(user=request.user)
+            .values_list("chat_id", "user_id")
+        )
+        for chat_id, user_id in others:
+            try:
+                notify_user(user_id, type="dm_read", chat_id=chat_id)
+            except Exception:
+                pass
+        return Response({"updated": updated})
+
+    @action(detail=False, methods=["get"], pagination_class=MessageSearchCursorPagination)
+    def search(self, request):
+        """
+        GET /api/messages/search/?q=<текст>&room=<id>
+        Полнотекстовый поиск (см. chat/search.py), сортировка по релевантности, курсорная пагинация.
+        """
+        user = request.user
+        if not user or not user.is_authenticated:
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        room_id = request.query_params.get("room")
+        if room_id:
+            if not str(room_id).isdigit():
+                return Response({"detail": "room должен быть числом."}, status=status.HTTP_400_BAD_REQUEST)
+            chat = get_object_or_404(Chat, pk=room_id)
+            if not user_can_read_room(user, chat):
+                return Response(status=status.HTTP_403_FORBIDDEN)
+            room_id = chat.id
+
+        qs = search_messages(user, request.query_params.get("q", ""), room_id=room_id or None)
+        page = self.paginate_queryset(qs)
+        ser = self.get_serializer(page, many=True)
+        return self.get_paginated_response(ser.data)
+
 
 # ======================= CONVERSATIONS (DM) =======================
 
-class ConversationsViewSet(viewsets.GenericViewSet,
+class ConversationsViewSet(ConditionalListMixin,
+                           viewsets.GenericViewSet,
                            mixins.ListModelMixin,
                            mixins.RetrieveModelMixin):
     permission_classes = [IsAuthenticated]
     serializer_class = ConversationSerializer
 
     def get_queryset(self):
+        qs = Chat.objects.filter(type=ChatType.PRIVATE, participants=self.request.user)
+        if self.action == "list":
+            qs = exclude_blocked_chats(qs, self.request.user)
         return (
-            Chat.objects
-            .filter(type=ChatType.PRIVATE, participants=self.request.user)
+            qs
             .select_related("last_message")
+            .defer("last_message__search_vector")
             .prefetch_related("participants")
+            .order_by("-last_message__created_at", "-id")
         )
 
+    @replica_reads
     def list(self, request, *args, **kwargs):
-        qs = self.get_queryset().order_by("-last_message__created_at", "-id")
-        page = self.paginate_queryset(qs)
-        if page is not None:
-            ser = self.get_serializer(page, many=True)
-            return self.get_paginated_response(ser.data)
-        ser = self.get_serializer(qs, many=True)
-        return Response(ser.data)
+        return super().list(request, *args, **kwargs)
+
+    def get_list_versions(self, request):
+        return [user_version(request.user.id)]
 
     def create(self, request, *args, **kwargs):
         ser = ConversationCreateSerializer(data=request.data, context={"request": request})
@@ -276,6 +650,21 @@ class ConversationsViewSet(viewsets.GenericViewSet,
         ser = ConversationSerializer(chat, context={"request": request})
         return Response(ser.data)
 
+    @action(detail=True, methods=["get"])
+    def export(self, request, pk=None):
+        """GET /api/conversations/{pk}/export/?as=ndjson|zip — потоковая выгрузка диалога."""
+        chat = get_object_or_404(self.get_queryset(), pk=pk)
+        kind = request.query_params.get("as", "ndjson")
+        if kind not in EXPORT_KINDS:
+            return Response({"detail": "as: ndjson или zip."}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(chat, request.user, request, kind)
+
+    @action(detail=True, methods=["post"])
+    def clear(self, request, pk=None):
+        """POST /api/conversations/{pk}/clear/ — очистить историю диалога у себя."""
+        chat = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response({"cleared_before": clear_history(chat, request.user)})
+
     def partial_update(self, request, *args, **kwargs):
         chat = get_object_or_404(self.get_queryset(), pk=kwargs["pk"])
         allowed = {"is_secret", "self_destruct_timer"}
@@ -301,6 +690,7 @@ class ConversationMessagesView(generics.ListCreateAPIView):
     """
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated, IsChatParticipant]
+    throttle_classes = [SendRateThrottle]
     pagination_class = None
     parser_classes = [JSONParser, FormParser, MultiPartParser]
 
@@ -316,9 +706,9 @@ class ConversationMessagesView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         chat = self.get_chat()
+        qs = Message.objects.filter(room=chat, deleted_at__isnull=True)
         return (
-            Message.objects
-            .filter(room=chat, deleted_at__isnull=True)
+            visible_messages(qs, self.request.user, chat.id)
             .select_related("author")
             .order_by("created_at")
         )
@@ -335,6 +725,7 @@ class ConversationMessagesView(generics.ListCreateAPIView):
             pass
         return resp
 
+    @idempotent_create
     def create(self, request, *args, **kwargs):
         chat = self.get_chat()
 
@@ -363,18 +754,16 @@ class ConversationMessagesView(generics.ListCreateAPIView):
 
         # обновим last_message у чата
         Chat.objects.filter(pk=chat.id).update(last_message=msg)
+        bump_private_participants(chat.id)
 
-        # realtime оповещение комнаты
+        # сериализуем один раз: те же данные уходят и в ответ, и (готовым кадром) в комнату
+        data = MessageSerializer(msg, context={"request": request}).data
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
-            f"chat_{chat.id}",
-            {
-                "type": "chat_message",
-                "data": MessageSerializer(msg, context={"request": request}).data,
-            },
+            f"chat_{chat.id}", replay.make_room_event("chat_message", data, chat.id),
         )
 
-        return Response(MessageSerializer(msg, context={"request": request}).data, status=201)
+        return Response(data, status=201)
 
 
 # ======================= FRIEND REQUESTS =======================
@@ -383,9 +772,11 @@ class FriendRequestViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
     def list(self, request):
-        qs = FriendRequest.objects.filter(
-            Q(from_user=request.user) | Q(to_user=request.user)
-        ).select_related("from_user", "to_user").order_by("-created_at")
+        qs = FriendRequest.objects.filter(Q(from_user=request.user) | Q(to_user=request.user))
+        # собеседник — одна из сторон; вторая (сам пользователь) с собой не блокируется
+        qs = exclude_blocked(qs, request.user, "from_user")
+        qs = exclude_blocked(qs, request.user, "to_user")
+        qs = qs.select_related("from_user", "to_user").order_by("-created_at")
         return Response(FriendRequestSerializer(qs, many=True, context={"request": request}).data)
 
     def create(self, request):
@@ -445,16 +836,35 @@ class FriendRequestViewSet(viewsets.ViewSet):
 class FriendsViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
+    @replica_reads
     def list(self, request):
         u = request.user
-        pairs = Friendship.objects.filter(Q(user1=u) | Q(user2=u)).select_related("user1", "user2")
-        others = []
-        for f in pairs:
-            other = f.user2 if f.user1_id == u.id else f.user1
-            others.append(other)
-        data = [UserMiniSerializer(o, context={"request": request}).data for o in others]
+        return Response(self._users_data(request, friend_ids(u.id)))
+
+    @action(detail=False, methods=["get"])
+    def suggestions(self, request):
+        """GET /api/friends/suggestions/ — друзья друзей по числу общих друзей."""
+        u = request.user
+        limit = _bounded_int(request.query_params.get("limit"), default=20, maximum=50)
+        ranked = suggest_friend_ids(u.id, limit=limit, exclude=get_block_ids(u.id))
+        mutual = dict(ranked)
+        data = self._users_data(request, mutual.keys())
+        for row in data:
+            row["mutual_count"] = mutual[row["id"]]
+        data.sort(key=lambda r: (-r["mutual_count"], r["id"]))
         return Response(data)
 
+    @action(detail=True, methods=["get"])
+    def mutual(self, request, pk=None):
+        """GET /api/friends/<user_id>/mutual/ — общие друзья."""
+        other = get_object_or_404(User, pk=pk)
+        return Response(self._users_data(request, mutual_friend_ids(request.user.id, other.id)))
+
+    def _users_data(self, request, ids) -> list[dict]:
+        qs = exclude_blocked(User.objects.filter(pk__in=list(ids)), request.user)
+        rows = qs.order_by("id").values("id", "nickname", "email", "avatar")
+        return serialize_users_mini(rows, request)
+
     def destroy(self, request, pk=None):
         other = get_object_or_404(User, pk=pk)
         remove_friend(request.user, other)
@@ -484,30 +894,17 @@ class BlockViewSet(viewsets.ViewSet):
 # ======================= USER SEARCH =======================
 
 class UserSearchView(generics.ListAPIView):
+    """
+    GET /api/users/search/?q=<строка>
+    Префиксный поиск по словам ника/почты/имени (GIN, см. chat/search.py), курсорная пагинация.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = UserMiniSerializer
+    pagination_class = UserSearchCursorPagination
 
     def get_queryset(self):
-        UserModel = get_user_model()
-        q = (self.request.query_params.get("q") or "").strip()
-        if len(q) < 4:
-            return UserModel.objects.none()
-
-        field_names = {f.name for f in UserModel._meta.get_fields()}
+        return search_users(self.request.user, self.request.query_params.get("q") or "")
 
-        cond = Q()
-        added = False
-        for fname in ("nickname", "username", "email", "first_name", "last_name"):
-            if fname in field_names:
-                cond |= Q(**{f"{fname}__icontains": q})
-                added = True
-
-        if not added:
-            return UserModel.objects.none()
-
-        return (
-            UserModel.objects
-            .filter(cond)
-            .exclude(pk=self.request.user.pk)
-            .order_by("id")
-        )
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
@@ -1,6 +1,6 @@
 # backend/chat/ws_auth.py
 from urllib.parse import parse_qs
-from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.utils.functional import LazyObject
 
@@ -18,7 +18,7 @@ async def _get_user_from_token(token: str):
     try:
         jwt_auth = JWTAuthentication()
         validated = jwt_auth.get_validated_token(token)
-        user = await sync_to_async(jwt_auth.get_user)(validated)
+        user = await database_sync_to_async(jwt_auth.get_user)(validated)
         return user
     except InvalidToken:
         return AnonymousUser()
@@ -16,14 +16,17 @@ from django.core.asgi import get_asgi_application
 from django.contrib.auth.models import AnonymousUser
 from django.urls import path
 
+from config.ws_compression import enable_permessage_deflate
+
 # === Консьюмеры WebSocket ===
 from notifications.consumers import NotificationsConsumer
 
 # Пытаемся подключить чат мягко, чтобы не ломать проект, если chat ещё не готов
 try:
     from chat.consumers import ChatConsumer  # ws://.../ws/chat/<room_id>/
+    from chat.gateway import GatewayConsumer  # ws://.../ws/gateway/ — все комнаты + уведомления
 except Exception:
-    ChatConsumer = None  # чат будет пропущен в маршрутах
+    ChatConsumer = GatewayConsumer = None  # чат будет пропущен в маршрутах
 
 # SimpleJWT для валидации токена
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -84,6 +87,11 @@ if ChatConsumer is not None:
     websocket_urlpatterns.append(
         path("ws/chat/<int:room_id>/", ChatConsumer.as_asgi())
     )
+    # Один сокет на клиента: ws://<host>/ws/gateway/?token=... (см. chat/gateway.py)
+    websocket_urlpatterns.append(path("ws/gateway/", GatewayConsumer.as_asgi()))
+
+# ===== Сжатие кадров (только под daphne; uvicorn согласует сам) =====
+enable_permessage_deflate()
 
 # ===== ASGI-приложение =====
 application = ProtocolTypeRouter({
@@ -0,0 +1,114 @@
+# config/async_api.py
+"""
+Async-представления для горячих GET-списков API под ASGI (daphne).
+
+DRF-представления синхронные: под ASGI Django выполняет каждое через sync_to_async —
+переход в единственный thread-sensitive поток процесса, где запросы всех клиентов идут
+по очереди. Для самых частых списков (сообщения комнаты, диалоги, уведомления) есть
+быстрый путь целиком в event loop: JWT проверяется без БД, пользователь и строки — async ORM,
+сериализация — те же сериализаторы DRF по уже загруженным объектам.
+
+Всё, что быстрый путь не берёт на себя (не GET, browsable API, ?format=, ошибка токена,
+архивные страницы, ASYNC_LIST_VIEWS=False), уходит в прежнее DRF-представление без изменений;
+тело ответа у обоих путей одно и то же.
+Сравнение: manage.py bench_async_lists.
+"""
+from __future__ import annotations
+
+from functools import wraps
+from typing import Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+FastPath = Callable[..., Awaitable[Optional[HttpResponse]]]
+
+_renderer = JSONRenderer()
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "ASYNC_LIST_VIEWS", True))
+
+
+def wants_json(request) -> bool:
+    # browsable API и ?format= — забота DRF
+    if "format" in request.GET:
+        return False
+    accept = request.headers.get("Accept", "")
+    return "text/html" not in accept
+
+
+async def aauthenticate(request):
+    """
+    Пользователь по заголовку Authorization: Bearer <JWT>, как у JWTAuthentication, но без
+    потока: подпись и срок проверяются без БД, пользователь — одним aget.
+    AnonymousUser — заголовка нет; None — токен не прошёл (ответ с ошибкой отдаст DRF).
+    """
+    forced = getattr(request, "_force_auth_user", None)  # APIClient.force_authenticate в тестах
+    if forced is not None:
+        return forced
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    if header is None:
+        return AnonymousUser()
+    raw = auth.get_raw_token(header)
+    if raw is None:
+        return AnonymousUser()
+    try:
+        token = auth.get_validated_token(raw)
+        user_id = token[jwt_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+
+    User = get_user_model()
+    user = await User.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+    if user is None or (jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active):
+        return None
+    if jwt_settings.CHECK_REVOKE_TOKEN and (
+        token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+    ):
+        return None
+    return user
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    response = HttpResponse(_renderer.render(data), status=status, content_type="application/json")
+    response["Vary"] = "Accept"
+    response.data = data  # как у DRF Response (APIClient в тестах читает .data)
+    return response
+
+
+def async_list(fallback) -> Callable[[FastPath], Callable]:
+    """
+    Декоратор быстрого пути: fast(request, *args, **kwargs) -> ответ или None
+    (None — «не мой случай», запрос уходит в fallback — обычное DRF-представление).
+    fast получает DRF Request с уже выставленным request.user (query_params, контекст сериализаторов).
+    """
+    sync_fallback = sync_to_async(fallback)
+
+    def decorator(fast: FastPath):
+        @csrf_exempt
+        @wraps(fast)
+        async def view(request, *args, **kwargs):
+            response = None
+            if request.method == "GET" and enabled() and wants_json(request):
+                user = await aauthenticate(request)
+                if user is not None:
+                    drf_request = Request(request, authenticators=())
+                    drf_request.user = user
+                    response = await fast(drf_request, *args, **kwargs)
+            if response is None:
+                response = await sync_fallback(request, *args, **kwargs)
+            return response
+        return view
+    return decorator
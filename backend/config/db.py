@@ -0,0 +1,95 @@
+# config/db.py
+"""
+Настройки соединений с Postgres (DATABASES["default"]) по DB_POOL_MODE.
+
+  off        — новое соединение на запрос / на каждый вызов database_sync_to_async;
+  persistent — (по умолчанию) соединение потока живёт DB_CONN_MAX_AGE секунд, перед повторным
+               использованием проверяется (CONN_HEALTH_CHECKS), так что рестарт Postgres не даёт
+               «мёртвых» запросов;
+  pool       — пул psycopg 3 в процессе (Django 5.1+, OPTIONS["pool"]), нужен пакет psycopg[pool];
+               соединение берётся из пула на вызов, проверяется и возвращается на close();
+  pgbouncer  — за pgbouncer в режиме transaction pooling: постоянные соединения к bouncer'у,
+               без серверных курсоров (.iterator()) и подготовленных выражений psycopg 3 —
+               между транзакциями соединение с сервером может смениться.
+
+В консьюмерах ORM — async (aget/afirst/acreate) или channels.db.database_sync_to_async;
+channels вызывает close_old_connections() перед каждым обработчиком (а database_sync_to_async —
+ещё и до/после вызова), и именно там соединение возвращается в пул или закрывается
+по CONN_MAX_AGE. Голый asgiref sync_to_async этого не делает.
+Под daphne sync-код идёт в одном потоке процесса, поэтому процессу обычно хватает
+одного-двух соединений; DB_POOL_MAX_SIZE — запас на фоновые потоки (chat/reactions.py).
+
+Реплики для чтения: DB_REPLICA_HOSTS=host[:port],... -> алиасы replica1, replica2, ... с теми же
+именем БД, пользователем, паролем и режимом соединений, что у default (маршрутизация —
+config/replicas.py). В тестах реплики зеркалят default. Локально реплику можно изобразить
+вторым Postgres (pg_basebackup / streaming replication) или тем же сервером:
+DB_REPLICA_HOSTS=127.0.0.1:5432 — маршрутизация работает, отставания нет.
+SQLite вместо реплик не подходит: схема завязана на Postgres (партиции, jsonb, GIN).
+"""
+from __future__ import annotations
+
+import copy
+import importlib.util
+
+from django.core.exceptions import ImproperlyConfigured
+
+POOL_MODES = ("off", "persistent", "pool", "pgbouncer")
+
+
+def _has_psycopg3() -> bool:
+    return importlib.util.find_spec("psycopg") is not None
+
+
+def database_config(env) -> dict:
+    """DATABASES["default"] из переменных окружения (django-environ Env)."""
+    db = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": env("DB_NAME"),
+        "USER": env("DB_USER"),
+        "PASSWORD": env("DB_PASSWORD"),
+        "HOST": env("DB_HOST"),
+        "PORT": env("DB_PORT"),
+        "OPTIONS": {"connect_timeout": env.int("DB_CONNECT_TIMEOUT", default=10)},
+    }
+    mode = env("DB_POOL_MODE", default="persistent").strip().lower()
+    if mode not in POOL_MODES:
+        raise ImproperlyConfigured(f"DB_POOL_MODE={mode!r}: ожидается одно из {', '.join(POOL_MODES)}")
+
+    if mode in ("persistent", "pgbouncer"):
+        db["CONN_MAX_AGE"] = env.int("DB_CONN_MAX_AGE", default=60)
+        db["CONN_HEALTH_CHECKS"] = True
+
+    if mode == "pgbouncer":
+        db["DISABLE_SERVER_SIDE_CURSORS"] = True
+        if _has_psycopg3():
+            db["OPTIONS"]["prepare_threshold"] = None
+
+    if mode == "pool":
+        if not _has_psycopg3() or importlib.util.find_spec("psycopg_pool") is None:
+            raise ImproperlyConfigured("DB_POOL_MODE=pool требует psycopg 3: pip install 'psycopg[binary,pool]'")
+        from psycopg_pool import ConnectionPool
+
+        db["CONN_MAX_AGE"] = 0  # пул несовместим с постоянными соединениями Django
+        db["OPTIONS"]["pool"] = {
+            "min_size": env.int("DB_POOL_MIN_SIZE", default=1),
+            "max_size": env.int("DB_POOL_MAX_SIZE", default=10),
+            "timeout": env.float("DB_POOL_TIMEOUT", default=10.0),
+            "max_idle": env.float("DB_POOL_MAX_IDLE", default=300.0),
+            # проверка соединения при выдаче из пула: после рестарта Postgres — новое, а не ошибка
+            "check": ConnectionPool.check_connection,
+        }
+    return db
+
+
+def replica_configs(env, primary: dict) -> dict[str, dict]:
+    """{"replica1": {...}, ...} из DB_REPLICA_HOSTS; пусто — реплик нет."""
+    replicas = {}
+    for i, item in enumerate(env.list("DB_REPLICA_HOSTS", default=[]), start=1):
+        host, _, port = item.strip().partition(":")
+        if not host:
+            raise ImproperlyConfigured(f"DB_REPLICA_HOSTS: пустой хост в {item!r}")
+        db = copy.deepcopy(primary)
+        db["HOST"], db["PORT"] = host, port or primary["PORT"]
+        db["TEST"] = {"MIRROR": "default"}
+        replicas[f"replica{i}"] = db
+    return replicas
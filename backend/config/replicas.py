@@ -0,0 +1,178 @@
+# config/replicas.py
+"""
+Чтение тяжёлых списков с реплик Postgres (DB_REPLICA_HOSTS, config/db.py) с «read-your-writes».
+
+  - Роутер (ReplicaRouter) отправляет чтения на реплику только внутри replica_reads —
+    им помечены list-эндпоинты (лента, диалоги, уведомления, друзья, поиск людей).
+    Всё остальное, и любые записи, — default.
+  - Кто только что писал, читает с default: после успешного небезопасного HTTP-запроса
+    (ReplicaStickinessMiddleware) или отправки по WS (mark_write) в кэше на DB_REPLICA_STICKY_SEC
+    лежит метка db:sticky:<user_id>. Метка в кэше, а не cookie: её видят и REST, и сокеты,
+    и все вкладки пользователя.
+  - Списки с ETag (chat/versioning.py) читают с default, если их версия поднялась позже,
+    чем DB_REPLICA_STICKY_SEC назад: иначе отстающая реплика отдала бы старые данные под новым
+    ETag, и клиент держал бы их до следующего изменения.
+  - Загрузчики кэшей (граф дружбы, блокировки) читают всегда с default (primary()) —
+    отставание реплики не должно оседать в кэше на часы.
+
+DB_REPLICA_STICKY_SEC должен быть больше типичного отставания реплики. Реплик нет — всё
+это ничего не делает.
+"""
+from __future__ import annotations
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject, empty
+
+STICKY_KEY = "db:sticky:{}"
+REPLICA_PREFIX = "replica"
+
+_read_alias: ContextVar[Optional[str]] = ContextVar("db_read_alias", default=None)
+
+
+def replica_aliases() -> list[str]:
+    return [alias for alias in settings.DATABASES if alias.startswith(REPLICA_PREFIX)]
+
+
+def sticky_seconds() -> int:
+    return int(getattr(settings, "DB_REPLICA_STICKY_SEC", 10))
+
+
+# ---- «только что писал» ----
+
+def mark_write(user_id: Optional[int]) -> None:
+    if user_id and replica_aliases():
+        cache.set(STICKY_KEY.format(int(user_id)), 1, sticky_seconds())
+
+
+async def amark_write(user_id: Optional[int]) -> None:
+    if user_id and replica_aliases():
+        await cache.aset(STICKY_KEY.format(int(user_id)), 1, sticky_seconds())
+
+
+def changed_recently(version_ns: int) -> bool:
+    """Версия списка (time_ns) моложе окна липкости — реплика может её ещё не видеть."""
+    return time.time_ns() - int(version_ns) < sticky_seconds() * 1_000_000_000
+
+
+# ---- выбор базы для чтения ----
+
+def _pick(user) -> Optional[str]:
+    aliases = replica_aliases()
+    if not aliases:
+        return None
+    if getattr(user, "is_authenticated", False) and cache.get(STICKY_KEY.format(user.pk)):
+        return None
+    return random.choice(aliases)
+
+
+async def _apick(user) -> Optional[str]:
+    aliases = replica_aliases()
+    if not aliases:
+        return None
+    if getattr(user, "is_authenticated", False) and await cache.aget(STICKY_KEY.format(user.pk)):
+        return None
+    return random.choice(aliases)
+
+
+def _request_of(args):
+    # метод представления (self, request, ...) или функция (request, ...)
+    first = args[0]
+    return first.request if hasattr(type(first), "as_view") else first
+
+
+def replica_reads(func):
+    """Чтения внутри представления — с реплики, если пользователь запроса недавно не писал."""
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = _read_alias.set(await _apick(_request_of(args).user))
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _read_alias.set(_pick(_request_of(args).user))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """Внутри блока все чтения — с default, даже под replica_reads."""
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS: чтения — текущий алиас из replica_reads, иначе default; записи — default."""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # явно default: иначе объект, прочитанный с реплики, Django сохранил бы туда же
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики — копии default, связи между объектами с разных алиасов допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None if db == DEFAULT_DB_ALIAS else False
+
+
+class ReplicaStickinessMiddleware:
+    """После успешного POST/PUT/PATCH/DELETE ставит пользователю метку «читать с default»."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self._wrote(request, response):
+            mark_write(self._user_id(request))
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self._wrote(request, response):
+            await amark_write(self._user_id(request))
+        return response
+
+    @staticmethod
+    def _wrote(request, response) -> bool:
+        return request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and response.status_code < 400
+
+    @staticmethod
+    def _user_id(request) -> Optional[int]:
+        # DRF кладёт сюда пользователя из JWT; ленивый пользователь сессии, которого никто
+        # не запрашивал, не трогаем — это лишний запрос (а под ASGI — синхронный)
+        user = getattr(request, "user", None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return None
+        return user.pk if getattr(user, "is_authenticated", False) else None
@@ -5,6 +5,8 @@ from datetime import timedelta
 import environ
 from corsheaders.defaults import default_headers
 
+from config.db import database_config, replica_configs
+
 # ---------------- Base & env ----------------
 env = environ.Env()
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -22,6 +24,8 @@ ALLOWED_HOSTS = [
 
 # ---------------- Installed apps ----------------
 INSTALLED_APPS = [
+    # daphne первым: runserver обслуживает HTTP и WebSocket через ASGI
+    "daphne",
     # Django
     "django.contrib.admin",
     "django.contrib.auth",
@@ -29,6 +33,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     # Third-party
     "corsheaders",
@@ -59,6 +64,8 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     # Обновляем last_activity при HTTP-запросах
     "users.middleware.LastActivityMiddleware",
+    # После своей записи пользователь читает списки с default, а не с реплики
+    "config.replicas.ReplicaStickinessMiddleware",
 ]
 
 # ---------------- CORS/CSRF (dev) ----------------
@@ -72,6 +79,7 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_HEADERS = list(default_headers) + [
     "authorization",
     "content-type",
+    "idempotency-key",
 ]
 
 CSRF_TRUSTED_ORIGINS = [
@@ -98,21 +106,22 @@ TEMPLATES = [
     },
 ]
 
-# HTTP обслуживает WSGI (админка/скрипты), WebSocket — ASGI/Channels
+# HTTP и WebSocket обслуживает ASGI (daphne, config/asgi.py); горячие GET-списки —
+# async-представления (config/async_api.py). WSGI остаётся для запуска под gunicorn/uwsgi.
 WSGI_APPLICATION = "config.wsgi.application"
 ASGI_APPLICATION = "config.asgi.application"
 
 # ---------------- Database ----------------
+# DB_POOL_MODE=off|persistent|pool|pgbouncer (+ DB_CONN_MAX_AGE, DB_POOL_MIN_SIZE/MAX_SIZE/TIMEOUT) —
+# см. config/db.py; замер: manage.py soak_ws_db
 DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": env("DB_NAME"),
-        "USER": env("DB_USER"),
-        "PASSWORD": env("DB_PASSWORD"),
-        "HOST": env("DB_HOST"),
-        "PORT": env("DB_PORT"),
-    }
+    "default": database_config(env),
 }
+# Реплики для тяжёлых списков (DB_REPLICA_HOSTS) и read-your-writes — config/replicas.py
+DATABASES.update(replica_configs(env, DATABASES["default"]))
+DATABASE_ROUTERS = ["config.replicas.ReplicaRouter"]
+# Сколько секунд после своей записи пользователь читает с default (больше отставания реплик)
+DB_REPLICA_STICKY_SEC = env.int("DB_REPLICA_STICKY_SEC", default=10)
 
 # ---------------- Auth ----------------
 AUTH_USER_MODEL = "users.User"
@@ -174,6 +183,88 @@ else:
         }
     }
 
+# ---------------- Cache (Redis + фолбэк LocMem) ----------------
+# Общий кэш нужен для версий списков (ETag) и прочих счётчиков между процессами.
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env("CACHE_REDIS_URL", default=REDIS_URL),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# TTL версий списков (сек). Истёкшая версия просто пересоздаётся — клиент получит полный ответ.
+CHAT_LIST_VERSION_TTL = env.int("CHAT_LIST_VERSION_TTL", default=7 * 24 * 3600)
+
+# Сколько месячных секций chat_message держать созданными наперёд (manage.py message_partitions ensure)
+CHAT_MESSAGE_PARTITIONS_AHEAD = env.int("CHAT_MESSAGE_PARTITIONS_AHEAD", default=3)
+
+# Курсор ленты сообщений по id (UUIDv7) вместо created_at. Включать только после
+# manage.py backfill_message_ids: пока в таблице есть uuid4, порядок по id случаен.
+CHAT_MESSAGE_CURSOR_ON_ID = env.bool("CHAT_MESSAGE_CURSOR_ON_ID", default=False)
+
+# Холодный архив сообщений (chat/archive.py, manage.py archive_messages)
+CHAT_ARCHIVE_DIR = env("CHAT_ARCHIVE_DIR", default=str(BASE_DIR / "archive"))
+CHAT_ARCHIVE_AFTER_DAYS = env.int("CHAT_ARCHIVE_AFTER_DAYS", default=365)
+CHAT_ARCHIVE_INACTIVE_DAYS = env.int("CHAT_ARCHIVE_INACTIVE_DAYS", default=90)
+
+# Бинарные кадры msgpack для клиентов с подпротоколом humy.msgpack (chat/frames.py).
+# Нужен пакет msgpack; без него подпротокол просто не предлагается.
+CHAT_WS_MSGPACK = env.bool("CHAT_WS_MSGPACK", default=True)
+
+# Профиль data_usage=low: длина превью в урезанных кадрах; сброс счётчиков трафика
+# по типам кадров в кэш (manage.py ws_frame_stats)
+CHAT_WS_LOW_PREVIEW_CHARS = env.int("CHAT_WS_LOW_PREVIEW_CHARS", default=40)
+CHAT_WS_STATS_FLUSH_SEC = env.int("CHAT_WS_STATS_FLUSH_SEC", default=10)
+
+# Сколько комнат можно держать подписанными на одном /ws/gateway/ сокете
+CHAT_GATEWAY_MAX_ROOMS = env.int("CHAT_GATEWAY_MAX_ROOMS", default=50)
+
+# Журнал событий комнаты для resume после реконнекта (chat/replay.py): сколько событий
+# и сколько секунд держим; отставшим сильнее клиент перечитывает страницу через REST
+CHAT_REPLAY_SIZE = env.int("CHAT_REPLAY_SIZE", default=200)
+CHAT_REPLAY_TTL = env.int("CHAT_REPLAY_TTL", default=300)
+# resume отдаёт и столько событий до last_event_id: рассылка не строго по порядку event_id
+CHAT_REPLAY_OVERLAP = env.int("CHAT_REPLAY_OVERLAP", default=16)
+
+# Сколько секунд помним Idempotency-Key отправки сообщения (chat/idempotency.py)
+CHAT_IDEMPOTENCY_TTL = env.int("CHAT_IDEMPOTENCY_TTL", default=900)
+
+# Лимит отправки сообщений (chat/ratelimit.py), общий для REST и WS: токенов/с и ёмкость ведра
+# на пользователя и на комнату
+CHAT_SEND_RATE_LIMIT = env.bool("CHAT_SEND_RATE_LIMIT", default=True)
+CHAT_SEND_RATE_USER = env.float("CHAT_SEND_RATE_USER", default=1.0)
+CHAT_SEND_BURST_USER = env.int("CHAT_SEND_BURST_USER", default=10)
+CHAT_SEND_RATE_ROOM = env.float("CHAT_SEND_RATE_ROOM", default=20.0)
+CHAT_SEND_BURST_ROOM = env.int("CHAT_SEND_BURST_ROOM", default=100)
+
+# Как часто процесс сводит счётчики реакций в Message.meta (chat/reactions.py), секунд
+CHAT_REACTION_FLUSH_SEC = env.float("CHAT_REACTION_FLUSH_SEC", default=2.0)
+
+# Async-путь для горячих GET-списков (config/async_api.py); False — все запросы идут в DRF
+ASYNC_LIST_VIEWS = env.bool("ASYNC_LIST_VIEWS", default=True)
+
+# permessage-deflate под daphne (config/ws_compression.py)
+WS_PERMESSAGE_DEFLATE = env.bool("WS_PERMESSAGE_DEFLATE", default=True)
+WS_DEFLATE_WINDOW_BITS = env.int("WS_DEFLATE_WINDOW_BITS", default=11)
+WS_DEFLATE_MEM_LEVEL = env.int("WS_DEFLATE_MEM_LEVEL", default=4)
+WS_DEFLATE_NO_CONTEXT_TAKEOVER = env.bool("WS_DEFLATE_NO_CONTEXT_TAKEOVER", default=False)
+
+# Срок хранения уведомлений (notifications/retention.py, manage.py compact_notifications):
+# тип -> дней (удаляются и непрочитанные), формат env: "presence=1;dm.read=7;group.new=30";
+# прочитанные любых типов живут NOTIFICATION_READ_RETENTION_DAYS дней
+NOTIFICATION_RETENTION_DAYS = env.dict(
+    "NOTIFICATION_RETENTION_DAYS", cast={"value": int},
+    default={"presence": 1, "dm.read": 7, "group.new": 30},
+)
+NOTIFICATION_READ_RETENTION_DAYS = env.int("NOTIFICATION_READ_RETENTION_DAYS", default=90)
+
 # ---------------- Notifications integrations ----------------
 # Эти значения можно переопределить в .env; если пусто/не найдено — интеграция тихо пропускается.
 # Для твоего проекта я ставлю безопасные дефолты:
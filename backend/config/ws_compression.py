@@ -0,0 +1,74 @@
+# config/ws_compression.py
+"""
+permessage-deflate (RFC 7692) для WebSocket под Daphne.
+
+Daphne поднимает autobahn-фабрику без сжатия, и JSON-кадры (presence, message:new,
+notification) уходят как есть. enable_permessage_deflate() вызывается из config/asgi.py
+и, если процесс запущен daphne (daphne.server уже импортирован), включает согласование
+сжатия: расширение принимается, когда его предложил клиент (браузеры предлагают всегда).
+
+Память на соединение ограничена окном и memLevel: ~2^(window_bits+2) + 2^(mem_level+9) байт
+на компрессор (11/4 — около 16 КиБ). WS_DEFLATE_NO_CONTEXT_TAKEOVER сбрасывает словарь после
+каждого кадра — ещё меньше памяти, но повторяющиеся ключи JSON жмутся хуже.
+
+Uvicorn (websockets) согласует permessage-deflate сам (--ws-per-message-deflate), здесь ничего не нужно.
+"""
+from __future__ import annotations
+
+import logging
+import sys
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_accept(window_bits: int, mem_level: int, no_context_takeover: bool):
+    """Функция выбора для autobahn perMessageCompressionAccept."""
+    from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+
+    def accept(offers):
+        for offer in offers:
+            if not isinstance(offer, PerMessageDeflateOffer):
+                continue
+            bits = window_bits
+            if offer.request_max_window_bits:
+                bits = min(bits, offer.request_max_window_bits)
+            # server_no_context_takeover от клиента обязателен к исполнению (RFC 7692, 7.1.1.1)
+            return PerMessageDeflateOfferAccept(
+                offer,
+                no_context_takeover=no_context_takeover or offer.request_no_context_takeover,
+                window_bits=bits,
+                mem_level=mem_level,
+            )
+        return None
+
+    return accept
+
+
+def enable_permessage_deflate() -> bool:
+    if not getattr(settings, "WS_PERMESSAGE_DEFLATE", True):
+        return False
+    # импорт daphne.server ставит twisted-реактор — делаем это только внутри самого daphne
+    if "daphne.server" not in sys.modules:
+        return False
+    from daphne.ws_protocol import WebSocketFactory
+
+    if getattr(WebSocketFactory, "_humy_deflate", False):
+        return True
+
+    accept = make_accept(
+        int(getattr(settings, "WS_DEFLATE_WINDOW_BITS", 11)),
+        int(getattr(settings, "WS_DEFLATE_MEM_LEVEL", 4)),
+        bool(getattr(settings, "WS_DEFLATE_NO_CONTEXT_TAKEOVER", False)),
+    )
+    original_init = WebSocketFactory.__init__
+
+    def __init__(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        self.setProtocolOptions(perMessageCompressionAccept=accept)
+
+    WebSocketFactory.__init__ = __init__
+    WebSocketFactory._humy_deflate = True
+    logger.info("WebSocket permessage-deflate enabled")
+    return True
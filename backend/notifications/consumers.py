@@ -4,11 +4,11 @@ from __future__ import annotations
 import asyncio
 from typing import Optional
 
-from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from chat import frames
 from notifications.utils import a_notify_friends_ids
 
 User = get_user_model()
@@ -20,8 +20,11 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
       - friend:request, friend:accept
       - dm:badge, dm:read
       - presence
+    При data_usage=low (profile=low) payload урезается (chat/frames.trim_low).
+    unread_count остаётся всегда: без него клиент (NotificationBell) сам увеличивает бейдж.
     """
     OFFLINE_DELAY_SEC = 20
+    profile = frames.PROFILE_FULL
 
     async def connect(self):
         user = self.scope.get("user")
@@ -29,20 +32,10 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
             await self.close(code=4401)
             return
 
-        self.user_id: int = int(user.id)
-        self.user_group = f"user_{self.user_id}"
-        self._offline_task: Optional[asyncio.Task] = None
-
         try:
-            if self.channel_layer:
-                await self.channel_layer.group_add(self.user_group, self.channel_name)
+            self.profile = await _get_frame_profile(int(user.id))
             await self.accept()
-
-            # начальная мета-информация
-            unread_count = await _get_unread_count(self.user_id)
-            await self.send_json({"kind": "meta:init", "unread_count": unread_count})
-
-            await self._safe_set_presence(True)
+            await self.start_notifications(int(user.id))
         except Exception:
             try:
                 await self.close(code=1011)
@@ -50,13 +43,31 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
                 return
 
     async def disconnect(self, code):
+        await self.stop_notifications()
+
+    async def start_notifications(self, user_id: int):
+        """Подписка на user_<id>, meta:init и presence online (общее с chat.gateway.GatewayConsumer)."""
+        self.user_id: int = user_id
+        self.user_group = f"user_{self.user_id}"
+        self._offline_task: Optional[asyncio.Task] = None
+
+        if self.channel_layer:
+            await self.channel_layer.group_add(self.user_group, self.channel_name)
+
+        # начальная мета-информация
+        unread_count = await _get_unread_count(self.user_id)
+        await self.send_json({"kind": "meta:init", "unread_count": unread_count})
+
+        await self._safe_set_presence(True)
+
+    async def stop_notifications(self):
         try:
             if getattr(self, "user_group", None) and self.channel_layer:
                 await self.channel_layer.group_discard(self.user_group, self.channel_name)
         except Exception:
             pass
 
-        if getattr(self, "user_id", None):
+        if getattr(self, "user_group", None) and getattr(self, "user_id", None):
             self._offline_task = asyncio.create_task(self._delayed_offline_safe())
 
     # ===== group handlers (все приводим к единому формату) =====
@@ -85,8 +96,16 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
             "unread_count": unread_count,
             "payload": payload,
         }
+        if self.profile == frames.PROFILE_LOW:
+            message["payload"] = frames.trim_low(payload)
         await self.send_json(message)
 
+    async def send_json(self, content, close=False):
+        text = frames.encode_json(content)
+        kind = content.get("type") or content.get("kind") or "event"
+        await frames.arecord(f"notifications:{kind}", len(text.encode()), self.profile)
+        await self.send(text_data=text, close=close)
+
     # ===== internal safe wrappers =====
 
     async def _delayed_offline_safe(self):
@@ -125,46 +144,45 @@ class NotificationsConsumer(AsyncJsonWebsocketConsumer):
 
 
 # ===== DB helpers =====
+# async ORM: по одному запросу на помощник, без отдельного перехода в поток на каждый.
+# Соединение перед каждым обработчиком проверяет channels (aclose_old_connections, config/db.py).
 
-@sync_to_async
-def _update_user_activity(user_id: int):
-    try:
-        u = User.objects.only("id").get(pk=user_id)
-    except User.DoesNotExist:
-        return
+_HAS_LAST_ACTIVITY = any(f.attname == "last_activity" for f in User._meta.concrete_fields)
 
-    update = {}
-    if hasattr(u, "last_activity"):
-        update["last_activity"] = timezone.now()
-    if update:
-        User.objects.filter(pk=user_id).update(**update)
 
+async def _update_user_activity(user_id: int):
+    if not _HAS_LAST_ACTIVITY:
+        return
+    await User.objects.filter(pk=user_id).aupdate(last_activity=timezone.now())
 
-@sync_to_async
-def _can_broadcast_presence(user_id: int) -> bool:
+
+async def _can_broadcast_presence(user_id: int) -> bool:
     try:
         from users.models import UserSettings
-        s = UserSettings.objects.only("online_status").get(user_id=user_id)
-        return bool(s.online_status)
+        status = await UserSettings.objects.filter(user_id=user_id).values_list("online_status", flat=True).afirst()
     except Exception:
         return True
+    return True if status is None else bool(status)
 
 
-@sync_to_async
-def _get_friend_ids(user_id: int) -> list[int]:
+async def _get_friend_ids(user_id: int) -> list[int]:
     try:
-        from chat.models import Friendship
+        from chat.friend_graph import afriend_ids
+        return list(await afriend_ids(user_id))
     except Exception:
         return []
-    qs = Friendship.objects.filter(user1_id=user_id).values_list("user2_id", flat=True)
-    qs2 = Friendship.objects.filter(user2_id=user_id).values_list("user1_id", flat=True)
-    return list(qs) + list(qs2)
 
 
-@sync_to_async
-def _get_unread_count(user_id: int) -> int:
+async def _get_frame_profile(user_id: int) -> str:
+    try:
+        return await frames.aprofile_for_user(user_id)
+    except Exception:
+        return frames.PROFILE_FULL
+
+
+async def _get_unread_count(user_id: int) -> int:
     try:
         from notifications.models import Notification
-        return Notification.objects.filter(user_id=user_id, is_read=False).count()
+        return await Notification.objects.filter(user_id=user_id, is_read=False).acount()
     except Exception:
         return 0
@@ -19,6 +19,7 @@ from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from .models import Notification
 from .utils import notify_room_subscribers, create_and_notify
 
 log = logging.getLogger(__name__)
@@ -167,7 +168,7 @@ def _on_group_message_created(sender, instance, created, **kwargs):
     try:
         notify_room_subscribers(
             room_id=room_id,
-            type="group.new",
+            type=Notification.Types.GROUP_NEW,
             payload={"room_id": room_id, "preview": preview, "by": author_id},
             exclude_user_id=author_id,
             kind="group",
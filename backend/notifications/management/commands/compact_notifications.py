@@ -0,0 +1,44 @@
+# notifications/management/commands/compact_notifications.py
+"""
+Чистка таблицы уведомлений (notifications/retention.py). Запускать по cron, например раз в час.
+
+  python manage.py compact_notifications                     # свёртка group.new + оба вида удаления
+  python manage.py compact_notifications --read-days 30 --batch 5000
+  python manage.py compact_notifications --skip-compact --dry-run
+
+Порядок: свёртка повторов group.new, удаление по срокам типов (NOTIFICATION_RETENTION_DAYS),
+удаление прочитанных старше --read-days (NOTIFICATION_READ_RETENTION_DAYS).
+"""
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications import retention
+
+
+class Command(BaseCommand):
+    help = "Свернуть повторы group.new и удалить устаревшие уведомления пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--read-days", type=int, default=None)
+        parser.add_argument("--batch", type=int, default=1000)
+        parser.add_argument("--skip-compact", action="store_true")
+        parser.add_argument("--skip-purge", action="store_true")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        if opts["batch"] < 1:
+            raise CommandError("--batch должен быть > 0")
+        if opts["read_days"] is not None and opts["read_days"] < 0:
+            raise CommandError("--read-days не может быть отрицательным")
+        batch, dry_run = opts["batch"], opts["dry_run"]
+        verb = "would delete" if dry_run else "deleted"
+
+        if not opts["skip_compact"]:
+            n = retention.compact_group_new(batch=batch, dry_run=dry_run)
+            self.stdout.write(f"group.new compaction: {verb} {n}")
+        if not opts["skip_purge"]:
+            for type_, n in retention.purge_expired(batch=batch, dry_run=dry_run).items():
+                self.stdout.write(f"expired {type_}: {verb} {n}")
+            n = retention.purge_read(days=opts["read_days"], batch=batch, dry_run=dry_run)
+            self.stdout.write(f"read: {verb} {n}")
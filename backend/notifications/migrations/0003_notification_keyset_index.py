@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 23:53
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы строим/удаляем CONCURRENTLY, чтобы не блокировать запись уведомлений;
+    # (user, created_at, id) покрывает и прежний (user, created_at)
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0002_groupchatsubscription'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='notification',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='type',
+            field=models.CharField(choices=[('friend.request', 'Friend Request'), ('friend.accept', 'Friend Accept'), ('dm.badge', 'DM Badge'), ('dm.read', 'DM Read'), ('presence', 'Presence'), ('group.new', 'Group Message'), ('system', 'System')], max_length=32),
+        ),
+        AddIndexConcurrently(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='notificatio_user_id_b87bb1_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='notification',
+            name='notificatio_user_id_c62b26_idx',
+        ),
+    ]
@@ -13,6 +13,7 @@ class Notification(models.Model):
         DM_BADGE = "dm.badge"
         DM_READ = "dm.read"
         PRESENCE = "presence"
+        GROUP_NEW = "group.new"
         SYSTEM = "system"
 
         CHOICES = [
@@ -21,6 +22,7 @@ class Notification(models.Model):
             (DM_BADGE, "DM Badge"),
             (DM_READ, "DM Read"),
             (PRESENCE, "Presence"),
+            (GROUP_NEW, "Group Message"),
             (SYSTEM, "System"),
         ]
 
@@ -37,10 +39,11 @@ class Notification(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ["-created_at"]
+        ordering = ["-created_at", "-id"]
         indexes = [
             models.Index(fields=["user", "is_read", "created_at"]),
-            models.Index(fields=["user", "created_at"]),
+            # keyset-курсор списка (NotificationCursorPagination)
+            models.Index(fields=["user", "created_at", "id"]),
         ]
 
     def __str__(self):
@@ -0,0 +1,119 @@
+# notifications/retention.py
+"""
+Срок хранения уведомлений. Строки presence и group.new пишутся на каждое событие,
+и без чистки таблица растёт бесконечно.
+
+  - compact_group_new — повторы group.new одной комнаты у пользователя сворачиваются в самую
+    новую строку; payload["count"] — сколько событий она заменяет (с учётом count уже свёрнутых).
+    Прочитанные и непрочитанные сворачиваются отдельно, так что свёртка не «прочитывает» события.
+  - purge_expired — строки типов из NOTIFICATION_RETENTION_DAYS старше своего срока, прочитанные или нет.
+  - purge_read — прочитанные строки любых типов старше NOTIFICATION_READ_RETENTION_DAYS.
+
+Удаление — пачками по batch строк, каждая своей короткой транзакцией: в таблицу постоянно пишут,
+долгих блокировок быть не должно. Запуск — manage.py compact_notifications (по cron).
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.fields.json import KT
+from django.utils import timezone
+
+from .models import Notification
+
+DEFAULT_RETENTION_DAYS = {
+    Notification.Types.PRESENCE: 1,
+    Notification.Types.DM_READ: 7,
+    Notification.Types.GROUP_NEW: 30,
+}
+
+
+def retention_days() -> dict[str, int]:
+    return dict(getattr(settings, "NOTIFICATION_RETENTION_DAYS", DEFAULT_RETENTION_DAYS))
+
+
+def read_retention_days() -> int:
+    return int(getattr(settings, "NOTIFICATION_READ_RETENTION_DAYS", 90))
+
+
+def compact_group_new(*, batch: int = 1000, dry_run: bool = False) -> int:
+    """Свернуть повторы group.new; возвращает число удалённых (при dry_run — лишних) строк."""
+    groups = (
+        Notification.objects.filter(type=Notification.Types.GROUP_NEW, payload__has_key="room_id")
+        .annotate(room=KT("payload__room_id"))
+        .values("user_id", "room", "is_read")
+        .annotate(n=Count("id"), keep=Max("id"))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    removed = 0
+    for group in groups.iterator(chunk_size=batch):
+        if dry_run:
+            removed += group["n"] - 1
+        else:
+            removed += _collapse(group)
+    return removed
+
+
+def _collapse(group: dict) -> int:
+    rows = (
+        Notification.objects.filter(
+            user_id=group["user_id"], type=Notification.Types.GROUP_NEW,
+            is_read=group["is_read"], pk__lte=group["keep"],
+        )
+        .annotate(room=KT("payload__room_id"))
+        .filter(room=group["room"])
+    )
+    with transaction.atomic():
+        # строки группы блокируем: параллельный mark-read не должен разойтись со счётом
+        locked = list(rows.select_for_update().values_list("pk", "payload"))
+        if len(locked) < 2:
+            return 0  # пока шли к группе, её уже почистили
+        keep = max(pk for pk, _ in locked)
+        drop = [pk for pk, _ in locked if pk != keep]
+        payload = dict(next(p for pk, p in locked if pk == keep))
+        payload["count"] = sum(_count(p) for _, p in locked)
+        removed = Notification.objects.filter(pk__in=drop).delete()[0]
+        Notification.objects.filter(pk=keep).update(payload=payload)
+    return removed
+
+
+def _count(payload) -> int:
+    try:
+        return max(1, int(payload.get("count", 1)))
+    except (AttributeError, TypeError, ValueError):
+        return 1
+
+
+def purge_expired(*, batch: int = 1000, dry_run: bool = False, now=None) -> dict[str, int]:
+    """Удалить строки с истёкшим сроком по типам; {тип: сколько}."""
+    now = now or timezone.now()
+    result = {}
+    for type_, days in retention_days().items():
+        qs = Notification.objects.filter(type=type_, created_at__lt=now - timedelta(days=int(days)))
+        result[type_] = qs.count() if dry_run else _delete_in_batches(qs, batch)
+    return result
+
+
+def purge_read(*, days: Optional[int] = None, batch: int = 1000, dry_run: bool = False, now=None) -> int:
+    """Удалить прочитанные строки старше days (по умолчанию NOTIFICATION_READ_RETENTION_DAYS)."""
+    days = read_retention_days() if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    qs = Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+    return qs.count() if dry_run else _delete_in_batches(qs, batch)
+
+
+def _delete_in_batches(qs, batch: int) -> int:
+    # пачки по возрастанию pk: каждый следующий SELECT начинает с места, где закончил прошлый
+    total, last = 0, 0
+    while True:
+        ids = list(qs.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)[:batch])
+        if not ids:
+            return total
+        total += qs.filter(pk__in=ids).delete()[0]
+        last = ids[-1]
+
@@ -1,3 +1,5 @@
+import io
+
 from django.contrib.auth import get_user_model
 from rest_framework.test import APITestCase, APIClient
 
@@ -30,6 +32,7 @@ class NotificationApiTests(APITestCase):
         results = res.data.get("results", res.data)
         self.assertIsInstance(results, list)
         self.assertEqual(len(results), 3)
+        self.assertNotIn(n4.id, [r["id"] for r in results])
 
         # отметить два из них
         url_mark = "/api/notifications/mark-read/"
@@ -47,3 +50,97 @@ class NotificationApiTests(APITestCase):
         res4 = self.client.post(url_mark, {"all": True}, format="json")
         self.assertEqual(res4.status_code, 200)
         self.assertEqual(res4.data["unread_count"], 0)
+
+    def test_async_list_matches_drf(self):
+        from django.test import override_settings
+
+        for i in range(25):
+            Notification.objects.create(user=self.user, type=Notification.Types.SYSTEM, payload={"i": i})
+        first = self.client.get("/api/notifications/?is_read=false")
+        for url in ("/api/notifications/", first.json()["next"]):
+            fast = self.client.get(url)
+            with override_settings(ASYNC_LIST_VIEWS=False):
+                slow = self.client.get(url)
+            self.assertEqual(fast.json(), slow.json())
+        self.assertEqual(len(fast.json()["results"]), 5)
+        self.assertIsNone(fast.json()["next"])
+        self.assertEqual(self.client.get("/api/notifications/?cursor=bogus").status_code, 404)
+
+    def test_keyset_pages_with_equal_created_at(self):
+        from django.utils import timezone
+
+        same = timezone.now()
+        Notification.objects.bulk_create([
+            Notification(user=self.user, type=Notification.Types.SYSTEM, payload={"i": i}) for i in range(7)
+        ])
+        Notification.objects.filter(user=self.user).update(created_at=same)
+        expected = list(Notification.objects.filter(user=self.user).order_by("-id").values_list("id", flat=True))
+
+        seen, url, pages = [], "/api/notifications/?page_size=3", []
+        while url:
+            body = self.client.get(url).json()
+            pages.append(body)
+            seen += [row["id"] for row in body["results"]]
+            url = body["next"]
+        self.assertEqual(seen, expected)
+
+        # назад со второй страницы — ровно первая
+        back = self.client.get(pages[1]["previous"]).json()
+        self.assertEqual([row["id"] for row in back["results"]], expected[:3])
+        self.assertIsNone(back["previous"])
+
+
+class NotificationRetentionTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(email="keep@example.com", password="pass12345")
+
+    def _group_new(self, room_id, n, **extra):
+        return Notification.objects.bulk_create([
+            Notification(user=self.user, type=Notification.Types.GROUP_NEW,
+                         payload={"room_id": room_id, "preview": f"m{i}"}, **extra)
+            for i in range(n)
+        ])
+
+    def test_compact_group_new_per_room(self):
+        from .retention import compact_group_new
+
+        self._group_new(1, 4)
+        self._group_new(2, 1)
+        self._group_new(1, 2, is_read=True)
+
+        self.assertEqual(compact_group_new(dry_run=True), 4)
+        self.assertEqual(compact_group_new(), 4)
+
+        rows = Notification.objects.filter(user=self.user).order_by("payload__room_id", "is_read")
+        self.assertEqual(
+            [(r.payload["room_id"], r.is_read, r.payload.get("count")) for r in rows],
+            [(1, False, 4), (1, True, 2), (2, False, None)],
+        )
+        self.assertEqual(rows[0].payload["preview"], "m3")  # осталась самая новая строка
+
+        self._group_new(1, 2)
+        compact_group_new()
+        unread = Notification.objects.get(user=self.user, is_read=False, payload__room_id=1)
+        self.assertEqual(unread.payload["count"], 6)
+
+    def test_purge_by_type_and_read_age(self):
+        from datetime import timedelta
+
+        from django.core.management import call_command
+        from django.test import override_settings
+        from django.utils import timezone
+
+        old = timezone.now() - timedelta(days=10)
+        presence = Notification.objects.create(user=self.user, type=Notification.Types.PRESENCE)
+        old_read = Notification.objects.create(user=self.user, type=Notification.Types.SYSTEM, is_read=True)
+        old_unread = Notification.objects.create(user=self.user, type=Notification.Types.SYSTEM)
+        fresh = Notification.objects.create(user=self.user, type=Notification.Types.PRESENCE)
+        Notification.objects.filter(pk__in=[presence.pk, old_read.pk, old_unread.pk]).update(created_at=old)
+
+        with override_settings(NOTIFICATION_RETENTION_DAYS={"presence": 1}):
+            call_command("compact_notifications", "--read-days", "5", "--batch", "1", stdout=io.StringIO())
+        self.assertEqual(
+            set(Notification.objects.filter(user=self.user).values_list("pk", flat=True)),
+            {old_unread.pk, fresh.pk},
+        )
@@ -6,12 +6,15 @@ from .views import (
     group_chat_subscribe,
     group_chat_unsubscribe,
     group_chat_mute,
+    notification_list,
 )
 
 router = DefaultRouter()
 router.register("notifications", NotificationViewSet, basename="notifications")
 
 urlpatterns = [
+    # GET-список — async (config/async_api.py), остальное — роутер
+    path("api/notifications/", notification_list, name="notifications-list-async"),
     path("api/", include(router.urls)),
 
     # Group chat subscription endpoints:
@@ -4,7 +4,8 @@ from __future__ import annotations
 import asyncio
 from typing import List, Optional
 
-from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from .models import Notification, GroupChatSubscription
 
@@ -115,7 +116,7 @@ async def a_notify_user_if_allowed(user_id: int, *, kind: str, type: str, **payl
     await a_notify_user(user_id, type=type, **payload)
 
 
-@sync_to_async
+@database_sync_to_async
 def _a_is_push_allowed(user_id: int, *, kind: str) -> bool:
     # Реиспользуем синхронную проверку в отдельном треде
     return _is_push_allowed_sync(user_id, kind=kind)
@@ -1,20 +1,104 @@
+from typing import Optional
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
 from rest_framework import status
 
+from config.async_api import async_list, json_response
+from config.replicas import replica_reads
+
 from .models import Notification, GroupChatSubscription
 from .serializers import NotificationSerializer, GroupChatSubscriptionSerializer
 
 
 # ====== Notification API (list + mark-read) ======
 
-class NotificationPagination(PageNumberPagination):
+class NotificationCursorPagination(CursorPagination):
+    """
+    Keyset по (created_at, id) в пределах пользователя — индекс (user, created_at, id), без OFFSET:
+    глубокая страница стоит столько же, сколько первая. Позиция курсора — «created_at|id».
+    """
     page_size = 20
     page_size_query_param = "page_size"
     max_page_size = 100
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self._window(queryset, request, view)
+        return self._finish(list(queryset[:self.page_size + 1]))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset для async-списка: та же страница, читается async ORM."""
+        queryset = self._window(queryset, request, view)
+        return self._finish([obj async for obj in queryset[:self.page_size + 1]])
+
+    def _window(self, queryset, request, view):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        self.current_position = self.cursor.position if self.cursor else None
+        reverse = bool(self.cursor and self.cursor.reverse)
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if self.current_position is None:
+            return queryset
+        created_at, pk = self._parse_position(self.current_position)
+        # лишнее условие по created_at — граница для индекса: одно OR Postgres в Index Cond не возьмёт
+        if reverse:
+            return queryset.filter(Q(created_at__gt=created_at) | Q(id__gt=pk), created_at__gte=created_at)
+        return queryset.filter(Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at)
+
+    def _finish(self, results):
+        more = len(results) > self.page_size
+        page = results[:self.page_size]
+        reverse = bool(self.cursor and self.cursor.reverse)
+        if reverse:
+            page.reverse()
+        started = self.current_position is not None
+        self.has_next, self.has_previous = (started, more) if reverse else (more, started)
+        # строгий keyset: next — после последней показанной строки, previous — до первой
+        self.next_position = self._get_position_from_instance(page[-1], self.ordering) if page else self.current_position
+        self.previous_position = self._get_position_from_instance(page[0], self.ordering) if page else self.current_position
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        return f"{instance.created_at.isoformat()}|{instance.pk}"
+
+    def _parse_position(self, position: str):
+        created_at, _, pk = position.rpartition("|")
+        created_at = parse_datetime(created_at) if created_at else None
+        if created_at is None or not pk.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, int(pk)
+
+
+def notifications_for(user, is_read: Optional[str] = None):
+    qs = Notification.objects.filter(user=user)
+    if is_read is not None:
+        val = is_read.lower()
+        if val in ("1", "true", "yes"):
+            qs = qs.filter(is_read=True)
+        elif val in ("0", "false", "no"):
+            qs = qs.filter(is_read=False)
+    return qs
 
 
 class NotificationViewSet(ReadOnlyModelViewSet):
@@ -23,18 +107,14 @@ class NotificationViewSet(ReadOnlyModelViewSet):
     """
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
-    pagination_class = NotificationPagination
+    pagination_class = NotificationCursorPagination
 
     def get_queryset(self):
-        qs = Notification.objects.filter(user=self.request.user)
-        is_read = self.request.query_params.get("is_read")
-        if is_read is not None:
-            val = is_read.lower()
-            if val in ("1", "true", "yes"):
-                qs = qs.filter(is_read=True)
-            elif val in ("0", "false", "no"):
-                qs = qs.filter(is_read=False)
-        return qs
+        return notifications_for(self.request.user, self.request.query_params.get("is_read"))
+
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     @action(detail=False, methods=["post"], url_path="mark-read")
     def mark_read(self, request, *args, **kwargs):
@@ -54,6 +134,23 @@ class NotificationViewSet(ReadOnlyModelViewSet):
         return Response({"updated": updated, "unread_count": unread_count})
 
 
+@async_list(NotificationViewSet.as_view({"get": "list"}))
+@replica_reads
+async def notification_list(request):
+    """GET /api/notifications/ в event loop (config/async_api.py)."""
+    if not request.user.is_authenticated:
+        return None
+    paginator = NotificationCursorPagination()
+    try:
+        page = await paginator.apaginate_queryset(
+            notifications_for(request.user, request.query_params.get("is_read")), request,
+        )
+    except NotFound:
+        return None  # битый курсор — 404 отдаст DRF-представление
+    data = NotificationSerializer(page, many=True).data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
 # ====== Group Chat Subscriptions: subscribe/unsubscribe/mute/status ======
 
 @api_view(["GET"])
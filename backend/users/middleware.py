@@ -15,6 +15,7 @@ from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
 
 User = get_user_model()
@@ -66,33 +67,50 @@ class LastActivityMiddleware:
     Обновляет поле user.last_activity не чаще, чем раз в UPDATE_INTERVAL секунд.
     ДОЛЖЕН стоять ПОСЛЕ AuthenticationMiddleware в settings.MIDDLEWARE.
     Работает безопасно: если у модели пользователя нет поля last_activity — ничего не делает.
+    Умеет и sync, и async: под ASGI не заставляет Django уводить async-представления в поток.
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         self._maybe_touch_last_activity(request)
         return self.get_response(request)
 
+    async def __acall__(self, request):
+        await self._amaybe_touch_last_activity(request)
+        return await self.get_response(request)
+
+    @staticmethod
+    def _has_field(UserModel) -> bool:
+        try:
+            UserModel._meta.get_field("last_activity")
+        except Exception:
+            return False
+        return True
+
     def _maybe_touch_last_activity(self, request):
         user = getattr(request, "user", None)
         if not user or not user.is_authenticated:
             return
 
-        # Троттлим обращение к БД через кэш (чтобы не писать на каждый запрос)
-        cache_key = f"last_activity_update:{user.pk}"
-        if cache.get(cache_key):
-            return
-
         # Проверяем наличие поля у модели
         UserModel = type(user)
-        try:
-            UserModel._meta.get_field("last_activity")
-        except Exception:
+        if not self._has_field(UserModel):
             # Поля нет — тихо выходим
             return
 
+        # Троттлим обращение к БД через кэш (чтобы не писать на каждый запрос)
+        cache_key = f"last_activity_update:{user.pk}"
+        if cache.get(cache_key):
+            return
+
         try:
             # Обновляем атомарно без загрузки всей модели
             UserModel.objects.filter(pk=user.pk).update(last_activity=timezone.now())
@@ -100,3 +118,19 @@ class LastActivityMiddleware:
         except Exception:
             # Никогда не роняем запрос из-за технических ошибок
             return
+
+    async def _amaybe_touch_last_activity(self, request):
+        # поля нет — не трогаем даже сессию (request.auser() — запрос в БД)
+        if not self._has_field(User):
+            return
+        try:
+            user = await request.auser()
+            if not user or not user.is_authenticated:
+                return
+            cache_key = f"last_activity_update:{user.pk}"
+            if await cache.aget(cache_key):
+                return
+            await User.objects.filter(pk=user.pk).aupdate(last_activity=timezone.now())
+            await cache.aset(cache_key, True, UPDATE_INTERVAL)
+        except Exception:
+            return
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 22:16
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # GIN-индекс строим CONCURRENTLY, чтобы не блокировать users_user
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0010_usersettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('nickname', 'email', 'first_name', 'last_name', config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='users_user_search_gin'),
+        ),
+    ]
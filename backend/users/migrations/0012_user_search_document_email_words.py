@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы строим/удаляем CONCURRENTLY; генерируемую колонку Django менять не умеет —
+    # пересоздаём (AddField переписывает users_user под ACCESS EXCLUSIVE, как и 0011)
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0011_user_search_document'),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name='user',
+            name='users_user_search_gin',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='search_document',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('nickname', 'email', models.Func(models.F('email'), models.Value('[^[:alnum:]]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), 'first_name', 'last_name', config='simple'), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='users_user_search_gin'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('email'), name='text_pattern_ops'), name='users_user_email_like'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('nickname'), name='text_pattern_ops'), name='users_user_nickname_like'),
+        ),
+    ]
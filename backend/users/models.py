@@ -1,6 +1,9 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
-from django.db.models import JSONField
+from django.db.models import F, Func, JSONField, Value
+from django.db.models.functions import Lower
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
@@ -51,11 +54,31 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
 
+    # Нормализованный документ для поиска пользователей (префиксный поиск по словам, см. chat/search.py).
+    # Парсер 'simple' держит e-mail одной лексемой — слова адреса (john, smith, example) добавляем отдельно.
+    search_document = models.GeneratedField(
+        expression=SearchVector(
+            'nickname', 'email',
+            Func(F('email'), Value('[^[:alnum:]]+'), Value(' '), Value('g'), function='regexp_replace'),
+            'first_name', 'last_name', config='simple',
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_document'], name='users_user_search_gin'),
+            # префикс почты/ника с пунктуацией ("john.smith@exa") — LIKE 'q%' по btree
+            models.Index(OpClass(Lower('email'), name='text_pattern_ops'), name='users_user_email_like'),
+            models.Index(OpClass(Lower('nickname'), name='text_pattern_ops'), name='users_user_nickname_like'),
+        ]
+
     def __str__(self):
         return self.email
 
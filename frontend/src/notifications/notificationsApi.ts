@@ -33,8 +33,11 @@ async function apiFetch(path: string, init?: RequestInit) {
 }
 
 export const notificationsApi = {
-  async listUnread(page: number = 1, pageSize: number = 20) {
-    return apiFetch(`/notifications/?is_read=false&page=${page}&page_size=${pageSize}`);
+  // Курсорная пагинация: следующая страница — по ссылке `next` из ответа
+  async listUnread(cursor: string | null = null, pageSize: number = 20) {
+    const params = new URLSearchParams({ is_read: "false", page_size: String(pageSize) });
+    if (cursor) params.set("cursor", cursor);
+    return apiFetch(`/notifications/?${params.toString()}`);
   },
   async markAllRead() {
     return apiFetch(`/notifications/mark-read/`, {